@@ -25,10 +25,19 @@ from SAUSERO.reduction_osirisplus import *
 from SAUSERO.aligning_osirisplus import *
 from SAUSERO.astrometry_osirisplus import *
 from SAUSERO.photometry_osirisplus import *
+from SAUSERO.writer_osirisplus import WriteError, configure_writer, get_writer
+from SAUSERO.sources_osirisplus import configure_sources
+from SAUSERO.library_osirisplus import CalibrationLibrary
+from SAUSERO.headers_osirisplus import HeaderCollection
+from SAUSERO.stages_osirisplus import Stage, StageGraph
+from SAUSERO.watch_osirisplus import NightWatcher
+
+from astropy.time import Time
 
 from astropy import units as u
 
-import argparse, time, os, shutil, re
+import argparse, time, os, shutil, re, copy
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os, json, warnings
 import pkg_resources
 from pathlib import Path
@@ -61,6 +70,41 @@ def readJSON():
     """
     return json.load(open(Path(os.getcwd())/'configuration.json'))
 
+
+def invalidate_library(kind, start=None, end=None, where=None):
+    """
+    This function removes from the calibration library the masters of a kind 
+    taken between two dates (e.g. after an intervention on the instrument) and/or
+    created with some parameters (e.g. an old instrument configuration).
+
+    Args:
+        kind (str): Type of master (bias, flat, fringe or all).
+        start (str, optional): First date (ISO format, e.g. 2025-01-01). Defaults to None.
+        end (str, optional): Last date (ISO format). Defaults to None.
+        where (list, optional): Conditions KEY=VALUE on the parameters of the masters
+        (e.g. method=median or config.FILTER4=OPEN). The values are read as JSON
+        when possible, otherwise as strings. Defaults to None.
+    """
+    library = CalibrationLibrary.from_config(readJSON())
+    if library is None:
+        print(f"{bcl.WARNING}The calibration library is not enabled in the configuration file.{bcl.ENDC}")
+        sys.exit()
+    params = {}
+    for condition in where or []:
+        if '=' not in condition:
+            print(f"{bcl.FAIL}Wrong condition {condition}: use KEY=VALUE.{bcl.ENDC}")
+            sys.exit()
+        key, value = condition.split('=', 1)
+        try:
+            params[key] = json.loads(value)
+        except json.JSONDecodeError:
+            params[key] = value
+    removed = library.invalidate(kind=None if kind == 'all' else kind,
+                                 mjd_min=None if start is None else Time(start).mjd,
+                                 mjd_max=None if end is None else Time(end).mjd, params=params or None)
+    print(f"{bcl.OKGREEN}{removed} masters removed from the calibration library.{bcl.ENDC}")
+    sys.exit()
+
     
 
 def Results(PATH, ZP, eZP, MASK, filt, ext_info = extinction_dict, conf = None):
@@ -75,13 +119,17 @@ def Results(PATH, ZP, eZP, MASK, filt, ext_info = extinction_dict, conf = None):
         eZP (float):  The error of the instrumental magnitude.
         MASK (bool): Mask of bad pixels.
         filt (string): Filter used for the image acquisition.
+
+    Returns:
+        list: Paths to the final images.
     """
-    ic = ccdp.ImageFileCollection(PATH, keywords='*', glob_include='*ast*')
+    products = []
+    ic = HeaderCollection(PATH, keywords='*', glob_include='*ast*')
     try:
         if len(ic.files) == 0:
-            ic = ccdp.ImageFileCollection(PATH, keywords='*', glob_include='*stacked*')
+            ic = HeaderCollection(PATH, keywords='*', glob_include='*stacked*')
         else:
-            ic = ccdp.ImageFileCollection(PATH, keywords='*', glob_include='*ADP*')
+            ic = HeaderCollection(PATH, keywords='*', glob_include='*ADP*')
     except:
         logger.error(f'{bcl.ERROR}No science images found for photometry results{bcl.ENDC}')
     
@@ -104,174 +152,248 @@ def Results(PATH, ZP, eZP, MASK, filt, ext_info = extinction_dict, conf = None):
             logger.info('Change units: ADUs to ADUs/second')
 
             frame.data = (frame.data / hd['EXPTIME'])
-            frame.write(PATH / f"{hd['GTCPRGID']}_{hd['GTCOBID']}_{filt}_pho_{sky}.fits",
-                        overwrite=True)
+            products.append(PATH / f"{hd['GTCPRGID']}_{hd['GTCOBID']}_{filt}_pho_{sky}.fits")
+            get_writer().write_ccd('results', frame, products[-1])
             logger.info(f"{bcl.OKGREEN}Frame generated: {hd['GTCPRGID']}_{hd['GTCOBID']}_{filt}_pho_{sky}.fits{bcl.ENDC}")
         else:
             logger.warning(f'{bcl.WARNING}The photometry is not going to be executed for NOSKY{bcl.ENDC}')
+    return products
     
 
-def run():
-    """
-    This function 
-    """
-    # Parse configuration
-    parser = argparse.ArgumentParser(
-                         prog = 'OsirisDRP',
-                         description = 'This software reduces observations taken with OSIRIS\
-                            in BBI mode. It can process any filter configuration and is suitable\
-                            for observations affected by fringing (Sloan_z).')
+def setup_reduction(conf, bpm_path):
+    """Creates the Reduction object of the OB and sorts its frames by type and filter.
 
-    parser.add_argument('-e', '--execute', help='Execute the configuration file in the current directory.',
-                        action='store_true')
-    
-    parser.add_argument('-c', '--create_config', help='Create a configuration file in the current directory.',
-                        action='store_true')
+    Args:
+        conf (dict): Collection of configuration parameters.
+        bpm_path (str): Path to the BPM.
 
-    args = parser.parse_args()
+    Returns:
+        Reduction: The object ready to reduce the frames.
+    """
+    o = Reduction(main_path=conf['DIRECTORIES']['PATH_DATA'],
+                path_mask=bpm_path, conf=conf)
+    o.get_imagetypes()
+    o.load_BPM()
+    o.sort_down_drawer()
+    return o
 
 
-    print(f"{bcl.OKBLUE}***********************************************************************{bcl.ENDC}")
-    print(f"{bcl.OKBLUE}************************* WELCOME TO SAUSERO **************************{bcl.ENDC}")
-    print(f"{bcl.OKBLUE}***********************************************************************{bcl.ENDC}")
-    print("\n")
-    print(f"{bcl.BOLD}---------------------- LICENSE ----------------------{bcl.ENDC}")
-    print("\n")
-    print(f"This program is free software: you can redistribute it and/or modify\n\
-it under the terms of the GNU General Public License as published by\n\
-the Free Software Foundation, either version 3 of the License, or\n\
-(at your option) any later version.\n\n\
-This program is distributed in the hope that it will be useful,\n\
-but WITHOUT ANY WARRANTY; without even the implied warranty of\n\
-MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the\n\
-GNU General Public License for more details.\n\n\
-You should have received a copy of the GNU General Public License\n\
-along with this program. If not, see <https://www.gnu.org/licenses/>.")
-    print("\n")
-    print(f"{bcl.BOLD}************************ IMPORTANT INFORMATION ************************{bcl.ENDC}")
-    print("\n")
-    print(f"This software is designed to reduce Broad Band Imaging observations obtained with OSIRIS+.\n\
-For proper use, you need to modify the configuration file, which can be found\n\
-in the directory where this software is installed. Additionally, you need to create\n\
-an account on Astrometry.net. Once you have the code that allows you to use the API,\n\
-you need to fill in the correct variable.")
-    print(f"\n")
 
-    # Check if the configuration file exists (2025-08-04)
-    if args.create_config:
-        print(f"{bcl.OKGREEN}Creating the configuration file in the current directory.{bcl.ENDC}")
-        print(f"{bcl.WARNING}You can edit it before you execute the reduction.{bcl.ENDC}")
-        create_config_file_home()
-        sys.exit()
+def reduce_frames(conf, bpm_path):
+    """Cleans the frames of the OB: masterbias, masterflat, STD and science frames, 
+    fringing and sky subtraction. The frames are kept in memory (they are saved later).
 
-    ########## Checking files (2025-01-22) ##########
-    conf = check_files()
+    Args:
+        conf (dict): Collection of configuration parameters.
+        bpm_path (str): Path to the BPM.
 
-    PRG = conf['PRG']
-    OB = conf['OB']
+    Returns:
+        Reduction: The object with the reduced frames.
+    """
+    o = setup_reduction(conf, bpm_path)
+    stage_masterbias(conf, o)
+    if conf['REDUCTION']['use_FLAT']:
+        o.do_masterflat()
+    else:
+        logger.warning(f'{bcl.WARNING}The masterflat is not going to be created{bcl.ENDC}')
+    stage_clean(conf, o)
+    stage_cr(conf, o)
+    stage_fringe(conf, o)
+    stage_sky(conf, o)
+    return o
 
-    hora_local = time.localtime()
-    print(conf)
-    logger.add(Path(conf['DIRECTORIES']['PATH'])/f"sausero_{time.strftime('%Y-%m-%d_%H:%M:%S', hora_local)}.log", format="{time} {level} {message} ({module}:{line})", level="INFO",
-            filter=lambda record: 'astropy' not in record["name"])
-        
-    logger.info(f'{bcl.OKGREEN}Log file created{bcl.ENDC}')
-    logger.info(f'{bcl.OKGREEN}Configuration has been updated successfully{bcl.ENDC}')
-    logger.info(f'{bcl.OKGREEN}Read the configuration file successfully{bcl.ENDC}')
-    
-    #Reduction Recipe. This recipe is responsible for cleaning the images by subtracting 
-    #the masterbias and dividing by the normalized masterflat.
-    #Subsequently, the cleaned images are saved.
-    logger.info(f'{bcl.OKBLUE}---------- Starting the reduction for {PRG}-{OB} ----------{bcl.ENDC}')
-    
-    bpm_path = pkg_resources.resource_filename('SAUSERO', 'BPM/BPM_OSIRIS_PLUS.fits')
-    o = Reduction(main_path=conf['DIRECTORIES']['PATH_DATA'],
-                path_mask=bpm_path)
-    o.get_imagetypes()
-    o.load_BPM()
-    o.sort_down_drawer()
 
+############## Stages of the pipeline #############
+# Each stage returns the frames it has produced (the checkpoint of StageGraph) or 
+# None if it has not changed the frames of the stages it depends on.
+
+def stage_masterbias(conf, o):
+    """Creates the masterbias."""
     if conf['REDUCTION']['use_BIAS']:
         o.do_masterbias()
+        return {'bias': o.master_dict['bias'], 'key': o.masterbias_key}
+    logger.warning(f'{bcl.WARNING}The masterbias is not going to be created{bcl.ENDC}')
+    return {}
 
-    else:
-        logger.warning(f'{bcl.WARNING}The masterbias is not going to be created{bcl.ENDC}')
 
+def restore_masterbias(o, state):
+    if 'bias' in state:
+        o.masterbias = o.master_dict['bias'] = state['bias']
+        o.masterbias_key = state['key']
+
+
+def stage_masterflat(conf, o, filt):
+    """Creates the masterflat of a filter."""
     if conf['REDUCTION']['use_FLAT']:
-        o.do_masterflat()
+        o.master_dict[filt] = o.filter_masterflat(filt)
+        return {filt: o.master_dict[filt]}
+    logger.warning(f'{bcl.WARNING}The masterflat is not going to be created for {filt}{bcl.ENDC}')
+    return {}
 
-    else:
-        logger.warning(f'{bcl.WARNING}The masterflat is not going to be created{bcl.ENDC}')
-    
-    if conf['REDUCTION']['use_STD']:
-        o.get_std(no_CRs=conf['REDUCTION']['no_CRs'], contrast_arg = conf['REDUCTION']['contrast'],
-            cr_threshold_arg = conf['REDUCTION']['cr_threshold'],
-            neighbor_threshold_arg = conf['REDUCTION']['neighbor_threshold'], apply_flat=conf['REDUCTION']['use_FLAT'])
 
+def stage_clean(conf, o):
+    """Calibrates (masterbias and masterflat) the STD and science frames."""
+    if conf['REDUCTION']['use_STD']:
+        o.calibrate_std(apply_flat=conf['REDUCTION']['use_FLAT'])
     else:
         logger.warning(f'{bcl.WARNING}The STD star is not going to be reduced{bcl.ENDC}')
-    
-    o.get_target(no_CRs=conf['REDUCTION']['no_CRs'], contrast_arg = conf['REDUCTION']['contrast'],
-            cr_threshold_arg = conf['REDUCTION']['cr_threshold'],
-            neighbor_threshold_arg = conf['REDUCTION']['neighbor_threshold'], apply_flat=conf['REDUCTION']['use_FLAT'])
-    
-    
+    o.calibrate_science(apply_flat=conf['REDUCTION']['use_FLAT'])
+    return frames_state(o, ('std+', 'target+'))
+
+
+def stage_cr(conf, o):
+    """Removes the cosmic rays of the STD and science frames."""
+    R = conf['REDUCTION']
+    params = dict(no_CRs=R['no_CRs'], contrast_arg=R['contrast'], cr_threshold_arg=R['cr_threshold'],
+                  neighbor_threshold_arg=R['neighbor_threshold'])
+    if R['use_STD']:
+        o.remove_crs('std', **params)
+    o.remove_crs('target', **params)
+    return frames_state(o, ('std+', 'target+')) if R['no_CRs'] else None
+
+
+def stage_fringe(conf, o):
+    """Removes the fringe of the Sloan_z frames."""
     if conf['REDUCTION']['save_fringing']:
         o.remove_fringing()
         logger.info(f'{bcl.OKGREEN}Fringing correction applied successfully{bcl.ENDC}')
-    else:
-        logger.warning(f'{bcl.WARNING}The fringing correction is not going to be executed{bcl.ENDC}')
+        return frames_state(o, ('fringe+',))
+    logger.warning(f'{bcl.WARNING}The fringing correction is not going to be executed{bcl.ENDC}')
+    return None
 
-    if conf['REDUCTION']['save_not_sky']:    
+
+def stage_sky(conf, o):
+    """Subtracts the sky background of the science frames."""
+    if conf['REDUCTION']['save_not_sky']:
         o.sustract_sky()
         logger.info(f'{bcl.OKGREEN}The sky subtraction has been applied successfully{bcl.ENDC}')
-    else:
-        logger.warning(f'{bcl.WARNING}The sky substraction is not going to be executed{bcl.ENDC}')
+        return frames_state(o, ('sky+',))
+    logger.warning(f'{bcl.WARNING}The sky substraction is not going to be executed{bcl.ENDC}')
+    return None
+
+
+def frames_state(o, prefixes):
+    """Frames of the STD and science dictionaries whose keys start with some prefixes."""
+    state = {}
+    for name, data_dict in [('std', o.std_dict), ('target', o.target_dict)]:
+        for key, frames in data_dict.items():
+            if key.startswith(prefixes):
+                state[f'{name}:{key}'] = frames
+    return state
+
+
+def restore_frames(o, state):
+    """Puts back the frames saved by frames_state."""
+    for entry, frames in state.items():
+        name, key = entry.split(':', 1)
+        (o.std_dict if name == 'std' else o.target_dict)[key] = frames
+
+
+def product_name(fname):
+    """Name of a reduced frame (ADP file) without its filter (see rename_products)."""
+    fname = re.sub(r"_(Sloan)_[a-zA-Z]+", "", fname)
+    if 'OPEN' in os.path.basename(fname):
+        fname = re.sub(r"_(OPEN)_+", "", fname)
+    return fname
+
+
+def rename_products(conf, files=()):
+    """Removes the filter from the names of the reduced frames (ADP files).
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+        files (list, optional): Paths to the frames just saved. Defaults to ().
+
+    Returns:
+        list: The new paths of those frames.
+    """
+    path = Path(conf['DIRECTORIES']['PATH_OUTPUT'])
+    if not (conf['REDUCTION']['save_sky'] or conf['REDUCTION']['save_not_sky']):
+        return [str(fname) for fname in files]
+    for archivo in glob.glob(str(path/"ADP*.fits")):
+        nuevo_nombre = re.sub(r"_(Sloan)_[a-zA-Z]+", "", archivo)
+        os.rename(archivo, nuevo_nombre)
+
+    try:
+        for archivo in glob.glob(str(path/"ADP*OPEN*.fits")):
+            nuevo_nombre = re.sub(r"_(OPEN)_+", "", archivo)
+            os.rename(archivo, nuevo_nombre)
+    except:
+        logger.info(f'No OPEN filter')
+    return [product_name(str(fname)) for fname in files]
+
+
+def stage_save(conf, o, bpm_path, products=None):
+    """Saves the reduced frames (their paths are added to products)."""
+    # Validation mode: the reduction is repeated in float64 and the differences are reported.
+    if conf.get('PRECISION', {}).get('validate', False) and o.dtype.name != 'float64':
+        ref_conf = {**conf, 'PRECISION': {**conf['PRECISION'], 'dtype': 'float64'}}
+        o.validate_precision(reduce_frames(ref_conf, bpm_path))
     
-    o.save_target(std=conf['REDUCTION']['save_std'])
-    o.save_target(std=conf['REDUCTION']['save_std'], fringing=conf['REDUCTION']['save_fringing'])
-    o.save_target(sky=conf['REDUCTION']['save_sky'])
-    o.save_target(fringing=conf['REDUCTION']['save_fringing'])    
-    o.save_target(not_sky=conf['REDUCTION']['save_not_sky'])
+    saved = o.save_target(std=conf['REDUCTION']['save_std'])
+    saved += o.save_target(std=conf['REDUCTION']['save_std'], fringing=conf['REDUCTION']['save_fringing'])
+    saved += o.save_target(sky=conf['REDUCTION']['save_sky'])
+    saved += o.save_target(fringing=conf['REDUCTION']['save_fringing'])    
+    saved += o.save_target(not_sky=conf['REDUCTION']['save_not_sky'])
+    get_writer().flush('reduction')
+    # The names of the products are final from here (the later stages read them by their headers).
+    saved = rename_products(conf, saved)
+    if products is not None:
+        products.extend(saved)
     logger.info(f'{bcl.OKBLUE}-------------- End of the reduction successfully --------------{bcl.ENDC}')
     print(2*"\n")
 
-#-----------------------------------------------------------------------------------------------------------------------------------    
+
+def stage_align(conf, force=False, products=None):
+    """Aligns and stacks the science frames of each filter (with force, the saved
+    stacks are not extended). The paths of the stacks are added to products."""
+    products = [] if products is None else products
     #Aligned Recipe. The cleaned science images are aligned based on the filter used in each case. 
     #Then, they are saved as aligned images.
+    PRG, OB = conf['PRG'], conf['OB']
     if conf['ALIGNING']['use_aligning']:
         logger.info(f"{bcl.OKBLUE}---------- Starting the alignment ----------{bcl.ENDC}")
-        al = OsirisAlign(conf)
-        for filt in list(set(al.ic.summary['filtro'])):
+        al = OsirisAlign(conf, force=force)
+        for filt in al.filters():
             for sky in ['SKY', 'NOSKY']:
                 if conf['REDUCTION']['save_not_sky'] or sky == 'SKY':
                     logger.info(f'{bcl.OKCYAN}++++++++++ Aligment for {filt} & {sky} ++++++++++{bcl.ENDC}')
-                    align = al.aligning(filt, sky=sky)
-                    lst = al.load_frames(filt, sky=sky)
-                    fr = CCDData.read(lst[0], unit='adu')
-                    header = fr.header
+                    stack = al.aligning(filt, sky=sky)
+                    if stack is None:
+                        continue
+                    header = stack.header
                     header['STACKED'] = (True, 'Stacked image')
-                    header['exptime'] = al.total_exptime * al.num #(al.num + 1.)
-                    logger.info(f"Estimated total exposure time: {header['exptime']} sec")
-                    wcs = fr.wcs
+                    header['exptime'] = stack.exptime
+                    logger.info(f"Total exposure time: {header['exptime']} sec")
                     logger.info(f"Updating the WCS information")
-                    save_fits(align, header, wcs, str(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_{sky}.fits'))
+                    products.append(str(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_{sky}.fits'))
+                    save_fits(stack.data, header, stack.wcs, products[-1])
+                    if conf['ALIGNING'].get('save_expmap', False):
+                        products.append(str(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_expmap_{sky}.fits'))
+                        save_exposure_map(stack.exposure, stack.weight, header, stack.wcs, products[-1])
                     
                 else:
                     logger.warning(f'{bcl.WARNING}Alignment is not going to be executed for NOSKY{bcl.ENDC}')
 
+        get_writer().flush('aligning')
         logger.info(f'{bcl.OKBLUE}------------------- End of the alignment -------------------{bcl.ENDC}')
         print(2*"\n")
     else:
         logger.warning(f'{bcl.WARNING}The alignment is not going to be executed{bcl.ENDC}')
 
-#-----------------------------------------------------------------------------------------------------------------------------------
-     #Astrometry Recipe. The aligned image for each filter undergoes an astrometric process to 
-     #accurately determine the real positions of the celestial bodies present in the scene.
+
+def stage_astrometry(conf, products=None):
+    """Solves the astrometry of the stacked images and of the STD frames. The paths
+    of the astrometrized images are added to products."""
+    products = [] if products is None else products
+    #Astrometry Recipe. The aligned image for each filter undergoes an astrometric process to 
+    #accurately determine the real positions of the celestial bodies present in the scene.
+    PRG, OB = conf['PRG'], conf['OB']
+    PATH_REDUCED = Path(conf['DIRECTORIES']['PATH_OUTPUT'])
+    filt = None
     if conf['ASTROMETRY']['use_astrometry']:
         logger.info(f"{bcl.OKBLUE}---------- Start the astrometrization ----------{bcl.ENDC}")
-        del filt
-        ic_ast = ccdp.ImageFileCollection(al.PATH_REDUCED, keywords='*', glob_include='*stacked*', glob_exclude='*NOSKY*')
+        ic_ast = HeaderCollection(PATH_REDUCED, keywords='*', glob_include='*stacked*', glob_exclude='*NOSKY*')
         lst_filt = list(ic_ast.summary['filtro'])
         for filt in lst_filt:
             logger.info(f'{bcl.OKCYAN}++++++++++ Astrometrization for the stacked image with {filt} filter ++++++++++{bcl.ENDC}')
@@ -279,31 +401,35 @@ you need to fill in the correct variable.")
                 best_wcs, new_frame = solving_astrometry(PRG, OB, filt, conf, sky='SKY', calib_std=False)
                 logger.info(f'{bcl.OKGREEN}New WCS for the stacked image with {filt} filter.{bcl.ENDC}')
             except:
-                new_frame = CCDData.read(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_SKY.fits', unit='adu')
+                new_frame = CCDData.read(PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_SKY.fits', unit='adu')
                 best_wcs = None
                 logger.error(f'{bcl.ERROR}Failed astrometrization for the stacked image with {filt} filter{bcl.ENDC}')
             for sky in ['SKY', 'NOSKY']:
                 if sky == 'SKY':
                     if best_wcs is not None:
                         new_frame.header['ASTROMETRY'] = (True, 'Astrometrized image')
-                        new_frame.write(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits', overwrite=True)
+                        get_writer().write_ccd('astrometry', new_frame, PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits')
+                        products.append(PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits')
                         logger.info(f'{bcl.OKGREEN}Successful astrometrization for the stacked image with {filt} and SKY{bcl.ENDC}')
                     else:
                         new_frame.header['ASTROMETRY'] = (False, 'Astrometrized image')
-                        new_frame.write(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits', overwrite=True)
+                        get_writer().write_ccd('astrometry', new_frame, PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits')
+                        products.append(PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_SKY.fits')
                         logger.warning(f'{bcl.WARNING}Failed astrometrization for the stacked image with {filt} and SKY. Conservation of original WCS{bcl.ENDC}')
                 else:
                     if conf['REDUCTION']['save_not_sky']:
-                        nosky = CCDData.read(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_NOSKY.fits', unit='adu')
+                        nosky = CCDData.read(PATH_REDUCED / f'{PRG}_{OB}_{filt}_stacked_NOSKY.fits', unit='adu')
                         if best_wcs is not None:
                             nosky.wcs = WCS(best_wcs)
                             nosky.header['ASTROMETRY'] = (True, 'Astrometrized image')
-                            nosky.write(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits', overwrite=True)
+                            get_writer().write_ccd('astrometry', nosky, PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits')
+                            products.append(PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits')
                             logger.info(f'{bcl.OKGREEN}Successful astrometrization for the stacked image with {filt} and NOSKY{bcl.ENDC}')
                         else:
                             nosky.wcs = nosky.wcs
                             nosky.header['ASTROMETRY'] = (False, 'Astrometrized image')
-                            nosky.write(al.PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits', overwrite=True)
+                            get_writer().write_ccd('astrometry', nosky, PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits')
+                            products.append(PATH_REDUCED / f'{PRG}_{OB}_{filt}_ast_NOSKY.fits')
                             logger.warning(f'{bcl.WARNING}Failed astrometrization for the stacked image with {filt} and NOSKY. Conservation of original WCS{bcl.ENDC}')
                     else:
                         logger.warning(f'{bcl.WARNING}The astrometry is not going to be executed for NOSKY{bcl.ENDC}')
@@ -316,7 +442,7 @@ you need to fill in the correct variable.")
     if conf['REDUCTION']['use_STD'] and conf['ASTROMETRY']['use_astrometry']:
         logger.info(f'{bcl.OKCYAN}---------- Start astrometrization for STD star ----------{bcl.ENDC}')
         time.sleep(30)
-        ic_std = ccdp.ImageFileCollection(al.PATH_REDUCED, keywords='*', glob_include='*STD*', glob_exclude='*NOSKY*')
+        ic_std = HeaderCollection(PATH_REDUCED, keywords='*', glob_include='*STD*', glob_exclude='*NOSKY*')
         lst_object = list(set(ic_std.summary['object']))
         try:
             best_wcs_std, _ = solving_astrometry(PRG, OB, filt, conf, sky='SKY', calib_std=True)
@@ -324,18 +450,19 @@ you need to fill in the correct variable.")
         except:
             best_wcs_std = None
             logger.error(f'{bcl.ERROR}Failed astrometrization for the STD star with {filt} filter{bcl.ENDC}')
+        get_writer().flush('astrometry')
 
         for path_to_std in ic_std.files_filtered(include_path=True):
             std_img = CCDData.read(path_to_std, unit='adu')
             if best_wcs_std is not None:
                 std_img.wcs = WCS(best_wcs_std)
                 std_img.header['ASTROMETRY'] = (True, 'Astrometrized image')
-                std_img.write(path_to_std, overwrite=True)
+                get_writer().write_ccd('astrometry', std_img, path_to_std)
                 logger.info(f'{bcl.OKGREEN}Successful astrometrization done for the {std_img.header["OBJECT"]} with {std_img.header["FILTER2"]}{bcl.ENDC}')
             else:
                 std_img.wcs = std_img.wcs
                 std_img.header['ASTROMETRY'] = (False, 'Astrometrized image')
-                std_img.write(path_to_std, overwrite=True)
+                get_writer().write_ccd('astrometry', std_img, path_to_std)
                 logger.warning(f'{bcl.WARNING}Failed astrometrization for the {std_img.header["OBJECT"]} with {std_img.header["FILTER2"]}. Conserve the original WCS{bcl.ENDC}')
 
 
@@ -344,18 +471,21 @@ you need to fill in the correct variable.")
     else:
         logger.warning(f'{bcl.WARNING}The astrometry for STDs are not going to be executed{bcl.ENDC}')
 
+    get_writer().flush('astrometry')
     logger.info(f'{bcl.OKBLUE}------------------- End of the astrometrization -------------------{bcl.ENDC}')
     print(2*"\n")
 
-#-----------------------------------------------------------------------------------------------------------------------------------
+
+def stage_photometry(conf):
+    """Estimates the ZeroPoint of each filter from the STD star."""
     #Photometry Recipe. The instrumental magnitude is estimated from the calibration star. This allows us 
     # to later estimate the apparent magnitude of the celestial bodies present in the science image. 
-    # This process is done for each filter used. Additionally, the Results() function allows including 
-    # this information in the header of the cleaned, aligned, and astrometrically processed science image.
+    # This process is done for each filter used.
+    PRG, OB = conf['PRG'], conf['OB']
+    zeropoints = {}
     if conf['PHOTOMETRY']['use_photometry']:
         logger.info(f"{bcl.OKBLUE}---------- Starting the estimation of ZeroPoint ----------{bcl.ENDC}")
-        del filt
-        ic_pho = ccdp.ImageFileCollection(al.PATH_REDUCED, keywords='*', glob_include='*ADP*')
+        ic_pho = HeaderCollection(conf['DIRECTORIES']['PATH_OUTPUT'], keywords='*', glob_include='*ADP*')
         lst_filt = list(set(ic_pho.summary['filtro']))
         for filt in lst_filt:
             if filt == "OPEN":
@@ -364,32 +494,408 @@ you need to fill in the correct variable.")
             logger.info(f'{bcl.OKCYAN}++++++++++ Filter selected is {filt} ++++++++++{bcl.ENDC}')
             try:
                 ZP, eZP = photometry(PRG, OB, ic_pho.files_filtered(imgtype='STD',filter2=filt)[0], conf)
-                Results(al.PATH_REDUCED, ZP, eZP, o.MASK, filt, conf=conf)
+                zeropoints[filt] = [float(ZP), float(eZP)]
                 logger.info(f'{bcl.OKGREEN}Photometry done for {filt} filter{bcl.ENDC}')
             except:
-                ZP, eZP = None, None
-                Results(al.PATH_REDUCED, ZP, eZP, o.MASK, filt, conf=conf)
+                zeropoints[filt] = [None, None]
                 logger.warning(f'{bcl.WARNING}Failed photometry for {filt} filter{bcl.ENDC}')
     
     else:
         logger.warning(f'{bcl.WARNING}The photometry is not going to be executed{bcl.ENDC}')
+    return {'zeropoints': zeropoints}
 
+
+def stage_results(conf, zeropoints, MASK, products=None):
+    """Adds the ZeroPoint to the final images (Results) of each filter. Their paths
+    are added to products."""
+    # The Results() function includes the ZeroPoint in the header of the cleaned, 
+    # aligned, and astrometrically processed science image.
+    for filt, (ZP, eZP) in zeropoints.items():
+        saved = Results(Path(conf['DIRECTORIES']['PATH_OUTPUT']), ZP, eZP, MASK, filt, conf=conf)
+        if products is not None:
+            products.extend(saved)
+
+    get_writer().flush('results')
     logger.info(f'{bcl.OKBLUE}------------------- End of the photometry -------------------{bcl.ENDC}')
     print(2*"\n")
+
+
+def build_stages(conf, o, bpm_path, force=False):
+    """Builds the graph of stages of the OB: masterbias, masterflat (per filter), 
+    clean, cr, fringe, sky, save, align, astrometry, photometry and results. 
+
+    Args:
+        conf (dict): Configuration of the OB.
+        o (Reduction): Reduction object of the OB (see setup_reduction).
+        bpm_path (str): Path to the BPM.
+        force (bool, optional): The stages run from scratch (e.g. the saved stacks
+        are not extended). Defaults to False.
+
+    Returns:
+        StageGraph: The graph.
+    """
+    precision = ['PRECISION.dtype']
+    graph = StageGraph(conf, Path(conf['DIRECTORIES']['PATH_OUTPUT'])/'.stages', version=__version__,
+                       checkpoint=conf.get('STAGES', {}).get('checkpoint', False))
+    raw = lambda keys: [fr for key in keys for fr in o.DATA_DICT.get(key, [])] + [bpm_path]
+    zeropoints = {}
+    # Files produced by each stage (the stages add them when they run).
+    products = {name: [] for name in ['save', 'align', 'astrometry', 'results']}
+
+    graph.add(Stage('masterbias', lambda: stage_masterbias(conf, o),
+                    config=['REDUCTION.use_BIAS', 'REDUCTION.combine_method', 'REDUCTION.clip_sigma',
+                            'LIBRARY.use_library'] + precision,
+                    inputs=lambda: raw(['bias']),
+                    restore=lambda state: restore_masterbias(o, state)))
+    flats = sorted(key for key in o.DATA_DICT if 'flat' in key and key != 'flat+OPEN')
+    for filt in flats:
+        graph.add(Stage(f"masterflat:{filt.split('+')[1]}", lambda filt=filt: stage_masterflat(conf, o, filt),
+                        deps=['masterbias'],
+                        config=['REDUCTION.use_FLAT', 'REDUCTION.combine_method', 'REDUCTION.clip_sigma',
+                                'LIBRARY.use_library'] + precision,
+                        inputs=lambda filt=filt: raw([filt]),
+                        restore=o.master_dict.update))
+    graph.add(Stage('clean', lambda: stage_clean(conf, o),
+                    deps=['masterbias'] + [f"masterflat:{filt.split('+')[1]}" for filt in flats],
+                    config=['REDUCTION.use_STD', 'REDUCTION.use_FLAT'] + precision,
+                    inputs=lambda: raw([key for key in o.DATA_DICT if key.startswith(('std+', 'target+'))]),
+                    restore=lambda state: restore_frames(o, state)))
+    graph.add(Stage('cr', lambda: stage_cr(conf, o), deps=['clean'],
+                    config=['REDUCTION.no_CRs', 'REDUCTION.contrast', 'REDUCTION.cr_threshold',
+                            'REDUCTION.neighbor_threshold'],
+                    restore=lambda state: restore_frames(o, state)))
+    graph.add(Stage('fringe', lambda: stage_fringe(conf, o), deps=['masterbias', 'cr'],
+                    config=['REDUCTION.save_fringing', 'REDUCTION.fringe_method', 'REDUCTION.clip_sigma',
+                            'LIBRARY.use_fringe_library', 'LIBRARY.fringe_reuse', 'LIBRARY.fringe_keywords'],
+                    restore=lambda state: restore_frames(o, state)))
+    graph.add(Stage('sky', lambda: stage_sky(conf, o), deps=['cr', 'fringe'],
+                    config=['REDUCTION.save_not_sky', 'REDUCTION.sky_method', 'REDUCTION.sky_mode',
+                            'REDUCTION.sky_window', 'REDUCTION.clip_sigma'],
+                    restore=lambda state: restore_frames(o, state)))
+    graph.add(Stage('save', lambda: stage_save(conf, o, bpm_path, products['save']), deps=['cr', 'fringe', 'sky'],
+                    config=['REDUCTION.save_std', 'REDUCTION.save_sky', 'REDUCTION.save_fringing',
+                            'REDUCTION.save_not_sky'],
+                    outputs=lambda: products['save']))
+    graph.add(Stage('align', lambda: stage_align(conf, force=force, products=products['align']), deps=['save'],
+                    config=['ALIGNING'] + precision, outputs=lambda: products['align']))
+    graph.add(Stage('astrometry', lambda: stage_astrometry(conf, products['astrometry']), deps=['align'],
+                    config=['ASTROMETRY', 'REDUCTION.use_STD'], outputs=lambda: products['astrometry']))
+
+    def run_photometry():
+        zeropoints.update(stage_photometry(conf))
+        return dict(zeropoints)
+
+    graph.add(Stage('photometry', run_photometry, deps=['astrometry'], config=['PHOTOMETRY'] + precision,
+                    restore=zeropoints.update))
+    graph.add(Stage('results', lambda: stage_results(conf, zeropoints['zeropoints'], o.MASK, products['results']),
+                    deps=['photometry'], config=['REDUCTION.save_not_sky'], outputs=lambda: products['results']))
+    return graph
+
+
+
+def process_ob(conf, stage=None, force=False):
+    """
+    This function executes the recipes (reduction, alignment, astrometry and 
+    photometry) for the OB described in the configuration, as a graph of stages.
+    The stages that are up to date (same configuration and inputs as in a 
+    previous run, see StageGraph) are skipped.
+
+    Args:
+        conf (dict): Configuration of the OB (see start_ob).
+        stage (str, optional): Run only this stage. Defaults to None (all of them).
+        force (bool, optional): Run all the stages. Defaults to False.
+    """
+    PRG = conf['PRG']
+    OB = conf['OB']
+
+    #Reduction Recipe. This recipe is responsible for cleaning the images by subtracting 
+    #the masterbias and dividing by the normalized masterflat.
+    #Subsequently, the cleaned images are saved.
+    logger.info(f'{bcl.OKBLUE}---------- Starting the reduction for {PRG}-{OB} ----------{bcl.ENDC}')
+    
+    bpm_path = pkg_resources.resource_filename('SAUSERO', 'BPM/BPM_OSIRIS_PLUS.fits')
+    o = setup_reduction(conf, bpm_path)
+    graph = build_stages(conf, o, bpm_path, force=force)
+    try:
+        graph.run(only=stage, force=force)
+    except WriteError as e:
+        # A product could not be written in the background (e.g. full disk).
+        logger.critical(f'{bcl.ERROR}Some products could not be written: {e}{bcl.ENDC}')
+        sys.exit()
+    finally:
+        shutdown_cosmics_pools()
+
+    get_writer().close()
     # Final message
     logger.info(f'{bcl.OKBLUE}End of the reduction. The results are available in {conf["DIRECTORIES"]["PATH_OUTPUT"]}{bcl.ENDC}')
-    
-    if conf['REDUCTION']['save_sky'] or conf['REDUCTION']['save_not_sky']:
-        for archivo in glob.glob(str(al.PATH_REDUCED/"ADP*.fits")):
-            nuevo_nombre = re.sub(r"_(Sloan)_[a-zA-Z]+", "", archivo)
-            os.rename(archivo, nuevo_nombre)
-    
+
+
+
+def start_ob(conf=None):
+    """
+    This function checks the frames of the OB in the current directory (raw/), 
+    updates its configuration and opens its log file.
+
+    Args:
+        conf (dict, optional): Configuration to use instead of configuration.json.
+
+    Returns:
+        dict, int: Configuration of the OB and identifier of its log file.
+    """
+    ########## Checking files (2025-01-22) ##########
+    conf = check_files(conf)
+
+    hora_local = time.localtime()
+    print(conf)
+    log_id = logger.add(Path(conf['DIRECTORIES']['PATH'])/f"sausero_{time.strftime('%Y-%m-%d_%H:%M:%S', hora_local)}.log", format="{time} {level} {message} ({module}:{line})", level="INFO",
+            filter=lambda record: 'astropy' not in record["name"])
+        
+    logger.info(f'{bcl.OKGREEN}Log file created{bcl.ENDC}')
+    logger.info(f'{bcl.OKGREEN}Configuration has been updated successfully{bcl.ENDC}')
+    logger.info(f'{bcl.OKGREEN}Read the configuration file successfully{bcl.ENDC}')
+
+    # The products are written in the background. Each stage waits (flush) for the 
+    # frames it needs before reading them.
+    configure_writer(conf)
+    configure_sources(conf)
+    return conf, log_id
+
+
+
+def watch_ob():
+    """
+    This function reduces the OB in the current directory while it is being observed 
+    (quick-look products in reduced/quicklook, see NightWatcher). When no new frame 
+    arrives during the quiet period, the complete reduction of the OB is executed 
+    (unless final_reduction is false in the WATCH section).
+    """
+    conf = readJSON()
+    conf['DIRECTORIES']['PATH'] = str(Path(os.getcwd()))
+    conf['DIRECTORIES']['PATH_DATA'] = str(Path(os.getcwd())/'raw')
+    conf['DIRECTORIES']['PATH_OUTPUT'] = str(Path(os.getcwd())/'reduced')
+    Path(conf['DIRECTORIES']['PATH_DATA']).mkdir(parents=True, exist_ok=True)
+
+    log_id = logger.add(Path(conf['DIRECTORIES']['PATH'])/f"sausero_watch_{time.strftime('%Y-%m-%d_%H:%M:%S', time.localtime())}.log",
+                        format="{time} {level} {message} ({module}:{line})", level="INFO",
+                        filter=lambda record: 'astropy' not in record["name"])
+    configure_catalog(conf)
+    configure_writer(conf)
+    configure_sources(conf)
+
+    bpm_path = pkg_resources.resource_filename('SAUSERO', 'BPM/BPM_OSIRIS_PLUS.fits')
+    try:
+        NightWatcher(conf, bpm_path).run()
+    except WriteError as e:
+        logger.critical(f'{bcl.ERROR}Some quick-look products could not be written: {e}{bcl.ENDC}')
+        sys.exit()
+    finally:
+        shutdown_cosmics_pools()
+    logger.remove(log_id)
+
+    if conf.get('WATCH', {}).get('final_reduction', True):
+        conf, __ = start_ob()
+        process_ob(conf)
+
+
+
+def find_obs(paths):
+    """
+    This function finds the OB directories (those with a raw/ subdirectory) 
+    given directly or below the given root directories.
+
+    Args:
+        paths (list): OB directories or root directories.
+
+    Returns:
+        list: Paths to the OB directories.
+    """
+    obs = []
+    for path in paths:
+        path = Path(path).resolve()
+        if (path/'raw').is_dir():
+            obs.append(path)
+            continue
+        for root, dirs, __ in os.walk(path):
+            if 'raw' in dirs:
+                obs.append(Path(root))
+                dirs.clear()
+    return sorted(set(obs))
+
+
+
+def batch_worker(directory, conf):
+    """
+    This function reduces one OB of the batch mode in a worker process.
+
+    Args:
+        directory (str): Path to the OB directory.
+        conf (dict): Base configuration.
+
+    Returns:
+        dict: Directory, status (OK/FAILED), elapsed time (s) and error message.
+    """
+    start = time.time()
+    log_id = None
+    try:
+        os.chdir(directory)
+        conf, log_id = start_ob(copy.deepcopy(conf))
+        process_ob(conf)
+        status, message = 'OK', ''
+    except (Exception, SystemExit) as e:
+        # sys.exit is the way the stages stop on a fatal error. Ctrl-C stops the batch.
+        status, message = 'FAILED', f'{type(e).__name__}: {e}'
+        logger.error(f'{bcl.ERROR}Reduction of {directory} failed: {message}{bcl.ENDC}')
+    finally:
+        shutdown_cosmics_pools()
         try:
-            for archivo in glob.glob(str(al.PATH_REDUCED/"ADP*OPEN*.fits")):
-                nuevo_nombre = re.sub(r"_(OPEN)_+", "", archivo)
-                os.rename(archivo, nuevo_nombre)
-        except:
-            logger.info(f'No OPEN filter')
+            get_writer().close()
+        except Exception:
+            pass
+        if log_id is not None:
+            logger.remove(log_id)
+    return {'directory': str(directory), 'status': status, 'time': time.time() - start,
+            'message': message}
+
+
+
+def run_batch(paths, workers=1):
+    """
+    This function reduces many OBs with a pool of processes. The calibration library 
+    is enabled for all of them, so the masters shared by several OBs are built once 
+    (the other OBs wait for them) and reused. A summary per OB is printed at the end
+    and saved in batch_summary.json.
+
+    Args:
+        paths (list): OB directories or root directories to search for OBs.
+        workers (int, optional): Maximum number of OBs reduced at the same time. Defaults to 1.
+
+    Returns:
+        list: Summary per OB (see batch_worker).
+    """
+    obs = find_obs(paths)
+    if len(obs) == 0:
+        logger.critical(f'{bcl.ERROR}No OB directories (with raw/) found{bcl.ENDC}')
+        sys.exit()
+
+    # Configuration of the current directory (or the default one) for every OB.
+    base_conf = readJSON() if os.path.exists(Path(os.getcwd())/'configuration.json') else read_config(
+        pkg_resources.resource_filename('SAUSERO', 'config/configuration.json'))
+    base_conf.setdefault('LIBRARY', {})['use_library'] = True
+    logger.info(f'{bcl.OKBLUE}---------- Batch mode: {len(obs)} OBs with {workers} workers ----------{bcl.ENDC}')
+
+    cwd = os.getcwd()
+    summary = []
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [pool.submit(batch_worker, str(ob), base_conf) for ob in obs]
+        for future in as_completed(futures):
+            result = future.result()
+            summary.append(result)
+            logger.info(f"{result['status']}: {result['directory']} ({result['time']:.1f} s)")
+    os.chdir(cwd)
+
+    summary.sort(key=lambda result: result['directory'])
+    print(f"{bcl.BOLD}{'OB':<60}{'STATUS':>8}{'TIME (s)':>10}{bcl.ENDC}")
+    for result in summary:
+        colour = bcl.OKGREEN if result['status'] == 'OK' else bcl.FAIL
+        print(f"{colour}{result['directory']:<60}{result['status']:>8}{result['time']:>10.1f}{bcl.ENDC}")
+        if result['message']:
+            print(f"    {result['message']}")
+    with open(Path(cwd)/'batch_summary.json', 'w') as file:
+        json.dump(summary, file, indent=4)
+    return summary
+
+
+
+def run():
+    """
+    This function 
+    """
+    # Parse configuration
+    parser = argparse.ArgumentParser(
+                         prog = 'OsirisDRP',
+                         description = 'This software reduces observations taken with OSIRIS\
+                            in BBI mode. It can process any filter configuration and is suitable\
+                            for observations affected by fringing (Sloan_z).')
+
+    parser.add_argument('-e', '--execute', help='Execute the configuration file in the current directory.',
+                        action='store_true')
+    
+    parser.add_argument('-c', '--create_config', help='Create a configuration file in the current directory.',
+                        action='store_true')
+
+    parser.add_argument('-i', '--invalidate', nargs='+', metavar='KIND [START END]',
+                        help='Remove from the calibration library the masters of a kind (bias, flat,\
+                            fringe or all), taken between two dates (YYYY-MM-DD) if they are given.')
+
+    parser.add_argument('--where', nargs='+', metavar='KEY=VALUE',
+                        help='With -i, only remove the masters created with these parameters\
+                            (e.g. method=median, config.FILTER4=OPEN for the instrument configuration).')
+
+    parser.add_argument('-b', '--batch', nargs='+', metavar='DIR',
+                        help='Reduce many OBs: OB directories (with raw/) or root directories to search for them.')
+
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of OBs reduced at the same time in batch mode.')
+
+    parser.add_argument('-s', '--stage',
+                        help='Run only one stage (masterbias, masterflat:FILTER, clean, cr, fringe, sky,\
+                            save, align, astrometry, photometry or results) with the checkpoints of the others.')
+
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Run all the stages, even those that are up to date.')
+
+    parser.add_argument('--watch', action='store_true',
+                        help='Reduce the frames of the OB as they arrive to raw/ (quick-look), and the\
+                            whole OB when no new frame arrives during the quiet period.')
+
+    args = parser.parse_args()
+
+
+    print(f"{bcl.OKBLUE}***********************************************************************{bcl.ENDC}")
+    print(f"{bcl.OKBLUE}************************* WELCOME TO SAUSERO **************************{bcl.ENDC}")
+    print(f"{bcl.OKBLUE}***********************************************************************{bcl.ENDC}")
+    print("\n")
+    print(f"{bcl.BOLD}---------------------- LICENSE ----------------------{bcl.ENDC}")
+    print("\n")
+    print(f"This program is free software: you can redistribute it and/or modify\n\
+it under the terms of the GNU General Public License as published by\n\
+the Free Software Foundation, either version 3 of the License, or\n\
+(at your option) any later version.\n\n\
+This program is distributed in the hope that it will be useful,\n\
+but WITHOUT ANY WARRANTY; without even the implied warranty of\n\
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the\n\
+GNU General Public License for more details.\n\n\
+You should have received a copy of the GNU General Public License\n\
+along with this program. If not, see <https://www.gnu.org/licenses/>.")
+    print("\n")
+    print(f"{bcl.BOLD}************************ IMPORTANT INFORMATION ************************{bcl.ENDC}")
+    print("\n")
+    print(f"This software is designed to reduce Broad Band Imaging observations obtained with OSIRIS+.\n\
+For proper use, you need to modify the configuration file, which can be found\n\
+in the directory where this software is installed. Additionally, you need to create\n\
+an account on Astrometry.net. Once you have the code that allows you to use the API,\n\
+you need to fill in the correct variable.")
+    print(f"\n")
+
+    # Check if the configuration file exists (2025-08-04)
+    if args.create_config:
+        print(f"{bcl.OKGREEN}Creating the configuration file in the current directory.{bcl.ENDC}")
+        print(f"{bcl.WARNING}You can edit it before you execute the reduction.{bcl.ENDC}")
+        create_config_file_home()
+        sys.exit()
+
+    if args.invalidate:
+        if len(args.invalidate) not in (1, 3):
+            parser.error('-i/--invalidate takes KIND, or KIND START END')
+        invalidate_library(*args.invalidate, where=args.where)
+
+    if args.batch:
+        run_batch(args.batch, workers=args.workers)
+    elif args.watch:
+        watch_ob()
+    else:
+        conf, __ = start_ob()
+        process_ob(conf, stage=args.stage, force=args.force)
 
     print(2*"\n")
     print(f"{bcl.OKBLUE}************************* THANK YOU FOR USING SAUSERO *************************{bcl.ENDC}")
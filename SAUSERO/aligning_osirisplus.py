@@ -17,35 +17,659 @@ Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
 """
 
 import astroalign as aa
+import numpy as np
+from astropy.io import fits
 from astropy.nddata import CCDData
-from astropy.table import Table
-import ccdproc as ccdp
+from astropy.wcs import WCS
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-import time, os
+import json, re, time, os, sys
 import matplotlib.pyplot as plt
 from astropy.visualization import LogStretch,imshow_norm, ZScaleInterval
 
 from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.headers_osirisplus import HeaderCollection
+from SAUSERO.writer_osirisplus import get_writer
+from SAUSERO.precision_osirisplus import get_dtype, to_native
+from SAUSERO.shift_osirisplus import find_shift, shift_frame
+from SAUSERO.wcs_osirisplus import find_wcs_transform
+from SAUSERO.stacking_osirisplus import STACK_METHODS, ScratchCube
+from SAUSERO.resample_osirisplus import RESAMPLE_KERNELS, resample as resample_frame
+from SAUSERO.sources_osirisplus import control_points, extract_sources, get_sources
 from loguru import logger
 
 
+def find_registration(data, target, max_control_points=60, target_points=None, shift=None, seed=None,
+                      wcs=None):
+    """Finds the registration of a frame against a target, as aa.find_transform, but
+    the sources of the frame are taken from the shared catalog cache and those of
+    the target can be given (e.g. a fixed reference whose sources are detected
+    once). With shift, the translation found by FFT phase correlation is tried first
+    (see find_shift), and with seed and the WCS of the frame, the transform
+    predicted by the WCS (see find_wcs_transform). The full search of astroalign is
+    the last option.
+
+    Args:
+        data (array): Frame (native byte order).
+        target (array): Target frame.
+        max_control_points (int, optional): Maximum number of control points. Defaults to 60.
+        target_points (array, optional): Control points of the target. Defaults to
+        None (detected, without caching, since the running sum changes).
+        shift (dict, optional): Parameters of find_shift, with the sources of the
+        target (ref_sources). Defaults to None.
+        seed (dict, optional): Parameters of find_wcs_transform, with the WCS and
+        sources of the target (ref_wcs, ref_sources). Defaults to None.
+        wcs (WCS, optional): WCS of the frame. Defaults to None.
+
+    Returns:
+        tuple: Registration (see apply_registration): ('shift', (dy, dx)) or
+        ('transform', transform).
+    """
+    if shift is not None:
+        found = find_shift(data, target, get_sources().sources(data), **shift)
+        if found is not None:
+            return 'shift', found
+    if seed is not None and wcs is not None:
+        found = find_wcs_transform(data.shape, wcs, get_sources().sources(data), **seed)
+        if found is not None:
+            return 'transform', found
+    if target_points is None:
+        target_points = control_points(extract_sources(target), max_control_points)
+    source_points = control_points(get_sources().sources(data), max_control_points)
+    for points, image in ((source_points, 'source'), (target_points, 'target')):
+        if len(points) < 3:
+            raise ValueError(f"Reference stars in {image} image are less than the minimum value (3).")
+    t, __ = aa.find_transform(source_points, target_points, max_control_points=max_control_points)
+    return 'transform', t
+
+
+def apply_registration(registration, data, target, resample=None):
+    """Applies a registration (see find_registration) to a frame. It can be applied
+    to any version of the frame it was found for (e.g. with and without sky).
+
+    Args:
+        registration (tuple): ('shift', (dy, dx)) or ('transform', transform).
+        data (array): Frame (native byte order).
+        target (array): Target frame (only its shape is used).
+        resample (dict, optional): Parameters of resample_osirisplus.resample (kernel,
+        workers) for the transforms. Defaults to None (aa.apply_transform).
+
+    Returns:
+        tuple: Aligned frame and its footprint.
+    """
+    kind, params = registration
+    if kind == 'shift':
+        return shift_frame(data, *params)
+    if resample is not None:
+        return resample_frame(data, params.params, shape=target.shape, **resample)
+    return aa.apply_transform(params, data, target)
+
+
+def register_image(data, target, max_control_points=60, registration=None, resample=None, **kwargs):
+    """Registers a frame against a target (see find_registration for the parameters).
+
+    Args:
+        data (array): Frame (native byte order).
+        target (array): Target frame.
+        max_control_points (int, optional): Maximum number of control points. Defaults to 60.
+        registration (tuple, optional): Registration already found for the frame.
+        Defaults to None (it is searched).
+        resample (dict, optional): Parameters of the resampling (see
+        apply_registration). Defaults to None.
+
+    Returns:
+        tuple: Aligned frame, its footprint and the registration.
+    """
+    if registration is None:
+        registration = find_registration(data, target, max_control_points=max_control_points, **kwargs)
+    return (*apply_registration(registration, data, target, resample=resample), registration)
+
+
+# Arguments of register_image in the registration processes (the fixed reference,
+# its control points, ...; see register_frame).
+_CONTEXT = None
+
+
+def _init_register(context):
+    """Initializer of the registration processes: the reference and its control
+    points are sent once to each process instead of with every frame."""
+    global _CONTEXT
+    _CONTEXT = context
+
+
+def register_frame(path, dtype=np.float64, max_control_points=60, context=None, registration=None):
+    """Reads a frame and registers it against a fixed reference. It is defined at 
+    module level so it can be sent to the worker processes.
+
+    Args:
+        path (str): Path to the frame.
+        dtype (type, optional): Floating point type. Defaults to np.float64.
+        max_control_points (int, optional): Maximum number of control points. Defaults to 60.
+        context (dict, optional): Arguments of register_image: the reference frame
+        (target), its control points, ... Defaults to None (the ones given to the
+        process by _init_register).
+        registration (tuple, optional): Registration already found for the frame.
+        Defaults to None (it is searched).
+
+    Returns:
+        tuple: Aligned frame, footprint, exposure time, registration and error
+        message (None if the frame was aligned; the frame, footprint and
+        registration are then None).
+    """
+    context = _CONTEXT if context is None else context
+    ccd = CCDData.read(path, unit='adu', hdu=0)
+    exptime = float(ccd.header.get('EXPTIME', 0.))
+    try:
+        align, footprint, registration = register_image(to_native(ccd.data, dtype),
+                                                        max_control_points=max_control_points,
+                                                        registration=registration, wcs=ccd.wcs, **context)
+    except (aa.MaxIterError, ValueError, TypeError) as e:
+        return None, None, exptime, None, f"{type(e).__name__}; {str(e)}"
+    return align.astype(dtype, copy=False), footprint, exptime, registration, None
+
+
+def raw_exposure(name):
+    """Returns the name of the raw exposure of a reduced frame
+    (ADP_{raw}_{type}_{sky}.fits), shared by all its versions.
+
+    Args:
+        name (str): Name or path of the reduced frame.
+
+    Returns:
+        str: Name of the raw exposure (the name of the frame if it is not a reduced frame).
+    """
+    name = os.path.basename(str(name))
+    match = re.match(r'ADP_(.+?)_(SCIENCE|STD)_', name)
+    return match.group(1) if match else name
+
+
+class StackAccumulator:
+    """Running stack of aligned frames. It keeps the reference, the running sum of
+    the frames, a map of the exposure time of each pixel and the number of frames 
+    and their total exposure time. The frames are added one at a time, each one
+    registered once, so only one frame is in memory and a late frame extends the
+    stack without aligning the previous ones again. The state can be saved and
+    loaded, so a stack is extended between runs.
+
+    The reference is the running sum, or with fixed_reference the first frame: then
+    the frames do not depend on each other and can be registered in parallel
+    (see register_frame) and added with add_aligned. With shift, the frames that
+    are only translated are aligned with an FFT shift (see find_shift), and with
+    seed, the transform is predicted by the WCS of the frames (see find_wcs_transform).
+    With resample, the transforms are applied by resample_osirisplus instead of
+    astroalign, and with accumulate they are resampled straight into the running
+    sum (the aligned frames are then not returned). The registration of each frame is kept (registrations), so it can be applied to
+    other versions of the same frames (see apply_registration).
+    """
+
+    def __init__(self, max_control_points=60, dtype=np.float64, fixed_reference=False, shift=None,
+                 seed=None, resample=None, options=None, accumulate=False):
+        """Accumulator initialization.
+
+        Args:
+            max_control_points (int, optional): Maximum number of control points of
+            astroalign. Defaults to 60.
+            dtype (type, optional): Floating point type of the stack. Defaults to np.float64.
+            fixed_reference (bool, optional): Register the frames against the first
+            one instead of the running sum. Defaults to False.
+            shift (dict, optional): Parameters of find_shift (border, 
+            min_significance, max_residual). Defaults to None.
+            seed (dict, optional): Parameters of find_wcs_transform (search_radius,
+            max_residual). Defaults to None.
+            resample (dict, optional): Parameters of resample_osirisplus.resample
+            (kernel, workers). Defaults to None (aa.apply_transform).
+            options (dict, optional): Other settings that change the stack (e.g. the
+            reuse of the registrations), saved with it (see settings). Defaults to None.
+            accumulate (bool, optional): With resample, add the transformed frames to
+            the running sum without an intermediate aligned frame. Defaults to False.
+        """
+        self.max_control_points = max_control_points
+        self.dtype = np.dtype(dtype)
+        self.fixed_reference = fixed_reference
+        self.shift = shift
+        self.seed = seed
+        self.resample = resample
+        self.options = options or {}
+        self.accumulate = accumulate
+        self._footprint = None     # Footprint buffer of the frames resampled into the sum
+        self.reference = None      # First frame (with fixed_reference)
+        self.base_sources = None   # Sources of the first frame (the pixel grid of the stack)
+        self.base_wcs = None       # WCS of the first frame
+        self.base_header = None    # Header of the first frame (without the WCS)
+        self.sum = None            # Running sum
+        self.exposure = None       # Exposure time (s) of each pixel
+        self.num = 0
+        self.total_exptime = 0.
+        self.frames = {}           # Frames added (name: [size, mtime])
+        self.failed = {}           # Frames that could not be aligned (name: error)
+        self.registrations = {}    # Registrations of the frames added in this run (name: registration)
+
+
+    @staticmethod
+    def stamp(path):
+        """Returns the size and modification time of a frame."""
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+
+    def settings(self):
+        """Returns the settings that change the registration and resampling of the
+        frames, as saved with the stack (a stack is only extended with the same ones).
+        The number of threads of the resampling does not change it, so only the
+        kernel is kept.
+
+        Returns:
+            dict: Settings (JSON types).
+        """
+        settings = {'max_control_points': self.max_control_points, 'dtype': self.dtype.name,
+                    'fixed_reference': self.fixed_reference, 'shift': self.shift, 'seed': self.seed,
+                    'resample': None if self.resample is None else self.resample['kernel'],
+                    'options': self.options}
+        return json.loads(json.dumps(settings))
+
+
+    def extends(self, paths):
+        """Checks if the stack can be extended with a list of frames, that is, every
+        frame already added is in the list and has not changed.
+
+        Args:
+            paths (list): Paths to the frames.
+
+        Returns:
+            bool: True if the frames of the stack are a subset of the list.
+        """
+        stamps = {os.path.basename(str(path)): self.stamp(path) for path in paths}
+        return all(stamps.get(name) == stamp for name, stamp in self.frames.items())
+
+
+    def target(self):
+        """Returns the arguments of register_image for the new frames: the frame they
+        are registered against (target), its control points (None for the running
+        sum) and the parameters of the FFT shift, the WCS seed and the resampling."""
+        if self.fixed_reference and self.base_sources is None:
+            self.base_sources = get_sources().sources(self.reference)
+        context = {'target': self.reference if self.fixed_reference else self.sum,
+                   'target_points': None, 'shift': None, 'seed': None, 'resample': self.resample}
+        if self.fixed_reference:
+            context['target_points'] = control_points(self.base_sources, self.max_control_points)
+        if self.shift is not None and self.base_sources is not None:
+            context['shift'] = dict(self.shift, ref_sources=self.base_sources)
+        if self.seed is not None and self.base_sources is not None and self.base_wcs is not None:
+            context['seed'] = dict(self.seed, ref_wcs=self.base_wcs, ref_sources=self.base_sources)
+        return context
+
+
+    def add(self, data, exptime=0., name=None, stamp=None, wcs=None, registration=None, header=None):
+        """Registers a frame against the reference and adds it.
+
+        Args:
+            data (array): Frame.
+            exptime (float, optional): Exposure time of the frame. Defaults to 0.
+            name (str, optional): Name of the frame. Defaults to None.
+            stamp (list, optional): Size and modification time of the file. Defaults to None.
+            wcs (WCS, optional): WCS of the frame. Defaults to None.
+            registration (tuple, optional): Registration already found for the frame
+            (e.g. for its version with sky). Defaults to None (it is searched).
+            header (Header, optional): Header of the frame, kept for the first frame
+            as the header of the stack. Defaults to None.
+
+        Returns:
+            tuple: Aligned frame (None if it was resampled into the running sum), its
+            footprint (True where it has no data) and its exposure time, or None if the
+            frame could not be aligned.
+        """
+        data = to_native(data, self.dtype)
+        if self.sum is None:
+            self.base_wcs = wcs
+            self.base_header = header
+            if self.fixed_reference:
+                self.reference = data.copy()
+            elif self.shift is not None or self.seed is not None:
+                self.base_sources = get_sources().sources(data)
+            return self.add_aligned(data, np.zeros(data.shape, dtype=bool), exptime, name, stamp)
+        try:
+            context = self.target()
+            resample = context.pop('resample')
+            if registration is None:
+                registration = find_registration(data, max_control_points=self.max_control_points, wcs=wcs,
+                                                 **context)
+            if self.accumulate and resample is not None and registration[0] == 'transform':
+                return self.add_resampled(data, registration, exptime, name, stamp)
+            align, footprint = apply_registration(registration, data, self.sum, resample=resample)
+        except (aa.MaxIterError, ValueError, TypeError) as e:
+            self.add_failure(name, f"{type(e).__name__}; {str(e)}")
+            return None
+        return self.add_aligned(align.astype(self.dtype, copy=False), footprint, exptime, name, stamp,
+                                registration)
+
+
+    def add_resampled(self, data, registration, exptime=0., name=None, stamp=None):
+        """Resamples a frame with its transform straight into the running sum (see
+        resample_osirisplus.resample), so no aligned frame is allocated.
+
+        Args:
+            data (array): Frame (native byte order).
+            registration (tuple): ('transform', transform).
+            exptime (float, optional): Exposure time of the frame. Defaults to 0.
+            name (str, optional): Name of the frame. Defaults to None.
+            stamp (list, optional): Size and modification time of the file. Defaults to None.
+
+        Returns:
+            tuple: None (no aligned frame), its footprint and its exposure time.
+        """
+        if self._footprint is None or self._footprint.shape != self.sum.shape:
+            self._footprint = np.empty(self.sum.shape, dtype=bool)
+        __, footprint = resample_frame(data, registration[1].params, out=self.sum, footprint=self._footprint,
+                                       accumulate=True, **self.resample)
+        self.exposure[~footprint] += exptime
+        self._record(exptime, name, stamp, registration)
+        return None, footprint, exptime
+
+
+    def add_aligned(self, align, footprint, exptime=0., name=None, stamp=None, registration=None):
+        """Adds a frame already registered against the reference.
+
+        Args:
+            align (array): Aligned frame.
+            footprint (array): True where the aligned frame has no data.
+            exptime (float, optional): Exposure time of the frame. Defaults to 0.
+            name (str, optional): Name of the frame. Defaults to None.
+            stamp (list, optional): Size and modification time of the file. Defaults to None.
+            registration (tuple, optional): Registration of the frame. Defaults to None.
+
+        Returns:
+            tuple: Aligned frame, its footprint and its exposure time.
+        """
+        if self.sum is None:
+            self.sum = align.copy()
+            self.exposure = np.zeros(align.shape, dtype=np.float32)
+        else:
+            self.sum += align
+        self.exposure[~footprint & np.isfinite(align)] += exptime
+        self._record(exptime, name, stamp, registration)
+        return align, footprint, exptime
+
+
+    def _record(self, exptime, name, stamp, registration):
+        """Counts a frame added to the stack."""
+        self.num += 1
+        self.total_exptime += exptime
+        if name is not None:
+            self.frames[name] = stamp
+            self.failed.pop(name, None)
+            if registration is not None:
+                self.registrations[name] = registration
+
+
+    def add_failure(self, name, message):
+        """Records a frame that could not be aligned."""
+        self.failed[name] = message
+        logger.error(f"{bcl.FAIL}ERROR{bcl.ENDC} ({name}): {message}")
+
+
+    def add_file(self, path, registration=None):
+        """Reads a frame and adds it (see add). The exposure time is taken from its header.
+
+        Args:
+            path (str): Path to the frame.
+            registration (tuple, optional): Registration already found for the frame.
+            Defaults to None.
+
+        Returns:
+            tuple: Aligned frame, its footprint and its exposure time, or None.
+        """
+        stamp = self.stamp(path)
+        ccd = CCDData.read(path, unit='adu', hdu=0)
+        return self.add(ccd.data, exptime=float(ccd.header.get('EXPTIME', 0.)),
+                        name=os.path.basename(str(path)), stamp=stamp, wcs=ccd.wcs, registration=registration,
+                        header=ccd.header)
+
+
+    def add_files(self, paths, workers=1, registrations=None):
+        """Registers several frames against the fixed reference, in a pool of 
+        processes, and adds them in the order of the list. The first frame is 
+        the reference if the stack is empty.
+
+        Args:
+            paths (list): Paths to the frames.
+            workers (int, optional): Number of processes. Defaults to 1 (serial).
+            registrations (dict, optional): Registrations already found for some of
+            the frames (name: registration). Defaults to None.
+
+        Yields:
+            tuple: Aligned frame, its footprint and its exposure time, or None, for each frame.
+        """
+        paths = list(paths)
+        registrations = {} if registrations is None else registrations
+        if self.sum is None and len(paths) != 0:
+            yield self.add_file(paths.pop(0))
+        if len(paths) == 0 or self.sum is None:
+            return
+        known = [registrations.get(os.path.basename(str(path))) for path in paths]
+        if not self.fixed_reference:
+            for path, registration in zip(paths, known):
+                yield self.add_file(path, registration)
+            return
+
+        stamps = [self.stamp(path) for path in paths]
+        context = self.target()
+        if workers <= 1:
+            results = (register_frame(path, self.dtype, self.max_control_points, context, registration)
+                       for path, registration in zip(paths, known))
+            yield from self._add_results(paths, stamps, results)
+            return
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths)), initializer=_init_register,
+                                 initargs=(context,)) as pool:
+            results = pool.map(register_frame, paths, repeat(self.dtype), repeat(self.max_control_points),
+                               repeat(None), known)
+            yield from self._add_results(paths, stamps, results)
+
+
+    def _add_results(self, paths, stamps, results):
+        for path, stamp, (align, footprint, exptime, registration, error) in zip(paths, stamps, results):
+            name = os.path.basename(str(path))
+            if error is not None:
+                self.add_failure(name, error)
+                yield None
+            else:
+                yield self.add_aligned(align, footprint, exptime, name, stamp, registration)
+
+
+    def stacked(self):
+        """Returns (a copy of) the stacked image."""
+        return None if self.sum is None else self.sum.copy()
+
+
+    def save(self, path):
+        """Saves the state of the accumulator (.npz).
+
+        Args:
+            path (str): Path to the file.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {'settings': self.settings(), 'num': self.num,
+                'base_wcs': self.base_wcs.to_header_string() if self.base_wcs is not None else None,
+                'base_header': self.base_header.tostring() if self.base_header is not None else None,
+                'total_exptime': self.total_exptime, 'frames': self.frames}
+        arrays = {'sum': self.sum, 'exposure': self.exposure}
+        if self.reference is not None:
+            arrays['reference'] = self.reference
+        if self.base_sources is not None:
+            arrays['base_sources'] = self.base_sources
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp, path)
+
+
+    @classmethod
+    def load(cls, path):
+        """Loads the state saved by save().
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            StackAccumulator: The accumulator, or None if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            meta = json.loads(str(state['meta']))
+            if 'settings' not in meta:
+                # Saved by a version without the settings: it cannot be validated.
+                return None
+            settings = dict(meta['settings'])
+            kernel = settings.pop('resample')
+            acc = cls(resample=None if kernel is None else {'kernel': kernel}, **settings)
+            acc.sum = state['sum']
+            acc.exposure = state['exposure']
+            if 'reference' in state:
+                acc.reference = state['reference']
+            if 'base_sources' in state:
+                acc.base_sources = state['base_sources']
+        acc.num = meta['num']
+        acc.total_exptime = meta['total_exptime']
+        if meta.get('base_wcs'):
+            acc.base_wcs = WCS(fits.Header.fromstring(meta['base_wcs']))
+        if meta.get('base_header'):
+            acc.base_header = fits.Header.fromstring(meta['base_header'])
+        acc.frames = meta['frames']
+        return acc
+
+
+class StackResult:
+    """Stacked image of a filter, with the header and WCS of its first frame, the
+    number of frames and their total exposure time. The exposure map (exposure time
+    of each pixel) and, for the combine methods, the weight map are also kept.
+    """
+
+    def __init__(self, data, header, wcs, num, exptime, exposure=None, weight=None, failed=None):
+        """Result initialization.
+
+        Args:
+            data (array): Stacked image.
+            header (Header): Header of the first frame (without the WCS).
+            wcs (WCS): WCS of the first frame (the pixel grid of the stack).
+            num (int): Number of stacked frames.
+            exptime (float): Total exposure time of the stacked frames (sec).
+            exposure (array, optional): Exposure map. Defaults to None.
+            weight (array, optional): Weight map. Defaults to None.
+            failed (dict, optional): Frames that could not be aligned (name: error). Defaults to None.
+        """
+        self.data = data
+        self.header = header
+        self.wcs = wcs
+        self.num = num
+        self.exptime = exptime
+        self.exposure = exposure
+        self.weight = weight
+        self.failed = {} if failed is None else failed
+
+
 class OsirisAlign:
     """This class allows the alignment of science frames (or photometry calibration frames, if applicable). 
     Afterward, we can stack them to enhance the measured flux. This step is essential for observing 
     faint sources.
     """
     
-    def __init__(self, conf):
+    def __init__(self, conf, force=False):
         """We initialize the class by defining important parameters.
 
         Args:
-            program (str): Science program code
-            block (str): Observational block number assigned to a science program
+            conf (dict): Configuration of the OB.
+            force (bool, optional): Ignore the saved stacks. Defaults to False.
         """
         self.conf = conf
+        self.force = force
         self.PATH_REDUCED = Path(self.conf["DIRECTORIES"]["PATH_OUTPUT"])
         
-        self.ic = ccdp.ImageFileCollection(self.PATH_REDUCED, keywords='*', glob_include='ADP*')
+        self.ic = HeaderCollection(self.PATH_REDUCED, keywords='*', glob_include='ADP*')
+        # Science frames of each filter and sky, resolved once.
+        self.index = self.index_frames()
+
+        # 'sum' keeps the running sum of the aligned frames. Any method of 
+        # stacking_osirisplus combines the aligned frames, scaled to the sum. They
+        # are written in a scratch cube (in scratch_dir) and combined by blocks of
+        # rows of at most memory_limit MB.
+        self.combine_method = self.conf["ALIGNING"].get("combine_method", "sum")
+        if self.combine_method != 'sum' and self.combine_method not in STACK_METHODS:
+            logger.critical(f"{bcl.FAIL}Unknown combine method {self.combine_method}. Options: sum, "
+                            f"{', '.join(STACK_METHODS)}{bcl.ENDC}")
+            sys.exit()
+        self.clip_sigma = self.conf["ALIGNING"].get("clip_sigma", 3.0)
+        self.memory_limit = self.conf["ALIGNING"].get("memory_limit", 1024)
+        self.scratch_dir = self.conf["ALIGNING"].get("scratch_dir") or self.PATH_REDUCED
+        self.max_control_points = self.conf["ALIGNING"].get("max_control_points", 60)
+
+        # With persist_stack, the running sums are saved in reduced/.stacks and extended
+        # in the next run if their frames have not been written again.
+        self.persist_stack = self.conf["ALIGNING"].get("persist_stack", False)
+        self.PATH_STACKS = self.PATH_REDUCED / '.stacks'
+
+        # 'running' registers each frame against the running sum (serial). 'reference'
+        # registers them against the first frame, in a pool of align_workers processes.
+        self.fixed_reference = self.conf["ALIGNING"].get("register_mode", "running") == "reference"
+        self.align_workers = self.conf["ALIGNING"].get("align_workers", 1)
+
+        # Frames that are only translated are aligned with an FFT shift (fast_shift),
+        # the rest with astroalign.
+        self.shift = None
+        if self.conf["ALIGNING"].get("fast_shift", False):
+            self.shift = {'border': self.conf["ALIGNING"].get("shift_border", 64),
+                          'min_significance': self.conf["ALIGNING"].get("shift_min_significance", 8.0),
+                          'max_residual': self.conf["ALIGNING"].get("shift_max_residual", 0.5)}
+
+        # The transform of each frame is predicted by the WCS of its header and
+        # refined with the sources (wcs_seed), instead of searched by astroalign.
+        self.seed = None
+        if self.conf["ALIGNING"].get("wcs_seed", False):
+            self.seed = {'search_radius': self.conf["ALIGNING"].get("wcs_search_radius", 10.0),
+                         'max_residual': self.conf["ALIGNING"].get("wcs_max_residual", 1.0)}
+
+        # The registrations found for the frames with sky are applied to the same
+        # exposures without sky (reuse_transforms), keyed by raw exposure.
+        self.reuse_transforms = self.conf["ALIGNING"].get("reuse_transforms", True)
+        self.registrations = {}
+
+        # The transforms are applied by resample_osirisplus with resample_kernel
+        # (nearest, bilinear or lanczos3) in resample_workers threads, instead of
+        # astroalign (bicubic).
+        self.resample = None
+        kernel = self.conf["ALIGNING"].get("resample_kernel", "astroalign")
+        if kernel != 'astroalign':
+            if kernel not in RESAMPLE_KERNELS:
+                logger.critical(f"{bcl.FAIL}Unknown resample kernel {kernel}. Options: astroalign, "
+                                f"{', '.join(RESAMPLE_KERNELS)}{bcl.ENDC}")
+                sys.exit()
+            self.resample = {'kernel': kernel, 'workers': self.conf["ALIGNING"].get("resample_workers", 1)}
+
+        # Floating point type of the frames (PRECISION section).
+        self.dtype = get_dtype(self.conf)
+
+
+    def index_frames(self):
+        """Groups the science frames of the collection by filter and sky, in one
+        pass over their (cached) headers.
+
+        Returns:
+            dict: Paths to the frames (in name order) for each (filter, sky).
+        """
+        index = {}
+        for name in self.ic.files:
+            path = self.PATH_REDUCED / name
+            if str(self.ic.cache.value(path, 'IMGTYPE', '')).upper() != 'SCIENCE':
+                continue
+            key = (str(self.ic.cache.value(path, 'FILTRO')), str(self.ic.cache.value(path, 'SSKY')).upper())
+            index.setdefault(key, []).append(str(path))
+        return index
+
+
+    def filters(self):
+        """Returns the filters with science frames."""
+        return sorted({filt for filt, __ in self.index})
 
 
     def load_frames(self, filt, sky):
@@ -53,85 +677,148 @@ class OsirisAlign:
 
         Args:
             filt (str): Filter name
+            sky (str): SKY or NOSKY
 
         Returns:
             list: A list of science frames for a given filter and its path
         """
-        self.tab = Table(self.ic.summary)
-        sub_tab = self.tab[(self.tab['filter2']==filt) & (self.tab['ssky']==sky)]
-        logger.info(f"Looking for frames that have {filt} and {sky}")
-        logger.info(f"{sub_tab}")
-        self.total_exptime = sub_tab['exptime'].value.data[0]
-        logger.info(f"Exposure time per frame: {self.total_exptime} sec")
-        return self.ic.files_filtered(imgtype="SCIENCE",
-                                      filtro=filt,
-                                      ssky = sky,
-                                      include_path=True)
+        frames = self.index.get((filt, sky.upper()), [])
+        logger.info(f"Looking for frames that have {filt} and {sky}: {len(frames)} frames")
+        return frames
+
 
+    def accumulator(self, filt, sky, frames):
+        """Returns the saved running sum of a filter if it can be extended with the
+        given frames, or a new accumulator.
 
+        Args:
+            filt (str): Filter name
+            sky (str): SKY or NOSKY
+            frames (list): Paths to the frames of the stack.
+
+        Returns:
+            StackAccumulator: Accumulator.
+        """
+        new = StackAccumulator(max_control_points=self.max_control_points, dtype=self.dtype,
+                               fixed_reference=self.fixed_reference, shift=self.shift, seed=self.seed,
+                               resample=self.resample,
+                               options={'reuse_transforms': self.reuse_transforms and sky == 'NOSKY'},
+                               accumulate=self.combine_method == 'sum')
+        if self.persist_stack and self.combine_method == 'sum' and not self.force:
+            acc = StackAccumulator.load(self.PATH_STACKS / f'{filt}_{sky}.npz')
+            if acc is not None:
+                if acc.settings() == new.settings() and acc.extends(frames):
+                    logger.info(f"Extending the saved stack of {acc.num} frames")
+                    acc.resample, acc.accumulate = self.resample, new.accumulate
+                    return acc
+                logger.info("The saved stack does not match the frames or the settings. It is created again")
+        return new
 
-    def get_each_data(self, filt, sky):
-        """This methods reads a list containing the paths to several frames 
-        and opens them to add them to a new list.
+
+    def known_registrations(self, filt, acc, frames):
+        """Returns the registrations found for other versions of the same raw
+        exposures (the frames with sky for the frames without it). They are only
+        valid if the stack has the same first frame (the same pixel grid).
 
         Args:
             filt (str): Filter name
+            acc (StackAccumulator): Accumulator of the frames.
+            frames (list): Paths to the frames to add.
 
         Returns:
-            list: List of science frames for each filter (matrices)
+            dict: Registrations of the frames (name: registration).
         """
-        ccd = []
-        for frame_path in self.load_frames(filt, sky=sky):
-            ccd.append(CCDData.read(frame_path, unit='adu', hdu=0).data)
+        stored = self.registrations.get(filt)
+        if not self.reuse_transforms or stored is None or len(frames) == 0:
+            return {}
+        base = next(iter(acc.frames), os.path.basename(frames[0]))
+        if raw_exposure(base) != stored['base']:
+            return {}
+        known = {}
+        for path in frames:
+            name = os.path.basename(path)
+            if raw_exposure(name) in stored['frames']:
+                known[name] = stored['frames'][raw_exposure(name)]
+        if len(known) != 0:
+            logger.info(f"Reusing the registrations of {len(known)} frames")
+        return known
+
 
-        return ccd
+    def keep_registrations(self, filt, acc):
+        """Keeps the registrations of the frames of a stack by raw exposure, for
+        the other versions of the frames (see known_registrations).
 
+        Args:
+            filt (str): Filter name
+            acc (StackAccumulator): Accumulator of the frames.
+        """
+        if not self.reuse_transforms or len(acc.frames) == 0:
+            return
+        base = raw_exposure(next(iter(acc.frames)))
+        stored = self.registrations.get(filt)
+        if stored is None or stored['base'] != base:
+            stored = self.registrations[filt] = {'base': base, 'frames': {}}
+        stored['frames'].update({raw_exposure(name): registration
+                                 for name, registration in acc.registrations.items()})
 
 
     def aligning(self, filt, sky='SKY'): #default: 30
-        """This method aligns the science frames taken with the same filter.
+        """This method aligns the science frames taken with the same filter. The frames
+        are read and added to the running sum one at a time or, with a fixed
+        reference, registered in a pool of processes.
 
         Args:
             filt (str): Filter name
 
         Returns:
-            float: Stacked image obtained by combining multiple science frames.
+            StackResult: Stacked image (float32) obtained by combining multiple science
+            frames, with its header, WCS, number of frames and exposure time, or None if
+            there are no frames.
         """
         logger.info(f"Creating cube with frames for {filt}")
-        cube = self.get_each_data(filt, sky=sky)
-        REF = cube[0].astype('float32')
-
-        self.num=1
-        logger.info(f"Number of frames in cube is: {len(cube)}")
-        for IMG in cube[1:]:
-            try:
-                #-------------------------------------------------------------------------------
-                #Change the following line to use astroalign's register method in v1.1.0 (2025-07-25)
-                #
-                #t, __ = aa.find_transform(IMG.astype('float32'), REF, 
-                #                          max_control_points=self.conf["ALIGNING"]["max_control_points"]) #default: 30
-                #time.sleep(1)
-                ##REF = REF.view(REF.dtype.newbyteorder('<')) # Convert to little-endian
-                ##IMG = IMG.view(IMG.dtype.newbyteorder('<')) # Convert to little-endian
-                ##IMG = IMG.byteswap().newbyteorder()
-                #align, footprint = aa.apply_transform(t, IMG, REF)
-                #------------------------------------------------------------------------------
-                align, footprint = aa.register(IMG.astype('float32'), REF,
-                                               max_control_points=self.conf["ALIGNING"]["max_control_points"]) #default: 30
-                REF = REF + align
-                self.num += 1
-                logger.info(f"Image NO: {self.num}/{len(cube)}")
-            except aa.MaxIterError as e:
-                logger.error(f"{bcl.FAIL}ERROR{bcl.ENDC}: {type(e).__name__}; {str(e)}")
-                pass
-            except ValueError as e:
-                logger.error(f"{bcl.FAIL}ERROR{bcl.ENDC}: {type(e).__name__}; {str(e)}")
-                pass
-            except TypeError as e:
-                logger.error(f"{bcl.FAIL}ERROR{bcl.ENDC}: {type(e).__name__}; {str(e)}")
-                pass
-
-        return REF
+        frames = self.load_frames(filt, sky=sky)
+        acc = self.accumulator(filt, sky, frames)
+
+        logger.info(f"Number of frames in cube is: {len(frames)}")
+        new_frames = [path for path in frames if os.path.basename(path) not in acc.frames]
+        registrations = self.known_registrations(filt, acc, new_frames)
+        with ScratchCube(len(new_frames), dtype=self.dtype, path=self.scratch_dir) as cube:
+            for result in acc.add_files(new_frames, workers=self.align_workers, registrations=registrations):
+                if result is None:
+                    continue
+                if self.combine_method != 'sum':
+                    cube.append(*result)
+                if acc.num > 1:
+                    logger.info(f"Image NO: {acc.num}/{len(frames)}")
+            self.num = acc.num
+            self.stack = acc
+            self.keep_registrations(filt, acc)
+            if len(acc.failed) != 0:
+                logger.warning(f"{bcl.WARNING}{len(acc.failed)} frames could not be aligned: "
+                               f"{', '.join(sorted(acc.failed))}{bcl.ENDC}")
+
+            if acc.num == 0:
+                logger.warning(f"{bcl.WARNING}No frames to stack for {filt} and {sky}{bcl.ENDC}")
+                return None
+            if self.combine_method != 'sum':
+                logger.info(f"Combining {self.num} aligned frames with method: {self.combine_method}")
+                image, exposure, weight = cube.combine(method=self.combine_method, sigma=self.clip_sigma,
+                                                       memory_limit=self.memory_limit)
+                image *= self.num
+            else:
+                image, exposure, weight = acc.stacked(), acc.exposure.copy(), None
+
+        if acc.base_header is None or acc.base_wcs is None:
+            # Stack saved without the header of its first frame.
+            ccd = CCDData.read(frames[0], unit='adu', hdu=0)
+            acc.base_header, acc.base_wcs = ccd.header, ccd.wcs
+        if self.persist_stack and self.combine_method == 'sum':
+            acc.save(self.PATH_STACKS / f'{filt}_{sky}.npz')
+        # The stacks are accumulated in the precision of the frames, but saved in
+        # float32, as before the precision policy.
+        return StackResult(image.astype(np.float32, copy=False), acc.base_header.copy(), acc.base_wcs,
+                           acc.num, acc.total_exptime,
+                           exposure=exposure, weight=weight, failed=dict(acc.failed))
 
 
 def show_picture(cube, a=1):
@@ -160,5 +847,26 @@ def save_fits(image, header, wcs, fname, allow_nosky=True):
     """
     header['STACKED'] = 'YES'
     ccd = CCDData(data=image, header=header, wcs=wcs, unit='adu')
-    ccd.write(fname, overwrite=True)
-    logger.info(f"{bcl.OKGREEN}New image has been created: {os.path.basename(fname)}{bcl.ENDC}")
\ No newline at end of file
+    get_writer().write_ccd('aligning', ccd, fname)
+    logger.info(f"{bcl.OKGREEN}New image has been created: {os.path.basename(fname)}{bcl.ENDC}")
+
+
+def save_exposure_map(exposure, weight, header, wcs, fname):
+    """This method saves the exposure map of a stacked image (exposure time of the
+    values combined in each pixel) and, if given, its weight map (WEIGHT extension).
+
+    Args:
+        exposure (array): Exposure map (sec).
+        weight (array): Weight map, or None.
+        header (str): Header of the stacked image.
+        wcs (str): WCS information for the stacked image.
+        fname (str): Name for the exposure map.
+    """
+    hd = header.copy()
+    hd.update(wcs.to_header())
+    hd['BUNIT'] = ('s', 'Exposure time of each pixel')
+    hdul = fits.HDUList([fits.PrimaryHDU(exposure, header=hd)])
+    if weight is not None:
+        hdul.append(fits.ImageHDU(weight, header=wcs.to_header(), name='WEIGHT'))
+    get_writer().write('aligning', hdul, fname)
+    logger.info(f"{bcl.OKGREEN}New exposure map has been created: {os.path.basename(fname)}{bcl.ENDC}")
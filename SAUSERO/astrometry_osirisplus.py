@@ -19,11 +19,15 @@ Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
 import yaml, glob, os
 from pathlib import Path
 
+from astropy.io import fits
 from astropy.nddata import CCDData
 from astropy.wcs import WCS
 from astrometry_net_client import Session, FileUpload, Settings
 
 from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.precision_osirisplus import get_dtype, to_native
+from SAUSERO.sources_osirisplus import get_sources
+from SAUSERO.writer_osirisplus import get_writer
 from loguru import logger
 
 def settings(PATH_TO_CONFIG_FILE):
@@ -45,6 +49,24 @@ def settings(PATH_TO_CONFIG_FILE):
 
     return prime_service['OSIRIS']
 
+def write_xylist(img, fname, conf):
+    """This method saves the sources of a frame (from the shared catalog cache, 
+    with the parameters of the photometry) as a list of positions (FITS table 
+    with X, Y and FLUX, 1-based pixels) that Astrometry.net solves instead of 
+    detecting the sources of the image again.
+
+    Args:
+        img (CCDData): Frame.
+        fname (str): Path to the list.
+    """
+    sources = get_sources().photometry_sources(to_native(img.data, get_dtype(conf)), conf)
+    table = fits.BinTableHDU.from_columns([fits.Column(name='X', format='D', array=sources['x'] + 1.),
+                                           fits.Column(name='Y', format='D', array=sources['y'] + 1.),
+                                           fits.Column(name='FLUX', format='D', array=sources['flux'])])
+    table.writeto(fname, overwrite=True)
+    logger.info(f"List of {len(sources)} sources saved in {os.path.basename(fname)}")
+
+
 def apply_astrometrynet_client(filename, conf):
     """This method sends the stacked science frame along with settings information 
     to the Astrometry.net server through its API. Then, it receives the 
@@ -75,10 +97,16 @@ def apply_astrometrynet_client(filename, conf):
     ss.publicly_visible = 'n'
     logger.info("Settings:")
     logger.info(f"{ss}")
-    #Send the image
+    #Send the list of the sources (from the shared cache) or, without upload_sources, the image
+    upload_name = filename
+    if conf["ASTROMETRY"].get("upload_sources", True):
+        upload_name = str(Path(filename).with_suffix('.xyls'))
+        write_xylist(img, upload_name, conf)
+        ss.image_width, ss.image_height = img.shape[1], img.shape[0]
+        ss.use_sextractor = False
     s = Session(api_key=conf["ASTROMETRY"]["No_Session"])
     logger.info("API connection is ready")
-    upl = FileUpload(filename, session=s, settings=ss)
+    upl = FileUpload(upload_name, session=s, settings=ss)
     logger.info("Frame has been uploaded")
     try:
         submission = upl.submit()
@@ -117,7 +145,7 @@ def modify_WCS(best_wcs, PATH_TO_FILE):
         best_wcs = WCS(best_wcs)
         new_frame =  CCDData(data=frame.data, header=frame.header, wcs=best_wcs,
                             unit='adu')
-        new_frame.write(PATH_TO_FILE, overwrite=True)
+        get_writer().write_ccd('astrometry', new_frame, PATH_TO_FILE)
         logger.info(f"{bcl.OKGREEN}The WCS for {os.path.basename(PATH_TO_FILE)} has been updated{bcl.ENDC}")
         return new_frame
 
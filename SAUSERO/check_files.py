@@ -18,9 +18,12 @@ Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
 
 import json, os
 import pkg_resources
-import ccdproc as ccdp
 from pathlib import Path
 
+from SAUSERO.headers_osirisplus import HeaderCollection, configure_catalog
+from SAUSERO.library_osirisplus import CalibrationLibrary
+from SAUSERO.reduction_osirisplus import Reduction, library_params
+
 def read_config(config_path):
     with open(config_path, 'r') as file:
         config = json.load(file)
@@ -76,28 +79,56 @@ def classify_images(tab):
     return existence
 
 
-def check_files():
+def library_bias(conf, ic):
+    """
+    Looks in the calibration library for a masterbias valid for the science 
+    frames of the OB (see CalibrationLibrary.nearest).
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+        ic (HeaderCollection): Headers of the raw frames.
+
+    Returns:
+        bool: True if the library is enabled and has a valid masterbias.
+    """
+    library = CalibrationLibrary.from_config(conf)
+    if library is None:
+        return False
+    science = ic.files_filtered(include_path=True, OBSMODE='OsirisBroadBandImage')
+    return library.has('bias', Reduction.frames_mjd(science), params=library_params(conf, 'bias'))
+
+def check_files(conf=None):
 
-    conf = readJSON()
+    # A configuration can be given (e.g. by the batch mode) instead of configuration.json
+    if conf is None:
+        conf = readJSON()
 
     directory = Path(os.getcwd())/'raw'
 
-    ic = ccdp.ImageFileCollection(directory, keywords=['GTCPRGID','GTCOBID','OBSMODE','OBJECT','FILTER2','EXPTIME'])
+    conf['DIRECTORIES']['PATH'] = str(Path(os.getcwd()))
+    conf['DIRECTORIES']['PATH_DATA'] = str(Path(os.getcwd())/'raw')
+    conf['DIRECTORIES']['PATH_OUTPUT'] = str(Path(os.getcwd())/'reduced') 
+
+    # The headers read here are cached (and kept in the persistent catalog of the 
+    # OB) and reused by the reduction.
+    configure_catalog(conf)
+    ic = HeaderCollection(directory, keywords=['GTCPRGID','GTCOBID','OBSMODE','OBJECT','FILTER2','EXPTIME'])
     image_types = classify_images(ic.summary)
 
     conf['PRG'] = [elem for elem in set(ic.summary['GTCPRGID'].value.data) if not 'CALIB' in elem][0]
     conf['OB'] = [elem for elem in set(ic.summary['GTCOBID'].value.data) if not 'CALIB' in elem][0]
 
-    conf['DIRECTORIES']['PATH'] = str(Path(os.getcwd()))
-    conf['DIRECTORIES']['PATH_DATA'] = str(Path(os.getcwd())/'raw')
-    conf['DIRECTORIES']['PATH_OUTPUT'] = str(Path(os.getcwd())/'reduced') 
+    # The calibration library can provide the masters when the OB has no calibrations.
+    # The masterbias is only taken from it if it has one for the night. A missing 
+    # masterflat only skips the flat of its filter (see Reduction.filter_masterflat).
+    use_library = conf.get('LIBRARY', {}).get('use_library', False)
 
     # Update config based on image types
     if conf['REDUCTION']['use_BIAS']:
-        conf['REDUCTION']['use_BIAS'] = image_types['exist_BIAS']
+        conf['REDUCTION']['use_BIAS'] = image_types['exist_BIAS'] or library_bias(conf, ic)
     
     if conf['REDUCTION']['use_FLAT']:
-        conf['REDUCTION']['use_FLAT'] = image_types['exist_SKYFLAT']
+        conf['REDUCTION']['use_FLAT'] = image_types['exist_SKYFLAT'] or use_library
 
     if conf['REDUCTION']['use_STD']:
         conf['REDUCTION']['use_STD'] = (image_types['exist_STD'] and image_types['exist_SKYFLAT'] and conf['REDUCTION']['use_FLAT'])
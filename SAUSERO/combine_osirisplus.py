@@ -0,0 +1,196 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import warnings
+
+import numpy as np
+
+# Methods available to combine a data cube.
+#   trimmed_median: median after rejecting the minimum and maximum value of each pixel.
+#   median: plain median.
+#   minmax: mean after rejecting the minimum and maximum value of each pixel.
+#   sigclip: iterative sigma-clipped mean.
+COMBINE_METHODS = ('trimmed_median', 'median', 'minmax', 'sigclip')
+
+
+def stack_frames(lst_frames):
+    """Builds a frame-major data cube (frames, rows, columns) from a list of images.
+    Each frame is contiguous in memory, so the reductions along the first axis
+    run over whole rows at once.
+
+    Args:
+        lst_frames (list): List of images with the same shape.
+
+    Returns:
+        array: Data cube with shape (frames, rows, columns).
+    """
+    return np.stack(lst_frames, axis=0)
+
+
+def _partition_median(cube):
+    """Median along the first axis using a selection (np.partition) instead of a full sort.
+
+    Args:
+        cube (array): Frame-major data cube.
+
+    Returns:
+        array, array: Median image (valid for the pixels without NaN values or with 
+        all of them NaN) and boolean map of the pixels with only some NaN values.
+    """
+    n = cube.shape[0]
+    lo, hi = (n - 1) // 2, n // 2
+    part = np.partition(cube, [lo, hi], axis=0)
+    result = 0.5 * (part[lo] + part[hi])
+    del part
+
+    nans = np.isnan(cube)
+    partial = nans.any(axis=0) & ~nans.all(axis=0)
+    return result, partial
+
+
+def _median(cube):
+    """Median along the first axis. Pixels with some NaN values are computed 
+    apart with np.nanmedian.
+
+    Args:
+        cube (array): Frame-major data cube.
+
+    Returns:
+        array: Median image.
+    """
+    result, partial = _partition_median(cube)
+    if partial.any():
+        result[partial] = np.nanmedian(cube[:, partial], axis=0)
+    return result
+
+
+def _trimmed_median(cube):
+    """Median after rejecting the minimum and the maximum value of each pixel.
+    Without NaN values this is the plain median, so only the pixels with some
+    NaN need the sort (NaN values are placed at the end, as before).
+
+    Args:
+        cube (array): Frame-major data cube.
+
+    Returns:
+        array: Combined image.
+    """
+    if cube.shape[0] < 3:
+        return _median(cube)
+
+    result, partial = _partition_median(cube)
+    if partial.any():
+        sub = np.sort(cube[:, partial], axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            result[partial] = np.nanmedian(sub[1:-1], axis=0)
+    return result
+
+
+def _minmax_mean(cube):
+    """Mean after rejecting the minimum and the maximum value of each pixel.
+    It only needs the sum and the extreme values, so no sort is done.
+
+    Args:
+        cube (array): Frame-major data cube.
+
+    Returns:
+        array: Combined image.
+    """
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        nvalid = np.count_nonzero(~np.isnan(cube), axis=0)
+        total = np.nansum(cube, axis=0)
+        rejected = np.nanmin(cube, axis=0) + np.nanmax(cube, axis=0)
+        return np.where(nvalid > 2, (total - rejected) / (nvalid - 2),
+                        total / nvalid)
+
+
+def sigclip_mask(cube, sigma=3.0, maxiters=5):
+    """Values kept by the iterative sigma clipping of each pixel. The first center
+    is the median; then the values further than sigma times the standard deviation
+    are rejected and the mean of the remaining values is used as the new center.
+
+    Args:
+        cube (array): Frame-major data cube.
+        sigma (float, optional): Rejection threshold. Defaults to 3.0.
+        maxiters (int, optional): Maximum number of iterations. Defaults to 5.
+
+    Returns:
+        array, array: Boolean cube of the kept values and number of kept values of each pixel.
+    """
+    keep = ~np.isnan(cube)
+    nkeep = np.count_nonzero(keep, axis=0)
+    center = _median(cube)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(maxiters):
+            resid = cube - center
+            np.square(resid, out=resid)
+            var = np.sum(resid, axis=0, where=keep) / nkeep
+            # The rejection only removes values, so equal counts mean convergence.
+            new_keep = keep & (resid <= sigma**2 * var)
+            new_nkeep = np.count_nonzero(new_keep, axis=0)
+            del resid
+            if np.array_equal(new_nkeep, nkeep):
+                break
+            keep, nkeep = new_keep, new_nkeep
+            center = np.sum(cube, axis=0, where=keep) / nkeep
+    return keep, nkeep
+
+
+def _sigclip_mean(cube, sigma=3.0, maxiters=5):
+    """Iterative sigma-clipped mean (see sigclip_mask).
+
+    Args:
+        cube (array): Frame-major data cube.
+        sigma (float, optional): Rejection threshold. Defaults to 3.0.
+        maxiters (int, optional): Maximum number of iterations. Defaults to 5.
+
+    Returns:
+        array: Combined image.
+    """
+    keep, nkeep = sigclip_mask(cube, sigma=sigma, maxiters=maxiters)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(cube, axis=0, where=keep) / nkeep
+
+
+def combine(cube, method='trimmed_median', sigma=3.0, maxiters=5):
+    """Combines a frame-major data cube along the frames axis.
+
+    Args:
+        cube (array): Data cube with shape (frames, rows, columns).
+        method (str, optional): One of COMBINE_METHODS. Defaults to 'trimmed_median'.
+        sigma (float, optional): Rejection threshold for 'sigclip'. Defaults to 3.0.
+        maxiters (int, optional): Maximum number of iterations for 'sigclip'. Defaults to 5.
+
+    Raises:
+        ValueError: If the method is not available.
+
+    Returns:
+        array: Combined image.
+    """
+    if method == 'trimmed_median':
+        return _trimmed_median(cube)
+    elif method == 'median':
+        return _median(cube)
+    elif method == 'minmax':
+        return _minmax_mean(cube)
+    elif method == 'sigclip':
+        return _sigclip_mean(cube, sigma=sigma, maxiters=maxiters)
+    else:
+        raise ValueError(f"Unknown combine method '{method}'. Options: {', '.join(COMBINE_METHODS)}")
@@ -0,0 +1,402 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import fnmatch, os, sqlite3, threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from astropy import wcs
+from astropy.io import fits
+from astropy.table import MaskedColumn, Table
+
+
+# Extensions recognized as FITS files (as ccdproc.ImageFileCollection).
+FITS_EXTENSIONS = ('.fits', '.fit', '.fts', '.fits.gz', '.fit.gz', '.fts.gz')
+
+
+class HeaderCatalog:
+    """Persistent catalog (SQLite) of the headers of the raw and reduced frames. Each
+    file is stored with its modification time and size, so a header is parsed again
+    only when its file changes, also between runs. The keywords of every header are 
+    indexed, so the frames with some keyword values are found with a query.
+    """
+
+    def __init__(self, path):
+        """Catalog initialization.
+
+        Args:
+            path (str): Path to the database.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn, self._pid = None, None
+
+
+    def _connect(self):
+        """Connection to the database (a new one in each process)."""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False)
+            self._pid = os.getpid()
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, directory TEXT,
+                    name TEXT, mtime INTEGER, size INTEGER, header TEXT);
+                CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+                CREATE TABLE IF NOT EXISTS cards (path TEXT, keyword TEXT, value,
+                    PRIMARY KEY (path, keyword));
+                CREATE INDEX IF NOT EXISTS cards_value ON cards (keyword, value COLLATE NOCASE);
+            """)
+        return self._conn
+
+
+    def lookup(self, path, mtime, size):
+        """Returns the header of a file if it is in the catalog and has not changed.
+
+        Args:
+            path (str): Absolute path to the file.
+            mtime (int): Modification time (ns).
+            size (int): Size of the file.
+
+        Returns:
+            Header: The header, or None.
+        """
+        with self._lock:
+            row = self._connect().execute("SELECT header FROM files WHERE path=? AND mtime=? AND size=?",
+                                          (path, mtime, size)).fetchone()
+        return fits.Header.fromstring(row[0]) if row is not None else None
+
+
+    def store(self, path, mtime, size, header):
+        """Adds (or replaces) the header of a file and its indexed keywords.
+
+        Args:
+            path (str): Absolute path to the file.
+            mtime (int): Modification time (ns).
+            size (int): Size of the file.
+            header (Header): Header of the file.
+        """
+        cards = {}
+        for key, value in header.items():
+            if key in ('', 'COMMENT', 'HISTORY') or key in cards:
+                continue
+            cards[key] = value if isinstance(value, (str, int, float)) else str(value)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM cards WHERE path=?", (path,))
+                conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                             (path, os.path.dirname(path), os.path.basename(path), mtime, size,
+                              header.tostring()))
+                conn.executemany("INSERT INTO cards VALUES (?, ?, ?)",
+                                 [(path, key, value) for key, value in cards.items()])
+
+
+    def prune(self, directory, names):
+        """Removes the files of a directory that do not exist any more.
+
+        Args:
+            directory (str): Absolute path to the directory.
+            names (list): Names of the files in the directory.
+        """
+        with self._lock:
+            conn = self._connect()
+            stored = [row[0] for row in conn.execute("SELECT name FROM files WHERE directory=?",
+                                                     (directory,))]
+            missing = [os.path.join(directory, name) for name in set(stored) - set(names)]
+            if len(missing) != 0:
+                with conn:
+                    conn.executemany("DELETE FROM files WHERE path=?", [(p,) for p in missing])
+                    conn.executemany("DELETE FROM cards WHERE path=?", [(p,) for p in missing])
+
+
+    def query(self, directory, **kwd):
+        """Returns the names of the files of a directory whose keywords have the 
+        given values (strings are compared without case, '*' matches any value).
+
+        Args:
+            directory (str): Absolute path to the directory.
+
+        Returns:
+            set: Names of the files.
+        """
+        sql = "SELECT name FROM files WHERE directory=?"
+        args = [directory]
+        for key, value in kwd.items():
+            if value == '*':
+                sql += " AND path IN (SELECT path FROM cards WHERE keyword=?)"
+                args.append(key.upper())
+            else:
+                sql += " AND path IN (SELECT path FROM cards WHERE keyword=? AND value=? COLLATE NOCASE)"
+                args.extend([key.upper(), value])
+        with self._lock:
+            return set(row[0] for row in self._connect().execute(sql, args))
+
+
+class HeaderCache:
+    """Cache of the headers of the frames. Each header is parsed once, the first time
+    it is needed, and every stage that needs it (classification of the frames,
+    headers of the reduced frames, WCS) reads it from here. The headers are checked
+    against the modification time and size of their files, so a rewritten frame is
+    read again. At most max_headers headers are kept in memory (the least recently
+    used are dropped). With a HeaderCatalog, the headers are kept between runs.
+    """
+
+    def __init__(self, catalog=None, max_headers=1024):
+        self.catalog = catalog
+        self.max_headers = max_headers
+        self._headers = OrderedDict()
+        self._wcs_headers = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+
+    @staticmethod
+    def _stamp(key):
+        st = os.stat(key)
+        return st.st_mtime_ns, st.st_size
+
+
+    def _get(self, path):
+        key = self._key(path)
+        stamp = self._stamp(key)
+        with self._lock:
+            cached = self._headers.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._headers.move_to_end(key)
+                return cached[1]
+
+        hd = self.catalog.lookup(key, *stamp) if self.catalog is not None else None
+        if hd is None:
+            hd = fits.getheader(key)
+            if self.catalog is not None:
+                self.catalog.store(key, *stamp, hd)
+        with self._lock:
+            self._headers[key] = (stamp, hd)
+            self._headers.move_to_end(key)
+            self._wcs_headers.pop(key, None)
+            while len(self._headers) > self.max_headers:
+                old, __ = self._headers.popitem(last=False)
+                self._wcs_headers.pop(old, None)
+        return hd
+
+
+    def header(self, path):
+        """Returns the primary header of a frame.
+
+        Args:
+            path (str): Path to the frame.
+
+        Returns:
+            Header: Copy of the header (it can be modified).
+        """
+        return self._get(path).copy()
+
+
+    def wcs_header(self, path):
+        """Returns the WCS of a frame as a header.
+
+        Args:
+            path (str): Path to the frame.
+
+        Returns:
+            Header: Header with the WCS keywords.
+        """
+        key = self._key(path)
+        hd = self._get(path)
+        with self._lock:
+            hd_wcs = self._wcs_headers.get(key)
+        if hd_wcs is None:
+            hd_wcs = wcs.WCS(hd).to_header()
+            with self._lock:
+                if key in self._headers:
+                    self._wcs_headers[key] = hd_wcs
+        return hd_wcs.copy()
+
+
+    def value(self, path, keyword, default=None):
+        """Returns the value of a keyword of the header of a frame.
+        """
+        return self._get(path).get(keyword, default)
+
+
+    def forget(self, path):
+        """Removes a frame from the cache (e.g. because it has been rewritten)."""
+        key = self._key(path)
+        with self._lock:
+            self._headers.pop(key, None)
+            self._wcs_headers.pop(key, None)
+
+
+# Cache shared by all the stages of a run.
+HEADERS = HeaderCache()
+
+
+def configure_catalog(conf):
+    """Connects the shared cache to the persistent catalog described in the 
+    configuration (CATALOG section), if it is enabled, and sets the number of
+    headers kept in memory (max_headers). The catalog is kept, by default, in
+    the .headers.sqlite file of the reduced frames of the OB.
+
+    Args:
+        conf (dict): Collection of configuration parameters (DIRECTORIES must be set).
+    """
+    cat_conf = conf.get('CATALOG', {})
+    HEADERS.max_headers = cat_conf.get('max_headers', 1024)
+    if cat_conf.get('use_catalog', True):
+        path = cat_conf.get('PATH') or Path(conf['DIRECTORIES']['PATH_OUTPUT'])/'.headers.sqlite'
+        HEADERS.catalog = HeaderCatalog(path)
+    else:
+        HEADERS.catalog = None
+
+
+def _masked_column(name, values):
+    """Builds a column in which the missing values (None) are masked."""
+    present = [v for v in values if v is not None]
+    if len(set(type(v) for v in present)) > 1 and any(isinstance(v, str) for v in present):
+        values = [str(v) if v is not None else None for v in values]
+        present = [v for v in values if v is not None]
+    fill = type(present[0])() if len(present) != 0 else ''
+    return MaskedColumn([fill if v is None else v for v in values],
+                        mask=[v is None for v in values], name=name)
+
+
+class HeaderCollection:
+    """Collection of the frames of a directory with a summary table of their headers.
+    It follows the interface of ccdproc.ImageFileCollection used by the pipeline
+    (files, summary and files_filtered), but the headers come from the HeaderCache,
+    so they are parsed only once per run (or once, with the persistent catalog). 
+    The summary table is built only when it is used; files_filtered queries the 
+    catalog when there is one.
+    """
+
+    def __init__(self, location, keywords='*', glob_include=None, glob_exclude=None,
+                 cache=HEADERS):
+        """Collection initialization.
+
+        Args:
+            location (str): Directory with the frames.
+            keywords (str or list, optional): Keywords in the summary. '*' means all
+            of them, in lower case. Defaults to '*'.
+            glob_include (str, optional): Pattern of the files included. Defaults to None.
+            glob_exclude (str, optional): Pattern of the files excluded. Defaults to None.
+            cache (HeaderCache, optional): Cache of headers. Defaults to HEADERS.
+        """
+        self.location = Path(location)
+        self.keywords = keywords
+        self.cache = cache
+        files = sorted(name for name in os.listdir(self.location)
+                       if name.lower().endswith(FITS_EXTENSIONS))
+        if glob_include is not None:
+            files = fnmatch.filter(files, glob_include)
+        if glob_exclude is not None:
+            files = [name for name in files if not fnmatch.fnmatch(name, glob_exclude)]
+        self.files = files
+        self._table = None
+
+        # Every header is loaded (and stored in the catalog) here.
+        for name in self.files:
+            self.cache._get(self.location/name)
+        if self.cache.catalog is not None:
+            self.cache.catalog.prune(self.cache._key(self.location), os.listdir(self.location))
+
+
+    @property
+    def summary(self):
+        """Table with a row per file and a column per keyword."""
+        if self._table is None:
+            self._table = self._summary()
+        return self._table
+
+
+    def _summary(self):
+        rows = []
+        for name in self.files:
+            hd = self.cache._get(self.location/name)
+            if self.keywords == '*':
+                row = {}
+                for key, value in hd.items():
+                    if key in ('', 'COMMENT', 'HISTORY'):
+                        continue
+                    row.setdefault(key.lower(), value)
+            else:
+                row = {key: hd.get(key) for key in self.keywords}
+            rows.append(row)
+
+        if self.keywords == '*':
+            names = []
+            for row in rows:
+                names.extend(key for key in row if key not in names)
+        else:
+            names = list(self.keywords)
+
+        table = Table(masked=True)
+        table['file'] = self.files
+        for name in names:
+            table[name] = _masked_column(name, [row.get(name) for row in rows])
+        return table
+
+
+    def files_filtered(self, include_path=False, **kwd):
+        """Returns the files whose keywords have the given values. The names of the
+        keywords and the comparison of strings are case insensitive and '*' matches 
+        any value.
+
+        Args:
+            include_path (bool, optional): Return the full paths. Defaults to False.
+
+        Returns:
+            list: Names (or paths) of the files.
+        """
+        catalog = self.cache.catalog
+        if self.keywords != '*':
+            names = {key.lower(): key for key in self.keywords}
+            if any(key.lower() not in names for key in kwd):
+                return []
+            kwd = {names[key.lower()]: value for key, value in kwd.items()}
+        else:
+            kwd = {key.lower(): value for key, value in kwd.items()}
+        if catalog is not None and all(isinstance(value, str) for value in kwd.values()):
+            found = catalog.query(self.cache._key(self.location), **kwd)
+            files = [name for name in self.files if name in found]
+            if include_path:
+                return [str(self.location/name) for name in files]
+            return files
+
+        matches = np.ones(len(self.files), dtype=bool)
+        for key, value in kwd.items():
+            if key not in self.summary.colnames:
+                return []
+            column = self.summary[key]
+            present = ~np.ma.getmaskarray(column)
+            if value == '*':
+                matches &= present
+            elif isinstance(value, str):
+                matches &= present & np.array([str(v).lower() == value.lower() for v in column])
+            else:
+                matches &= present & (np.ma.getdata(column) == value)
+
+        files = [name for name, match in zip(self.files, matches) if match]
+        if include_path:
+            return [str(self.location/name) for name in files]
+        return files
@@ -0,0 +1,487 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import hashlib, json, os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+from astropy.io import fits
+
+from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.precision_osirisplus import to_native
+from loguru import logger
+
+# Digests of the raw frames hashed in this run (see CalibrationLibrary.file_digest).
+_DIGESTS = {}
+_DIGESTS_LOCK = threading.Lock()
+
+
+class CalibrationLibrary:
+    """Persistent on-disk library of master calibration frames (bias, flat, fringe).
+    Each master is stored under a key built from the list of input frames and the
+    parameters used to combine them, so the same calibration set is combined only
+    once, whatever the OB or the night being reduced. The library can also return
+    the calibration nearest in time, and it is limited in size: the least recently
+    used masters are removed first. Some masters (the fringe) are running masters,
+    built incrementally from the contributions of several OBs and nights.
+    """
+
+    def __init__(self, path=None, max_size=4096, max_days=3.0):
+        """Library initialization.
+
+        Args:
+            path (str, optional): Directory of the library. Defaults to ~/.sausero/calibrations.
+            max_size (float, optional): Maximum size of the library in MB. Defaults to 4096.
+            max_days (float, optional): Maximum time distance (days) for the nearest
+            calibration lookup. Defaults to 3.0.
+        """
+        self.PATH = Path(path) if path else Path.home()/'.sausero'/'calibrations'
+        self.PATH.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.PATH/'index.json'
+        self.lock_path = self.PATH/'index.lock'
+        self.max_size = max_size
+        self.max_days = max_days
+
+
+    @classmethod
+    def from_config(cls, conf):
+        """Creates the library described in the configuration, if it is enabled.
+
+        Args:
+            conf (dict): Collection of configuration parameters.
+
+        Returns:
+            CalibrationLibrary: The library, or None if it is disabled.
+        """
+        lib_conf = conf.get('LIBRARY', {})
+        if not lib_conf.get('use_library', False):
+            return None
+        return cls(path=lib_conf.get('PATH'), max_size=lib_conf.get('max_size', 4096),
+                   max_days=lib_conf.get('max_days', 3.0))
+
+
+    @staticmethod
+    def file_digest(path):
+        """Returns the SHA-256 of the content of a file. The digests are kept for the
+        run (by path, size and modification time), so each frame is hashed once.
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            str: Hexadecimal digest.
+        """
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with _DIGESTS_LOCK:
+            digest = _DIGESTS.get(stamp)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(2**22), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            with _DIGESTS_LOCK:
+                _DIGESTS[stamp] = digest
+        return digest
+
+
+    @staticmethod
+    def make_key(frames, params):
+        """Builds the key of a master from its input frames and combine parameters.
+        The frames are identified by the digest of their content, so the key does
+        not change when the raw data are copied to another directory or renamed,
+        and two different frames never share it.
+
+        Args:
+            frames (list): Paths to the input frames.
+            params (dict): Parameters used to create the master.
+
+        Returns:
+            str: Hexadecimal key.
+        """
+        content = {'frames': sorted(CalibrationLibrary.file_digest(fr) for fr in frames),
+                   'params': params}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(lock_path, timeout=60.):
+        """Lock between processes based on the exclusive creation of a file. While
+        the lock is held, its modification time is refreshed every timeout / 4
+        seconds, so a lock not refreshed for longer than the timeout belongs to a
+        process that died and is removed as stale."""
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    stale = time.time() - os.path.getmtime(lock_path) > timeout
+                except FileNotFoundError:
+                    continue
+                if stale:
+                    logger.warning(f"{bcl.WARNING}Removing stale lock of the calibration library{bcl.ENDC}")
+                    try:
+                        os.remove(lock_path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                time.sleep(0.1)
+
+        stop = threading.Event()
+        def heartbeat():
+            while not stop.wait(timeout / 4.):
+                try:
+                    os.utime(lock_path)
+                except FileNotFoundError:
+                    return
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            os.close(fd)
+            os.remove(lock_path)
+
+
+    def _locked(self, timeout=60.):
+        """Serializes the access to the index between processes."""
+        return self._file_lock(self.lock_path, timeout=timeout)
+
+
+    def _read_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as file:
+                return json.load(file)
+        return {}
+
+
+    def _write_index(self, index):
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+
+    def _read_entry(self, key, entry, index):
+        """Opens the master of an entry and updates its last use."""
+        path = self.PATH/entry['file']
+        if not os.path.exists(path):
+            index.pop(key, None)
+            return None
+        # The master keeps the floating point type it was created with.
+        data = fits.getdata(path)
+        data = to_native(data, data.dtype)
+        entry['last_used'] = time.time()
+        return data
+
+
+    def get(self, key):
+        """Returns the master stored under a key.
+
+        Args:
+            key (str): Key of the master.
+
+        Returns:
+            array: The master, or None if it is not in the library.
+        """
+        with self._locked():
+            index = self._read_index()
+            if key not in index:
+                return None
+            data = self._read_entry(key, index[key], index)
+            self._write_index(index)
+        if data is not None:
+            logger.info(f"{bcl.OKGREEN}Master {index[key]['kind']} found in the calibration library{bcl.ENDC}")
+        return data
+
+
+    def _candidates(self, index, kind, mjd, filt=None, params=None):
+        """Entries of a kind valid for a date, sorted by their time distance."""
+        candidates = [(abs(entry['mjd'] - mjd), key) for key, entry in index.items()
+                      if entry['kind'] == kind and entry['filter'] == filt
+                      and entry['mjd'] is not None
+                      and all((entry['params'] or {}).get(k) == v
+                              for k, v in (params or {}).items())]
+        return sorted(cand for cand in candidates if cand[0] <= self.max_days)
+
+
+    def get_or_build(self, key, build, kind, mjd=None, filt=None, params=None, timeout=3600.):
+        """Returns the master stored under a key, building and storing it if it is not 
+        in the library. When several processes (e.g. OBs reduced in parallel) need the 
+        same master, only one of them builds it and the others wait and read it.
+
+        Args:
+            key (str): Key of the master.
+            build (callable): Function without arguments that creates the master.
+            kind (str): Type of master (bias, flat, fringe).
+            mjd (float, optional): Modified Julian Date of the input frames. Defaults to None.
+            filt (str, optional): Filter of the master. Defaults to None.
+            params (dict, optional): Parameters used to create the master. Defaults to None.
+            timeout (float, optional): Seconds without a refresh after which the
+            lock of a build is considered stale. Defaults to 3600.
+
+        Returns:
+            array: The master.
+        """
+        with self._file_lock(self.PATH/f"{key[:16]}.build", timeout=timeout):
+            data = self.get(key)
+            if data is None:
+                data = build()
+                self.store(key, data, kind, mjd=mjd, filt=filt, params=params)
+        return data
+
+
+    def nearest(self, kind, mjd, filt=None, params=None):
+        """Returns the master of a kind nearest in time to a given date.
+
+        Args:
+            kind (str): Type of master (bias, flat, fringe).
+            mjd (float): Modified Julian Date of the observation.
+            filt (str, optional): Filter of the master. Defaults to None.
+            params (dict, optional): Only masters created with these parameters
+            (the stored parameters may include more) are valid. Defaults to None.
+
+        Returns:
+            array, str: The master and its key, or None, None if there is no
+            valid master within max_days.
+        """
+        if mjd is None:
+            return None, None
+        with self._locked():
+            index = self._read_index()
+            candidates = self._candidates(index, kind, mjd, filt=filt, params=params)
+            if len(candidates) == 0:
+                return None, None
+            distance, key = candidates[0]
+            data = self._read_entry(key, index[key], index)
+            self._write_index(index)
+        if data is None:
+            return None, None
+        logger.info(f"{bcl.OKGREEN}Using the master {kind} from the calibration library "
+                    f"taken {distance:.2f} days away{bcl.ENDC}")
+        return data, key
+
+
+    def has(self, kind, mjd, filt=None, params=None):
+        """Tells whether the library has a valid master of a kind for a date (see
+        nearest), without reading it.
+
+        Args:
+            kind (str): Type of master (bias, flat, fringe).
+            mjd (float): Modified Julian Date of the observation.
+            filt (str, optional): Filter of the master. Defaults to None.
+            params (dict, optional): Parameters the master must have. Defaults to None.
+
+        Returns:
+            bool: True if nearest would find a master.
+        """
+        if mjd is None:
+            return False
+        with self._locked():
+            index = self._read_index()
+            candidates = self._candidates(index, kind, mjd, filt=filt, params=params)
+            return len(candidates) != 0 and os.path.exists(self.PATH/index[candidates[0][1]]['file'])
+
+
+    def store(self, key, data, kind, mjd=None, filt=None, params=None):
+        """Stores a master in the library and removes the least recently used
+        masters if the library is larger than its maximum size.
+
+        Args:
+            key (str): Key of the master.
+            data (array): The master.
+            kind (str): Type of master (bias, flat, fringe).
+            mjd (float, optional): Modified Julian Date of the input frames. Defaults to None.
+            filt (str, optional): Filter of the master. Defaults to None.
+            params (dict, optional): Parameters used to create the master. Defaults to None.
+        """
+        fname = self._write_master(key, data, kind, mjd, filt)
+        with self._locked():
+            index = self._read_index()
+            index[key] = {'file': fname, 'kind': kind, 'filter': filt, 'mjd': mjd,
+                          'params': params, 'size': os.path.getsize(self.PATH/fname),
+                          'created': time.time(), 'last_used': time.time()}
+            self._evict(index, keep=key)
+            self._write_index(index)
+        logger.info(f"{bcl.OKGREEN}Master {kind} stored in the calibration library{bcl.ENDC}")
+
+
+    def _write_master(self, key, data, kind, mjd=None, filt=None):
+        """Writes the file of a master (atomically) and returns its name."""
+        fname = f"{kind}_{filt}_{key[:16]}.fits" if filt else f"{kind}_{key[:16]}.fits"
+        hd = fits.Header()
+        hd['CALKIND'] = (kind, 'Type of master')
+        hd['CALKEY'] = key[:64]
+        if filt is not None:
+            hd['FILTRO'] = filt
+        if mjd is not None:
+            hd['MJD-OBS'] = (mjd, 'Mean MJD of the input frames')
+        tmp_path = self.PATH/(fname + '.tmp')
+        fits.PrimaryHDU(data, header=hd).writeto(tmp_path, overwrite=True)
+        os.replace(tmp_path, self.PATH/fname)
+        return fname
+
+
+    def find_contribution(self, kind, contribution):
+        """Returns the running master that already includes a contribution.
+
+        Args:
+            kind (str): Type of master (fringe).
+            contribution (str): Key of the contribution (see make_key).
+
+        Returns:
+            array, str: The running master and its key, or None, None.
+        """
+        with self._locked():
+            index = self._read_index()
+            for key, entry in index.items():
+                if entry['kind'] == kind and contribution in entry.get('contributors', []):
+                    data = self._read_entry(key, entry, index)
+                    self._write_index(index)
+                    if data is not None:
+                        return data, key
+        return None, None
+
+
+    def accumulate(self, contribution, data, kind, mjd, filt=None, params=None, weight=1):
+        """Adds a normalized frame to the running master of a kind nearest in time 
+        (within max_days and with the same parameters), or starts a new one. The 
+        running master is the weighted mean of its contributions, so only one image 
+        is kept whatever the number of OBs. A contribution is never added twice.
+
+        Args:
+            contribution (str): Key of the contribution (see make_key).
+            data (array): Normalized frame of the contribution.
+            kind (str): Type of master (fringe).
+            mjd (float): Modified Julian Date of the contribution.
+            filt (str, optional): Filter of the master. Defaults to None.
+            params (dict, optional): Parameters of the master. Defaults to None.
+            weight (float, optional): Weight of the contribution (e.g. number of 
+            frames). Defaults to 1.
+
+        Returns:
+            array, str: The running master and its key.
+        """
+        master, key = self.find_contribution(kind, contribution)
+        if master is not None:
+            return master, key
+
+        with self._locked():
+            index = self._read_index()
+            master, entry = None, None
+            candidates = self._candidates(index, kind, mjd, filt=filt, params=params) if mjd is not None else []
+            for distance, key in candidates:
+                entry = index[key]
+                master = self._read_entry(key, entry, index)
+                if master is not None:
+                    break
+            if master is None:
+                key = hashlib.sha256(f"{kind}:{contribution}".encode()).hexdigest()
+                entry = {'kind': kind, 'filter': filt, 'mjd': mjd, 'mjd_min': mjd,
+                         'mjd_max': mjd, 'params': params, 'weight': 0, 'contributors': [],
+                         'created': time.time()}
+                master = data.copy()
+            else:
+                # Running weighted mean: only the master is kept in memory and on disk.
+                master = master + (data - master) * (weight / (entry['weight'] + weight))
+                entry['mjd'] = (entry['mjd'] * entry['weight'] + mjd * weight) / (entry['weight'] + weight)
+                entry['mjd_min'] = min(entry.get('mjd_min', mjd), mjd)
+                entry['mjd_max'] = max(entry.get('mjd_max', mjd), mjd)
+            entry['weight'] += weight
+            entry['contributors'].append(contribution)
+            entry['file'] = self._write_master(key, master, kind, entry['mjd'], filt)
+            entry['size'] = os.path.getsize(self.PATH/entry['file'])
+            entry['last_used'] = time.time()
+            index[key] = entry
+            self._evict(index, keep=key)
+            self._write_index(index)
+        logger.info(f"{bcl.OKGREEN}Running master {kind} updated in the calibration library "
+                    f"({len(entry['contributors'])} contributions){bcl.ENDC}")
+        return master, key
+
+
+    @staticmethod
+    def _param(params, key):
+        """Returns a parameter of a master (nested keys joined with dots), or None."""
+        for part in key.split('.'):
+            if not isinstance(params, dict):
+                return None
+            params = params.get(part)
+        return params
+
+
+    def invalidate(self, kind=None, mjd_min=None, mjd_max=None, params=None):
+        """Removes the masters of a kind taken within a range of dates and/or 
+        created with some parameters (e.g. an old instrument configuration).
+
+        Args:
+            kind (str, optional): Type of master. Defaults to None (all of them).
+            mjd_min (float, optional): Start of the range (MJD). Defaults to None.
+            mjd_max (float, optional): End of the range (MJD). Defaults to None.
+            params (dict, optional): Only the masters with these parameters are 
+            removed. The keys of nested parameters are joined with dots (e.g.
+            config.FILTER4 for a keyword of the instrument configuration of the
+            fringe). Defaults to None.
+
+        Returns:
+            int: Number of masters removed.
+        """
+        removed = 0
+        with self._locked():
+            index = self._read_index()
+            for key in list(index):
+                entry = index[key]
+                first = entry.get('mjd_min', entry['mjd'])
+                last = entry.get('mjd_max', entry['mjd'])
+                if kind is not None and entry['kind'] != kind:
+                    continue
+                if (mjd_min is not None or mjd_max is not None) and first is None:
+                    continue
+                if mjd_min is not None and last < mjd_min:
+                    continue
+                if mjd_max is not None and first > mjd_max:
+                    continue
+                if not all(self._param(entry['params'], k) == v for k, v in (params or {}).items()):
+                    continue
+                index.pop(key)
+                if os.path.exists(self.PATH/entry['file']):
+                    os.remove(self.PATH/entry['file'])
+                removed += 1
+            self._write_index(index)
+        logger.info(f"{removed} masters removed from the calibration library")
+        return removed
+
+
+    def _evict(self, index, keep=None):
+        """Removes the least recently used masters until the library fits in max_size."""
+        total = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_size * 2**20:
+                break
+            if key == keep:
+                continue
+            entry = index.pop(key)
+            total -= entry['size']
+            if os.path.exists(self.PATH/entry['file']):
+                os.remove(self.PATH/entry['file'])
+            logger.info(f"Master {entry['kind']} removed from the calibration library")
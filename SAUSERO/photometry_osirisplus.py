@@ -29,6 +29,8 @@ from astropy.visualization import LogStretch,imshow_norm, ZScaleInterval
 from matplotlib.patches import Ellipse
 
 from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.precision_osirisplus import get_dtype, to_native
+from SAUSERO.sources_osirisplus import get_sources
 from loguru import logger
 import pkg_resources
 
@@ -115,22 +117,16 @@ def photometry(programa, bloque, filename, conf, extinction_dict=extinction_dict
     logger.info("STD's FoV has been saved as a PNG file")
 
     # Extract Sources
-    frame_data = frame.data.astype(frame.data.dtype.newbyteorder('='))
+    frame_data = to_native(frame.data, get_dtype(conf))
 
     bkg = sep.Background(frame_data)
     logger.info(f"Background estimated: {bkg.globalback:.3f} +- {bkg.globalrms:.3f}")
 
-    kernel = np.array([[1., 2., 3., 2., 1.],
-                   [2., 3., 5., 3., 2.],
-                   [3., 5., 8., 5., 3.],
-                   [2., 3., 5., 3., 2.],
-                   [1., 2., 3., 2., 1.]])
-
     clean_data = frame_data - bkg
     logger.info("Background subtracted")
 
-    objects = sep.extract(clean_data, conf["PHOTOMETRY"]["threshold"], 
-                          err=bkg.globalrms, filter_kernel=kernel)
+    # The sources are detected once per frame (they are shared with the astrometry).
+    objects = get_sources().photometry_sources(frame_data, conf)
     
     logger.info("Objects catalogue in FoV has been created")
 
@@ -0,0 +1,82 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+
+import numpy as np
+
+from SAUSERO.Color_Codes import bcolors as bcl
+from loguru import logger
+
+# Floating point types available for the data of the frames.
+PRECISIONS = ('float32', 'float64')
+
+
+def get_dtype(conf):
+    """Returns the floating point type selected in the configuration (PRECISION section).
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+
+    Raises:
+        ValueError: If the type is not available.
+
+    Returns:
+        dtype: Native-endian floating point type.
+    """
+    name = conf.get('PRECISION', {}).get('dtype', 'float64')
+    if name not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{name}'. Options: {', '.join(PRECISIONS)}")
+    return np.dtype(name).newbyteorder('=')
+
+
+def to_native(data, dtype=np.float64):
+    """Converts an image to a native-endian array of the given type. FITS data are
+    big-endian, and sep and astroalign need native byte order, so the frames are
+    converted once when they are loaded. No copy is made if the image already has
+    the right type.
+
+    Args:
+        data (array): Image.
+        dtype (dtype, optional): Floating point type. Defaults to float64.
+
+    Returns:
+        array: Image in native byte order.
+    """
+    return np.asarray(data, dtype=np.dtype(dtype).newbyteorder('='))
+
+
+def compare_precision(name, data, reference):
+    """Reports the difference between an image and its float64 reference.
+
+    Args:
+        name (str): Name of the image in the report.
+        data (array): Image computed with the selected precision.
+        reference (array): Same image computed in float64.
+
+    Returns:
+        float, float: Maximum absolute difference and the same difference relative
+        to the maximum absolute value of the reference (sky-subtracted frames are
+        close to zero, so the pixel-wise relative difference is not meaningful).
+    """
+    diff = np.abs(np.asarray(data, dtype=np.float64) - reference)
+    max_abs = float(np.nanmax(diff)) if np.any(np.isfinite(diff)) else 0.0
+    peak = float(np.nanmax(np.abs(reference))) if np.any(np.isfinite(reference)) else 0.0
+    max_rel = max_abs / peak if peak > 0 else 0.0
+    logger.info(f"{bcl.OKBLUE}Precision check {name}: max |diff| = {max_abs:.3e}, "
+                f"relative to the peak = {max_rel:.3e}{bcl.ENDC}")
+    return max_abs, max_rel
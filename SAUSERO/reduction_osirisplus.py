@@ -16,14 +16,17 @@ Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
 Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
 """
 
-import os, sys, time, json, logging
+import os, sys, time, json, logging, threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 from astropy import units as u
 from astropy import wcs
 from astropy.nddata import CCDData
 from astropy.io import fits
-import ccdproc as ccdp
+from astropy.time import Time
 from matplotlib import pyplot as plt
 import numpy as np
 import yaml as py
@@ -31,6 +34,12 @@ from lacosmic.core import lacosmic
 import sep
 
 from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.combine_osirisplus import combine, stack_frames
+from SAUSERO.headers_osirisplus import HEADERS, HeaderCollection
+from SAUSERO.library_osirisplus import CalibrationLibrary
+from SAUSERO.writer_osirisplus import get_writer
+from SAUSERO.precision_osirisplus import compare_precision, get_dtype
+from SAUSERO.sky_osirisplus import subtract_running_sky
 from loguru import logger
 
 import logging, inspect
@@ -81,6 +90,203 @@ class InterceptHandler(logging.Handler):
 
 logging.basicConfig(handlers=[InterceptHandler()], level=logging.INFO, force=False)
 
+# Trim section of the OSIRIS+ detector (rows, columns) in raw frame coordinates.
+TRIM_ROWS = (230, 2026)
+TRIM_COLS = (28, 2060)
+
+# Header keywords of the instrument configuration that separate the running master
+# fringes of the library: the filter wheels, the binning and the readout speed.
+FRINGE_KEYWORDS = ['FILTER1', 'FILTER2', 'FILTER3', 'FILTER4', 'CCDBIN1', 'CCDBIN2', 'RSPEED']
+
+
+def filter_wheel(summary):
+    """Finds the filter wheel used by the frames of an OB: the first of filter1, filter2
+    and filter3 with a filter (not OPEN) in some frame that is not a bias, or filter4
+    when the four wheels are OPEN. The frames are classified by the value of this wheel.
+
+    Args:
+        summary (Table): Table with the columns obsmode and filter1 to filter4 (e.g.
+        the summary of a HeaderCollection).
+
+    Returns:
+        str: Name of the wheel, or None if the filter setup is not compatible.
+    """
+    not_bias = (summary['obsmode'] != 'OsirisBias')
+    for wheel in ['filter1', 'filter2', 'filter3']:
+        if len(list(set(summary[wheel][not_bias & (summary[wheel] != 'OPEN')]))) >= 1:
+            return wheel
+    all_open = not_bias & (summary['filter1'] == 'OPEN') & (summary['filter2'] == 'OPEN')\
+        & (summary['filter3'] == 'OPEN') & (summary['filter4'] == 'OPEN')
+    if len(list(set(summary['filter4'][all_open]))) >= 1:
+        return 'filter4'
+    return None
+
+
+def library_params(conf, kind):
+    """Parameters of the configuration that define a master in the calibration 
+    library (the Reduction adds the BPM, see Reduction.combine_params).
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+        kind (str): Type of master (bias, flat, fringe).
+
+    Returns:
+        dict: Parameters used to create the master.
+    """
+    reduction = conf.get('REDUCTION', {})
+    return {'kind': kind, 'method': reduction.get('combine_method', 'trimmed_median'),
+            'sigma': reduction.get('clip_sigma', 3.0),
+            'trim': [list(TRIM_ROWS), list(TRIM_COLS)], 'dtype': get_dtype(conf).name}
+
+
+def _lacosmic_image(data, kwargs):
+    """Runs LACosmic over an image and returns the cleaned image. It is defined at 
+    module level so it can be sent to the worker processes.
+    """
+    return lacosmic(data, **kwargs)[0].astype(data.dtype, copy=False)
+
+
+def _tile_edges(size, ntiles, halo):
+    """Splits an axis in ntiles intervals and adds a halo to each of them.
+
+    Returns:
+        list: For each tile, (start, end) with the halo and (start, end) of the 
+        interior, the part of the result that is kept.
+    """
+    edges = np.linspace(0, size, ntiles + 1).astype(int)
+    return [((max(0, lo - halo), min(size, hi + halo)), (lo, hi))
+            for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+# Pools of processes of remove_cosmics (one per number of workers), kept for the run.
+_COSMICS_POOLS = {}
+_COSMICS_LOCK = threading.Lock()
+
+
+def _cosmics_pool(workers):
+    """Returns the pool of processes of remove_cosmics. The processes are started
+    with 'spawn', not forked: the pool can be created from a thread (e.g. a filter
+    of map_filters) while other threads hold locks (logger, writer), which a forked
+    process would inherit locked. Since spawning is slow, the pool is created once
+    and shared by the threads."""
+    with _COSMICS_LOCK:
+        if workers not in _COSMICS_POOLS:
+            _COSMICS_POOLS[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                          mp_context=multiprocessing.get_context('spawn'))
+        return _COSMICS_POOLS[workers]
+
+
+def _drop_cosmics_pool(workers, pool):
+    """Removes a broken pool from the cache, so the next call creates a new one."""
+    with _COSMICS_LOCK:
+        if _COSMICS_POOLS.get(workers) is pool:
+            del _COSMICS_POOLS[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_cosmics_pools():
+    """Stops the processes of the pools of remove_cosmics (at the end of an OB)."""
+    with _COSMICS_LOCK:
+        pools = list(_COSMICS_POOLS.values())
+        _COSMICS_POOLS.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def remove_cosmics(frames, workers=1, tiles=1, halo=64, **kwargs):
+    """Removes the cosmic rays of a list of frames with LACosmic. The frames are 
+    processed concurrently in a pool of processes (see _cosmics_pool). With 
+    tiles > 1, each frame is also split in tiles x tiles overlapping tiles: every
+    step of LACosmic only uses a small neighbourhood, so with a large enough halo
+    the merged result is the same as processing the whole frame.
+
+    Args:
+        frames (list): Images without NaN values.
+        workers (int, optional): Number of processes. Defaults to 1 (serial).
+        tiles (int, optional): Number of tiles per axis. Defaults to 1 (whole frames).
+        halo (int, optional): Pixels added around each tile. Defaults to 64.
+        **kwargs: Parameters for LACosmic.
+
+    Returns:
+        list: Images without cosmic rays.
+    """
+    if workers <= 1 and tiles <= 1:
+        return [_lacosmic_image(fr, kwargs) for fr in frames]
+
+    results = [np.empty_like(fr) for fr in frames]
+    workers = max(workers, 1)
+    pool = _cosmics_pool(workers)
+    jobs = []
+    try:
+        for i, fr in enumerate(frames):
+            for (r0, r1), (i0, i1) in _tile_edges(fr.shape[0], tiles, halo):
+                for (c0, c1), (j0, j1) in _tile_edges(fr.shape[1], tiles, halo):
+                    future = pool.submit(_lacosmic_image, fr[r0:r1, c0:c1], kwargs)
+                    jobs.append((i, (i0, i1, j0, j1), (i0 - r0, i1 - r0, j0 - c0, j1 - c0), future))
+        for i, (i0, i1, j0, j1), (k0, k1, l0, l1), future in jobs:
+            results[i][i0:i1, j0:j1] = future.result()[k0:k1, l0:l1]
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory): the pool cannot be used any more.
+        _drop_cosmics_pool(workers, pool)
+        raise
+    return results
+
+def calibrate_frame(frame_path, masterbias, masterflat=None, fill_nan=False,
+                    dtype=np.float64, workers=1, block=256, out=None):
+    """Calibrates a raw frame in a single pass: the trim section is read, scaled, 
+    the masterbias (which carries the BPM as NaN values) is subtracted and the 
+    result is divided by the masterflat, block by block of rows, in place over 
+    the output array. The blocks are shared among several threads (numpy releases 
+    the GIL). Finally, the NaN values can be replaced by the median of the frame.
+
+    Args:
+        frame_path (str): Path to the raw frame.
+        masterbias (array): MasterBias frame (trimmed).
+        masterflat (array, optional): Normalized MasterFlat (trimmed). Defaults to None.
+        fill_nan (bool, optional): Replace the NaN values by the median. Defaults to False.
+        dtype (dtype, optional): Floating point type of the result. Defaults to float64.
+        workers (int, optional): Number of threads. Defaults to 1.
+        block (int, optional): Rows per block. Defaults to 256.
+        out (array, optional): Preallocated output. Defaults to None.
+
+    Returns:
+        array: Calibrated frame.
+    """
+    nrows, ncols = TRIM_ROWS[1] - TRIM_ROWS[0], TRIM_COLS[1] - TRIM_COLS[0]
+    if out is None:
+        out = np.empty((nrows, ncols), dtype=np.dtype(dtype).newbyteorder('='))
+
+    with fits.open(frame_path, memmap=True, do_not_scale_image_data=True) as hdul:
+        header = hdul[0].header
+        raw = hdul[0].data
+        bscale, bzero = header.get('BSCALE', 1.0), header.get('BZERO', 0.0)
+
+        def calibrate_rows(first):
+            last = min(first + block, nrows)
+            rows = out[first:last]
+            np.copyto(rows, raw[TRIM_ROWS[0] + first:TRIM_ROWS[0] + last,
+                                TRIM_COLS[0]:TRIM_COLS[1]], casting='unsafe')
+            rows *= bscale
+            rows += bzero
+            rows -= masterbias[first:last]
+            if masterflat is not None:
+                rows /= masterflat[first:last]
+
+        if workers <= 1:
+            for first in range(0, nrows, block):
+                calibrate_rows(first)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(calibrate_rows, range(0, nrows, block)))
+        del raw
+
+    if fill_nan:
+        # Same value as np.nanmedian, with a single copy of the valid pixels.
+        nans = np.isnan(out)
+        median = np.median(out[~nans], overwrite_input=True)
+        np.nan_to_num(out, copy=False, nan=median)
+    return out
+
 class Reduction:
     """The goal is to perform the cleaning procedure for science and photometric calibration frames. 
     First, bias frames are averaged to create a master bias. This master bias is then used to subtract 
@@ -90,16 +296,60 @@ class Reduction:
     subtracting the master bias and dividing by the master flat, resulting in the final reduced frames.
     """
 
-    def __init__(self, main_path, path_mask = None):
+    def __init__(self, main_path, path_mask = None, conf = None):
         """Object initialization to carry out the reduction.
 
         Args:
             gtcprgid (str): Observation program code.
             gtcobid (str): Observation block code.
             path_mask (str, optional): Path to BPM.
+            conf (dict, optional): Collection of configuration parameters.
         """
 
         self.PATH = Path(main_path)
+        self.conf = conf if conf is not None else {}
+
+        # Floating point type of the frames (PRECISION section), kept from the reading
+        # of the raw frames to the products.
+        self.dtype = get_dtype(self.conf)
+
+        # Memory budget (MB) for the data cubes used to combine frames.
+        self.memory_limit = self.conf.get('REDUCTION', {}).get('memory_limit')
+
+        # Methods used to combine the frames (see combine_osirisplus.COMBINE_METHODS).
+        self.combine_method = self.conf.get('REDUCTION', {}).get('combine_method', 'trimmed_median')
+        self.fringe_method = self.conf.get('REDUCTION', {}).get('fringe_method', 'trimmed_median')
+        self.sky_method = self.conf.get('REDUCTION', {}).get('sky_method', 'median')
+        self.clip_sigma = self.conf.get('REDUCTION', {}).get('clip_sigma', 3.0)
+
+        # Sky model: 'global' (one background for all the frames of a filter) or 
+        # 'window' (background from the sky_window frames nearest in time).
+        self.sky_mode = self.conf.get('REDUCTION', {}).get('sky_mode', 'global')
+        self.sky_window = self.conf.get('REDUCTION', {}).get('sky_window', 5)
+        self.sky_workers = self.conf.get('REDUCTION', {}).get('sky_workers', 1)
+
+        # Pool for the cosmic ray removal (processes and tiles per axis of each frame).
+        self.cr_workers = self.conf.get('REDUCTION', {}).get('cr_workers', 1)
+        self.cr_tiles = self.conf.get('REDUCTION', {}).get('cr_tiles', 1)
+        self.cr_halo = self.conf.get('REDUCTION', {}).get('cr_halo', 64)
+
+        # Threads and rows per block for the calibration of the frames.
+        self.calib_workers = self.conf.get('REDUCTION', {}).get('calib_workers', 1)
+        self.calib_block = self.conf.get('REDUCTION', {}).get('calib_block', 256)
+
+        # Threads for the per-filter work (master flats, cleaning, CRs, sky and saving).
+        self.filter_workers = self.conf.get('REDUCTION', {}).get('filter_workers', 1)
+
+        # Persistent library of masters shared between OBs and nights.
+        self.library = CalibrationLibrary.from_config(self.conf)
+        self.masterbias_key = None
+
+        # Running master fringe in the library, built from the Sloan_z frames of 
+        # several OBs, and keywords that define the instrument configuration.
+        lib_conf = self.conf.get('LIBRARY', {})
+        self.use_fringe_library = self.library is not None and lib_conf.get('use_fringe_library', False)
+        self.fringe_reuse = lib_conf.get('fringe_reuse', False)
+        self.fringe_keywords = lib_conf.get('fringe_keywords', FRINGE_KEYWORDS)
         
         if os.path.exists(self.PATH):
             logger.info("Path to raw data exists")
@@ -127,7 +377,8 @@ class Reduction:
             sys.exit()
         
         # The information about the frames in that directory is gathered.
-        self.ic = ccdp.ImageFileCollection(self.PATH)
+        # The headers are kept in a cache, so they are parsed only once.
+        self.ic = HeaderCollection(self.PATH)
         if len(self.ic.summary) != 0:
             logger.info("Data collection is ready")
         else:
@@ -151,25 +402,26 @@ class Reduction:
 
 
     @staticmethod
-    def configure_mask(mask):
+    def configure_mask(mask, dtype=np.float64):
         """Static method to reshape the BPM array to match any frame shape.
 
         Args:
             mask (int): BPM HDU or CCDData Object
+            dtype (dtype, optional): Floating point type of the frames. Defaults to float64.
 
         Returns:
             bool: BPM array in boolean format to apply over the frames.
         """
         mask = mask.data.astype(bool)
-        matrix = np.ones(mask.shape)
+        matrix = np.ones(mask.shape, dtype=dtype)
         matrix[mask == False] = np.nan
-        return matrix[230:2026,28:2060] # TRIM SECTION
+        return matrix[TRIM_ROWS[0]:TRIM_ROWS[1],TRIM_COLS[0]:TRIM_COLS[1]] # TRIM SECTION
 
 
 
 
     @staticmethod
-    def get_each_data(data_dict, value):
+    def get_each_data(data_dict, value, dtype=np.float64):
         """Reads the contents of a dictionary containing the paths to a series of 
         frames and opens them, adding them to a list.
 
@@ -177,34 +429,112 @@ class Reduction:
             data_dict (dict): A dictionary containing the paths to 
             one or more frames in a list.
             value (str): Key to access the list of paths.
+            dtype (dtype, optional): Floating point type of the images. Defaults to float64.
 
         Returns:
             list: It is a list containing the images.
         """
         ccd = []
         for frame_path in data_dict[value]:
-            hdul = fits.open(frame_path)
-            ccd.append(hdul[0].data[230:2026,28:2060]) #TRIM SECTION
-            
+            ccd.append(Reduction.read_trimmed(frame_path, dtype=dtype)) #TRIM SECTION
+
         logger.info(f"List of images for key {value} is ready.")
         return ccd
 
 
 
     @staticmethod
-    def combining(lst_frames):
+    def read_rows(frame, first, last, dtype=np.float64):
+        """Reads a block of rows from the trim section of a frame. Raw frames are 
+        memory-mapped, so only the requested rows are read from disk, and the file 
+        is closed before returning.
+
+        Args:
+            frame (str or array): Path to a raw frame or an image already trimmed.
+            first (int): First row of the block (trimmed coordinates).
+            last (int): Row where the block ends (not included).
+            dtype (dtype, optional): Floating point type of the block. Defaults to float64.
+
+        Returns:
+            array: Block of rows of the trimmed image (native-endian float).
+        """
+        if isinstance(frame, np.ndarray):
+            return frame[first:last]
+
+        with fits.open(frame, memmap=True, do_not_scale_image_data=True) as hdul:
+            header = hdul[0].header
+            raw = hdul[0].data[TRIM_ROWS[0] + first:TRIM_ROWS[0] + last,
+                               TRIM_COLS[0]:TRIM_COLS[1]]
+            # The scaling (BZERO/BSCALE) is applied only over the trim section.
+            block = raw.astype(np.dtype(dtype).newbyteorder('='))
+            del raw
+        block *= header.get('BSCALE', 1.0)
+        block += header.get('BZERO', 0.0)
+        return block
+
+
+
+
+    @staticmethod
+    def read_trimmed(frame_path, dtype=np.float64):
+        """Reads the trim section of a raw frame.
+
+        Args:
+            frame_path (str): Path to the raw frame.
+            dtype (dtype, optional): Floating point type of the image. Defaults to float64.
+
+        Returns:
+            array: Trimmed image (native-endian float).
+        """
+        return Reduction.read_rows(frame_path, 0, TRIM_ROWS[1] - TRIM_ROWS[0], dtype=dtype)
+
+
+
+
+    @staticmethod
+    def combining(lst_frames, memory_limit=None, offset=None, method='trimmed_median',
+                  sigma=3.0, dtype=np.float64):
         """This static method combines the images in a list to obtain an averaged image. 
-        The process involves creating a data cube and averaging the images.
+        The process involves creating a data cube and averaging the images. When a memory 
+        limit is given, the cube is built and combined by blocks of rows, so the peak 
+        memory does not depend on the number of frames.
 
         Args:
-            lst_frames (list): List of images to be averaged.
+            lst_frames (list): List of images (or paths to raw frames) to be averaged.
+            memory_limit (float, optional): Memory budget in MB for the data cube. 
+            Defaults to None (all the rows at once).
+            offset (array, optional): Image subtracted from every frame before 
+            combining them (e.g. the masterbias). Defaults to None.
+            method (str, optional): Combine method (see combine_osirisplus). 
+            Defaults to 'trimmed_median'.
+            sigma (float, optional): Rejection threshold for 'sigclip'. Defaults to 3.0.
+            dtype (dtype, optional): Floating point type used to read the raw frames 
+            and of the result. Defaults to float64.
 
         Returns:
             image: Create an averaged matrix from a data cube.
         """
-        cube = np.dstack(lst_frames)
-        cube.sort(axis=2)
-        return np.nanmedian(cube[:,:,1:-1], axis=2)
+        if isinstance(lst_frames[0], np.ndarray):
+            nrows, ncols = lst_frames[0].shape
+        else:
+            nrows, ncols = TRIM_ROWS[1] - TRIM_ROWS[0], TRIM_COLS[1] - TRIM_COLS[0]
+
+        if memory_limit:
+            # The cube is copied by the selection and again by the NaN checks.
+            itemsize = np.dtype(dtype).itemsize
+            block = int(memory_limit * 2**20 // (3 * itemsize * len(lst_frames) * ncols))
+            block = min(max(block, 1), nrows)
+        else:
+            block = nrows
+
+        combined = np.empty((nrows, ncols), dtype=dtype)
+        for first in range(0, nrows, block):
+            last = min(first + block, nrows)
+            cube = stack_frames([Reduction.read_rows(fr, first, last, dtype=dtype) for fr in lst_frames])
+            if offset is not None:
+                cube -= offset[np.newaxis, first:last]
+            combined[first:last] = combine(cube, method=method, sigma=sigma)
+        return combined
 
 
 
@@ -236,7 +566,7 @@ class Reduction:
         Returns:
             list: List of the frames with masterbias applied.
         """
-        ccd = self.get_each_data(data_dict, value)
+        ccd = self.get_each_data(data_dict, value, dtype=self.dtype)
 
         frames = [fr - master for fr in ccd]
 
@@ -247,18 +577,22 @@ class Reduction:
 
 
 
-    def clean_target(self, value, masterbias, masterflat):
+    def clean_target(self, value, masterbias, masterflat, fill_nan=False):
         """Applies the subtraction of the MasterBias and the division 
-        by the normalized MasterFlat to the science images.
+        by the normalized MasterFlat to the science images. Each frame is read 
+        and calibrated in a single pass (see calibrate_frame).
+
+        Args:
+            fill_nan (bool, optional): Replace the NaN values (BPM) by the median 
+            of each frame. Defaults to False.
 
         Returns:
             list: List of cleaned science frames.
         """
-        #value, masterbias, masterflat = args
-        ccd = self.get_each_data(self.DATA_DICT, value)
-        if masterflat is None:
-            masterflat = 1.0
-        frames = [(fr - masterbias)/masterflat for fr in ccd]
+        frames = [calibrate_frame(frame_path, masterbias, masterflat, fill_nan=fill_nan,
+                                  dtype=self.dtype, workers=self.calib_workers,
+                                  block=self.calib_block)
+                  for frame_path in self.DATA_DICT[value]]
         logger.info(f"Applied masterbias and masterflat on the frames for {value}.")
         return frames
 
@@ -271,25 +605,10 @@ class Reduction:
         logger.info('Getting types of images and filters used.')
         self.filt_wheels = []
         matches = (self.ic.summary['obsmode'] != 'OsirisBias')
-        matches1 = (self.ic.summary['obsmode'] != 'OsirisBias') & (self.ic.summary['filter1'] != 'OPEN')
-        matches2 = (self.ic.summary['obsmode'] != 'OsirisBias') & (self.ic.summary['filter2'] != 'OPEN')
-        matches3 = (self.ic.summary['obsmode'] != 'OsirisBias') & (self.ic.summary['filter3'] != 'OPEN')
-        matches4 = (self.ic.summary['obsmode'] != 'OsirisBias') & (self.ic.summary['filter3'] == 'OPEN')\
-        & (self.ic.summary['filter2'] == 'OPEN') & (self.ic.summary['filter1'] == 'OPEN')\
-        & (self.ic.summary['filter4'] == 'OPEN')
-        
-
-        if len(list(set(self.ic.summary['filter1'][matches1]))) >= 1:
-            self.filt_wheels.append('filter1')
-        elif len(list(set(self.ic.summary['filter2'][matches2]))) >= 1:
-            self.filt_wheels.append('filter2')
-        elif len(list(set(self.ic.summary['filter3'][matches3]))) >= 1:
-            self.filt_wheels.append('filter3')
-        elif len(list(set(self.ic.summary['filter4'][matches4]))) >= 1:
-            self.filt_wheels.append('filter4')
-        else:
-            raise(ValueError, "Incompatible filter setup!!!")
-            sys.exit()
+        wheel = filter_wheel(self.ic.summary)
+        if wheel is None:
+            raise ValueError("Incompatible filter setup!!!")
+        self.filt_wheels.append(wheel)
 
         for filt in self.filt_wheels:
             for value in list(set(self.ic.summary[filt][matches])):
@@ -305,7 +624,7 @@ class Reduction:
         """
         bpm = CCDData.read(self.path_mask, unit=u.dimensionless_unscaled,
                             hdu=0, format='fits', ignore_missing_simple=True)
-        self.MASK = self.configure_mask(bpm)
+        self.MASK = self.configure_mask(bpm, dtype=self.dtype)
         logger.info("BPM is ready.")
 
 
@@ -315,8 +634,8 @@ class Reduction:
         """It generates a table with specific content in the results directory, specifically for 
         those scientific images that have already been cleaned.
         """
-        self.ic_r = ccdp.ImageFileCollection(self.PATH_RESULTS, keywords='*',
-                                             glob_include='red*')
+        self.ic_r = HeaderCollection(self.PATH_RESULTS, keywords='*',
+                                     glob_include='red*')
         logger.info("Table with several reduced science frames is ready.")
 
 
@@ -325,11 +644,11 @@ class Reduction:
     def sort_down_drawer(self):
         """This method is responsible for storing the images by their type and filter in the previously created dictionary.
         """
+        types_targets = set(self.ic.summary['object'][self.ic.summary['obsmode'] == 'OsirisBroadBandImage'])
         for filt in self.filt_wheels:
             for elem in list(self.DATA_DICT.keys()):
                 if elem != 'bias':
                     key, value = elem.split('+')
-                    types_targets = set(self.ic.summary['object'][self.ic.summary['obsmode'] == 'OsirisBroadBandImage'])
                     if key == 'flat':
                         try:
                             tmp_dict = {"obsmode":self.key_dict[key], filt: value}
@@ -369,13 +688,126 @@ class Reduction:
 
 
 
-    def do_masterbias(self):
+    @staticmethod
+    def frames_mjd(frames):
+        """Estimates the mean Modified Julian Date of a list of raw frames.
+
+        Args:
+            frames (list): Paths to the raw frames.
+
+        Returns:
+            float: Mean MJD, or None if the headers do not have the date.
         """
-        This method creates the master bias frame.
+        mjds = []
+        for frame_path in frames:
+            hd = HEADERS.header(frame_path)
+            if 'MJD-OBS' in hd:
+                mjds.append(hd['MJD-OBS'])
+            elif 'DATE-OBS' in hd:
+                mjds.append(Time(hd['DATE-OBS']).mjd)
+        return float(np.mean(mjds)) if len(mjds) != 0 else None
+
+
+
+    def obs_mjd(self):
+        """Mean Modified Julian Date of the science frames of the OB.
         """
-        bias = self.get_each_data(self.DATA_DICT, "bias")
+        frames = [fr for elem in self.DATA_DICT if 'target' in elem for fr in self.DATA_DICT[elem]]
+        return self.frames_mjd(frames)
+
+
+
+    def combine_params(self, kind):
+        """Parameters that define a master in the calibration library.
+
+        Args:
+            kind (str): Type of master (bias, flat, fringe).
+
+        Returns:
+            dict: Parameters used to create the master.
+        """
+        return {**library_params(self.conf, kind), 'bpm': os.path.basename(self.path_mask)}
+
 
-        self.masterbias = self.combining(bias) * self.MASK
+
+    def build_masterbias(self):
+        """Combines the bias frames of the OB and applies the BPM.
+
+        Returns:
+            array: MasterBias frame.
+        """
+        masterbias = self.combining(self.DATA_DICT["bias"],
+                                    memory_limit=self.memory_limit,
+                                    method=self.combine_method,
+                                    sigma=self.clip_sigma, dtype=self.dtype)
+        masterbias *= self.MASK
+        return masterbias
+
+
+
+    def build_masterflat(self, filt):
+        """Combines the flat frames of a filter, after subtracting the masterbias, 
+        and normalizes the result by its median.
+
+        Args:
+            filt (str): Key of the flat frames (flat+FILTER).
+
+        Returns:
+            array: Normalized MasterFlat frame.
+        """
+        combflat = self.combining(self.DATA_DICT[filt], memory_limit=self.memory_limit,
+                                  offset=self.masterbias, method=self.combine_method,
+                                  sigma=self.clip_sigma, dtype=self.dtype)
+        logger.info(f"Masterbias applied to key {filt} set.")
+        median = np.nanmedian(combflat)
+        return combflat/median
+
+
+
+    def map_filters(self, func, keys):
+        """Applies a function to each key (one per filter) on a pool of filter_workers 
+        threads. The filters are independent once the masterbias exists. The results 
+        are returned in the order of the keys, so the dictionaries are filled in the 
+        same order whatever the number of threads.
+
+        Args:
+            func (callable): Function of a key.
+            keys (list): Keys of the filters (e.g. flat+Sloan_g).
+
+        Returns:
+            list: Results of func for each key.
+        """
+        if self.filter_workers <= 1 or len(keys) <= 1:
+            return [func(key) for key in keys]
+        with ThreadPoolExecutor(max_workers=min(self.filter_workers, len(keys))) as pool:
+            return list(pool.map(func, keys))
+
+
+
+    def do_masterbias(self):
+        """
+        This method creates the master bias frame. If the calibration library is 
+        enabled, the master is taken from it when the same bias frames have already 
+        been combined, or the nearest in time is used when there are no bias frames.
+        """
+        frames = self.DATA_DICT["bias"]
+        self.masterbias = None
+        if self.library is not None:
+            params = self.combine_params('bias')
+            if len(frames) != 0:
+                self.masterbias_key = self.library.make_key(frames, params)
+                self.masterbias = self.library.get_or_build(self.masterbias_key, self.build_masterbias,
+                                                            'bias', mjd=self.frames_mjd(frames),
+                                                            params=params)
+            else:
+                self.masterbias, self.masterbias_key = self.library.nearest('bias', self.obs_mjd(),
+                                                                            params=params)
+
+        if self.masterbias is None:
+            if len(frames) == 0:
+                logger.critical(f"{bcl.ERROR}There are no bias frames to create the masterbias{bcl.ENDC}")
+                sys.exit()
+            self.masterbias = self.build_masterbias()
         self.master_dict['bias'] = self.masterbias
 
         logger.info(f"{bcl.OKGREEN}Masterbias has been created{bcl.ENDC}")
@@ -384,85 +816,143 @@ class Reduction:
 
     def do_masterflat(self):
         """
-        This method creates the master flat frame for each filter.
+        This method creates the master flat frame for each filter. As for the 
+        masterbias, the calibration library is used when it is enabled.
         """
-        lst_flat = [elem for elem in list(self.DATA_DICT.keys()) if 'flat' in elem]
-        for filt in lst_flat:
-            if 'flat+OPEN' in filt:
-                continue
-            flat = self.sustractMasterBias(filt, self.masterbias, self.DATA_DICT)
-            combflat = self.combining(flat)
-            median = np.nanmedian(combflat)
-            masterflat = combflat/median
+        lst_flat = [elem for elem in list(self.DATA_DICT.keys()) if 'flat' in elem and elem != 'flat+OPEN']
+        for filt, masterflat in zip(lst_flat, self.map_filters(self.filter_masterflat, lst_flat)):
             self.master_dict[filt] = masterflat
-            logger.info(f"{bcl.OKGREEN}Masterflat has been created for {filt} filter{bcl.ENDC}")
 
 
-    def get_std(self, no_CRs=False, contrast_arg = 1.5, cr_threshold_arg = 5.,
-                neighbor_threshold_arg = 5., apply_flat=False):
+
+    def filter_masterflat(self, filt):
+        """Creates the master flat frame of a filter (see do_masterflat).
+
+        Args:
+            filt (str): Key of the flat frames (flat+FILTER).
+
+        Returns:
+            array: Normalized MasterFlat frame, or None if there are no flat frames.
         """
-        This method processes the photometric calibration frames.
+        frames = self.DATA_DICT[filt]
+        value = filt.split('+')[1]
+        masterflat = None
+        if self.library is not None:
+            params = self.combine_params('flat')
+            if len(frames) != 0:
+                key = self.library.make_key(frames, {**params, 'bias': self.masterbias_key})
+                masterflat = self.library.get_or_build(key, lambda: self.build_masterflat(filt),
+                                                       'flat', mjd=self.frames_mjd(frames),
+                                                       filt=value,
+                                                       params={**params, 'bias': self.masterbias_key})
+            else:
+                masterflat, key = self.library.nearest('flat', self.obs_mjd(), filt=value,
+                                                       params=params)
+
+        if masterflat is None:
+            if len(frames) == 0:
+                logger.warning(f"{bcl.WARNING}There are no flat frames for {filt} filter{bcl.ENDC}")
+                return None
+            masterflat = self.build_masterflat(filt)
+        logger.info(f"{bcl.OKGREEN}Masterflat has been created for {filt} filter{bcl.ENDC}")
+        return masterflat
+
+
+    def calibrate_std(self, apply_flat=False):
         """
-        lst_std = [elem for elem in list(self.DATA_DICT.keys()) if 'std' in elem]
+        This method calibrates (masterbias and masterflat) the photometric calibration frames.
+        """
+        lst_std = [elem for elem in list(self.DATA_DICT.keys()) if 'std' in elem and elem != 'std+OPEN']
         logger.info("Processing photometric calibration frames.")
         for elem in lst_std:
-            if 'std+OPEN' in elem:
-                continue
-
-            key, value = elem.split('+')
-            
             if apply_flat == False:
-                self.master_dict['flat+' + value] = None
-        
-            std = self.clean_target(elem, self.master_dict['bias'],self.master_dict['flat+' + value])
-            lst_sd = []
-            for sd in std:
-                if no_CRs:
-                    logger.info(f"Removing CRs to photometric calibration frame for {value}.")
-                    no_mask = np.nan_to_num(sd, nan=np.nanmedian(sd))
-                    lst_sd.append(lacosmic(no_mask, contrast=contrast_arg,
-                                                    cr_threshold=cr_threshold_arg,
-                                                    neighbor_threshold=neighbor_threshold_arg,
-                                                    effective_gain=1.9,
-                                                    readnoise=4.3)[0])
-                else:
-                    logger.info(f"NOT treatment for CRs applied to photometric calibration frame for {value}.")
-                    lst_sd.append(np.nan_to_num(sd, nan=np.nanmedian(sd)))
+                self.master_dict['flat+' + elem.split('+')[1]] = None
+
+        def process(elem):
+            value = elem.split('+')[1]
+            return self.clean_target(elem, self.master_dict['bias'], self.master_dict['flat+' + value],
+                                     fill_nan=True)
+
+        for elem, lst_sd in zip(lst_std, self.map_filters(process, lst_std)):
             self.std_dict[elem] = lst_sd
 
 
 
-    def get_target(self, no_CRs=False, contrast_arg = 1.5, cr_threshold_arg = 5.,
-                neighbor_threshold_arg = 5., apply_flat=False):
+    def calibrate_science(self, apply_flat=False):
         """
-        This method cleans the science frames.
+        This method calibrates (masterbias and masterflat) the science frames.
         """
         lst_target = [elem for elem in list(self.DATA_DICT.keys()) if 'target' in elem]
         logger.info("Processing science frames.")
         for elem in lst_target:
-            key, value = elem.split('+')
-            
+            value = elem.split('+')[1]
             if (apply_flat == False) or (value == 'OPEN'):
                 self.master_dict['flat+' + value] = None
-            
-            target= self.clean_target(elem, self.master_dict['bias'],self.master_dict['flat+' + value])
-            lst_tg = []
-            for tg in target:
-                if no_CRs:
-                    logger.info(f"Removing CRs to science frames for {value}.")
-                    no_mask = np.nan_to_num(tg, nan=np.nanmedian(tg))
-                    lst_tg.append(lacosmic(no_mask, contrast=contrast_arg,
-                                                    cr_threshold=cr_threshold_arg,
-                                                    neighbor_threshold=neighbor_threshold_arg,
-                                                    effective_gain=1.9,
-                                                    readnoise=4.3)[0])
-                else:
-                    logger.info(f"NOT treatment for CRs applied to science frames for {value}.")
-                    lst_tg.append(np.nan_to_num(tg, nan=np.nanmedian(tg)))
+
+        def process(elem):
+            value = elem.split('+')[1]
+            return self.clean_target(elem, self.master_dict['bias'], self.master_dict['flat+' + value],
+                                     fill_nan=True)
+
+        for elem, lst_tg in zip(lst_target, self.map_filters(process, lst_target)):
             self.target_dict[elem] = lst_tg
 
 
 
+    def remove_crs(self, kind, no_CRs=False, contrast_arg = 1.5, cr_threshold_arg = 5.,
+                   neighbor_threshold_arg = 5.):
+        """
+        This method removes the cosmic rays of the calibrated frames of each filter.
+
+        Args:
+            kind (str): 'std' (photometric calibration frames) or 'target' (science frames).
+            no_CRs (bool, optional): Remove the cosmic rays. Defaults to False.
+        """
+        data_dict = self.std_dict if kind == 'std' else self.target_dict
+        name = 'photometric calibration frames' if kind == 'std' else 'science frames'
+        keys = [elem for elem in data_dict if elem.startswith(kind + '+')]
+        if not no_CRs:
+            for elem in keys:
+                logger.info(f"NOT treatment for CRs applied to {name} for {elem.split('+')[1]}.")
+            return
+
+        def process(elem):
+            logger.info(f"Removing CRs to {name} for {elem.split('+')[1]}.")
+            return remove_cosmics(data_dict[elem], workers=self.cr_workers, tiles=self.cr_tiles,
+                                  halo=self.cr_halo, contrast=contrast_arg,
+                                  cr_threshold=cr_threshold_arg,
+                                  neighbor_threshold=neighbor_threshold_arg,
+                                  effective_gain=1.9, readnoise=4.3)
+
+        for elem, frames in zip(keys, self.map_filters(process, keys)):
+            data_dict[elem] = frames
+
+
+
+    def get_std(self, no_CRs=False, contrast_arg = 1.5, cr_threshold_arg = 5.,
+                neighbor_threshold_arg = 5., apply_flat=False):
+        """
+        This method processes the photometric calibration frames.
+        """
+        self.calibrate_std(apply_flat=apply_flat)
+        self.remove_crs('std', no_CRs=no_CRs, contrast_arg=contrast_arg,
+                        cr_threshold_arg=cr_threshold_arg,
+                        neighbor_threshold_arg=neighbor_threshold_arg)
+
+
+
+    def get_target(self, no_CRs=False, contrast_arg = 1.5, cr_threshold_arg = 5.,
+                neighbor_threshold_arg = 5., apply_flat=False):
+        """
+        This method cleans the science frames.
+        """
+        self.calibrate_science(apply_flat=apply_flat)
+        self.remove_crs('target', no_CRs=no_CRs, contrast_arg=contrast_arg,
+                        cr_threshold_arg=cr_threshold_arg,
+                        neighbor_threshold_arg=neighbor_threshold_arg)
+
+
+
     def remove_fringing(self):
         """
         This method performs a special cleaning when using Sloan_z to remove the interference pattern.
@@ -471,9 +961,10 @@ class Reduction:
         if 'target+Sloan_z' in lst_results:
             logger.info("Removing the fringe on Sloan z filter.")
             fringe= self.target_dict['target+Sloan_z']
-            combfringe = self.combining(fringe)
-            median = np.nanmedian(combfringe)
-            masterfringe = combfringe/median
+            if self.use_fringe_library:
+                masterfringe = self.library_fringe(fringe)
+            else:
+                masterfringe = self.combine_fringe(fringe)
             fr_free = [elem/masterfringe for elem in fringe]
             self.target_dict['fringe+Sloan_z'] = fr_free
             logger.info("Sci frames with free fringe.")
@@ -494,29 +985,92 @@ class Reduction:
 
         
     
+    def combine_fringe(self, fringe):
+        """Combines the Sloan_z science frames of the OB into a normalized master fringe.
+
+        Args:
+            fringe (list): Sloan_z science frames.
+
+        Returns:
+            array: Master fringe normalized by its median.
+        """
+        combfringe = self.combining(fringe, memory_limit=self.memory_limit,
+                                    method=self.fringe_method, sigma=self.clip_sigma,
+                                    dtype=self.dtype)
+        median = np.nanmedian(combfringe)
+        return combfringe/median
+
+
+
+    def library_fringe(self, fringe):
+        """Returns the master fringe from the running master of the calibration library. 
+        The normalized master fringe of the OB is added to the running master nearest 
+        in time (with the same parameters and instrument configuration), unless the OB 
+        was already added. With fringe_reuse, the nearest running master is used 
+        directly and the frames of the OB are not combined.
+
+        Args:
+            fringe (list): Sloan_z science frames.
+
+        Returns:
+            array: Master fringe.
+        """
+        frames = self.DATA_DICT['target+Sloan_z']
+        params = {**self.combine_params('fringe'), 'method': self.fringe_method,
+                  'config': {kw: HEADERS.value(frames[0], kw) for kw in self.fringe_keywords}}
+        mjd = self.frames_mjd(frames)
+
+        if self.fringe_reuse:
+            masterfringe, __ = self.library.nearest('fringe', mjd, filt='Sloan_z', params=params)
+            if masterfringe is not None:
+                return masterfringe
+
+        contribution = self.library.make_key(frames, {**params, 'bias': self.masterbias_key})
+        masterfringe, __ = self.library.find_contribution('fringe', contribution)
+        if masterfringe is not None:
+            logger.info(f"{bcl.OKGREEN}The fringe of these frames is already in the library{bcl.ENDC}")
+            return masterfringe
+
+        masterfringe, __ = self.library.accumulate(contribution, self.combine_fringe(fringe),
+                                                   'fringe', mjd, filt='Sloan_z', params=params,
+                                                   weight=len(fringe))
+        return masterfringe
+
+
+
     def sustract_sky(self):
         """
         This method subtracts the contribution of the sky background.
         """
         lst_target_keys = [elem for elem in list(self.target_dict.keys())]
         logger.info(f"Substracting sky background.")
-        for elem in lst_target_keys:
+
+        def process(elem):
             key, value = elem.split('+')
             lst_frames = self.target_dict[elem]
-            cube = np.dstack(lst_frames)
-            cube.sort(axis=2)
-            im_avg = np.median(cube[:,:,:], axis=2)
+            if self.sky_mode == 'window':
+                logger.info(f"Creating running sky background ({self.sky_window} frames nearest in time) for {elem}.")
+                mjds = [self.frames_mjd([fr]) for fr in self.DATA_DICT['target+' + value]]
+                if None in mjds:
+                    mjds = list(range(len(lst_frames)))
+                no_sky = subtract_running_sky(lst_frames, mjds, k=self.sky_window,
+                                              method=self.sky_method, sigma=self.clip_sigma,
+                                              workers=self.sky_workers)
+                logger.info(f"List of science frames without sky for {elem} created.")
+                return None, no_sky
+            im_avg = self.combining(lst_frames, memory_limit=self.memory_limit,
+                                    method=self.sky_method, sigma=self.clip_sigma,
+                                    dtype=self.dtype)
             if key == 'target':
                 logger.info(f"Creating sky background simulated for {value}.")
             elif key == 'fringe':
                 logger.info(f"Creating sky background simulated for {value} without fringe.")
             else:
                 logger.error("No defined option for key (target or fringe).")
-            self.bkg = sep.Background(im_avg)
+            bkg = sep.Background(im_avg)
             no_sky = []
             for fr in lst_frames:
-                no_sky.append(fr-self.bkg)
-            self.target_dict['sky+' + value] = no_sky
+                no_sky.append(fr-bkg)
             if key == 'std': #This is a special case for the STD stars.
                 logger.info(f"List of photometric calibration frames without sky for {value} created.")
             elif key == 'target':
@@ -525,6 +1079,44 @@ class Reduction:
                 logger.info(f"List of science frames without sky and without fringe for {value} created.")
             else:
                 logger.error("No defined option for key (target or fringe).")
+            return bkg, no_sky
+
+        # The results are stored in order: as before, the frames without fringe of 
+        # Sloan_z (fringe+Sloan_z, after target+Sloan_z) give its frames without sky.
+        for elem, (bkg, no_sky) in zip(lst_target_keys, self.map_filters(process, lst_target_keys)):
+            if bkg is not None:
+                self.bkg = bkg
+            self.target_dict['sky+' + elem.split('+')[1]] = no_sky
+
+
+    def validate_precision(self, reference):
+        """Reports the difference between the frames of this reduction and those of 
+        the same reduction done in float64 (validation mode of the PRECISION section).
+
+        Args:
+            reference (Reduction): The same reduction done in float64.
+
+        Returns:
+            dict: Maximum absolute and relative differences for each set of frames.
+        """
+        logger.info(f"Validating the {self.dtype.name} reduction against float64.")
+        report = {}
+        for name, data_dict, ref_dict in [('master', self.master_dict, reference.master_dict),
+                                          ('std', self.std_dict, reference.std_dict),
+                                          ('target', self.target_dict, reference.target_dict)]:
+            for key in data_dict:
+                frames, ref_frames = data_dict[key], ref_dict.get(key)
+                if frames is None or ref_frames is None:
+                    continue
+                if isinstance(frames, np.ndarray):
+                    frames, ref_frames = [frames], [ref_frames]
+                if len(frames) == 0:
+                    continue
+                diffs = [compare_precision(f"{key} #{i}", fr, ref)
+                         for i, (fr, ref) in enumerate(zip(frames, ref_frames))]
+                report[f"{name}:{key}"] = (max(d[0] for d in diffs), max(d[1] for d in diffs))
+        return report
+
 
 
     def save_target(self, fringing=False, std=False, sky=False, not_sky=False):
@@ -538,6 +1130,9 @@ class Reduction:
             saved are photometric calibration star images. Defaults to False.
             sky (bool, optional): Indicates whether the science image(s) to 
             be saved contain sky or not. Defaults to False.
+
+        Returns:
+            list: Paths to the saved frames.
         """
         if not std:
             logger.info("Saving science reduced frames.")
@@ -549,7 +1144,8 @@ class Reduction:
         if 'std+OPEN' in lst_results:
             lst_results.remove('std+OPEN')
 
-        for key in lst_results:
+        # The frames of each filter are prepared (and queued to the writer) on the pool.
+        def process(key):
             fnames = self.DATA_DICT[key]
 
             if key == 'target+Sloan_z' and fringing:
@@ -601,13 +1197,14 @@ class Reduction:
                 #print(f'{bcl.HEADER}Sky: {sky}{bcl.ENDC}')
                 #print(f'{bcl.HEADER}Not sky: {not_sky}{bcl.ENDC}')
                 #print(f'{bcl.HEADER}STD: {std}{bcl.ENDC}')
-                continue
+                return []
 
+            saved = []
             for i in range(len(fnames)):
                 t = time.gmtime()
                 time_string = time.strftime("%Y-%m-%dT%H:%M:%S", t)
-                hd = fits.open(fnames[i])[0].header
-                hd_wcs = wcs.WCS(fits.open(fnames[i])[0].header).to_header()
+                hd = HEADERS.header(fnames[i])
+                hd_wcs = HEADERS.wcs_header(fnames[i])
                 hd['FRINGE'] = FRINGING
                 hd['imgtype'] = imagetype
                 hd['STATUS'] = status
@@ -622,5 +1219,8 @@ class Reduction:
                 raw_name , __ = filename.split('.')
 
                 logger.info(f"{bcl.OKGREEN}Storing the frame: ADP_{raw_name}_{imagetype}_{sky_status}_{filt} for {hd['FILTER2']}{bcl.ENDC}")
-                hdul.writeto(str(self.PATH_RESULTS / f'ADP_{raw_name}_{imagetype}_{sky_status}_{filt}.fits'),
-                            overwrite=True)
\ No newline at end of file
+                saved.append(str(self.PATH_RESULTS / f'ADP_{raw_name}_{imagetype}_{sky_status}_{filt}.fits'))
+                get_writer().write('reduction', hdul, saved[-1])
+            return saved
+
+        return [fname for saved in self.map_filters(process, lst_results) for fname in saved]
@@ -0,0 +1,211 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Interpolation kernels of resample:
+#   nearest: value of the closest pixel.
+#   bilinear: linear interpolation of the 2x2 closest pixels.
+#   lanczos3: Lanczos kernel of 3 lobes (6x6 pixels), applied in two passes of one dimension.
+RESAMPLE_KERNELS = ('nearest', 'bilinear', 'lanczos3')
+
+# Distance (pixels) beyond the edge of the frame from which an output pixel is in
+# the footprint (as the footprint of astroalign, a bilinear warp thresholded at 0.4).
+FOOTPRINT_MARGIN = 0.4
+
+
+def _lanczos3_weights(f):
+    """Weights of the Lanczos kernel (3 lobes) of the taps -2..3 for a fractional
+    offset f in [0, 1). The sines of all the taps come from those of f by the
+    angle-addition formulas, so only three are evaluated per pixel.
+
+    Args:
+        f (array): Fractional offsets.
+
+    Returns:
+        list: Weights of each tap (normalized to a sum of 1).
+    """
+    # An exact zero offset is moved away from the pole (its weights are then 1, 0, ...).
+    f = np.where(f == 0., 1e-9, f)
+    sin_f = np.sin(np.pi * f)
+    sin_f3, cos_f3 = np.sin(np.pi * f / 3.), np.cos(np.pi * f / 3.)
+    weights = []
+    for i in range(-2, 4):
+        # sinc(f - i) * sinc((f - i) / 3)
+        sin_i3 = sin_f3 * np.cos(np.pi * i / 3.) - cos_f3 * np.sin(np.pi * i / 3.)
+        weights.append((-1.)**i * 3. * sin_f * sin_i3 / (np.pi * (f - i))**2)
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+# Weights of the Lanczos kernel tabulated for fractional offsets in steps of 1/4096
+# pixel (one table per tap -2..3, for offsets from 0 to 1).
+LANCZOS3_STEPS = 4096
+_LANCZOS3_TABLES = _lanczos3_weights(np.minimum(np.arange(LANCZOS3_STEPS + 1) / LANCZOS3_STEPS, 1. - 1e-9))
+
+
+def _interpolate(flat, start, step, positions, size):
+    """Lanczos interpolation along one axis: the value at each position is the
+    weighted sum of the 6 closest samples start + k * step (k clipped to [0, size))."""
+    k0 = np.floor(positions)
+    q = np.rint((positions - k0) * LANCZOS3_STEPS).astype(np.intp)
+    k0 = k0.astype(np.intp)
+    # The taps of the positions far from the edges need no clipping.
+    kc = np.clip(k0, 2, size - 4)
+    index = start + (kc - 2) * step
+    values = np.zeros(positions.shape, dtype=np.float64)
+    term = np.empty(positions.shape, dtype=np.float64)
+    # The samples are gathered in the type of the frame (e.g. float32).
+    samples = term if flat.dtype == term.dtype else np.empty(positions.shape, dtype=flat.dtype)
+    for table in _LANCZOS3_TABLES:
+        flat.take(index, out=samples)
+        np.multiply(samples, table.take(q), out=term)
+        values += term
+        index += step
+    edge = kc != k0
+    if edge.any():
+        k_edge, q_edge = k0[edge], q[edge]
+        start_edge = np.broadcast_to(start, positions.shape)[edge]
+        values[edge] = sum(table.take(q_edge) * flat.take(start_edge + np.clip(k_edge + i, 0, size - 1) * step)
+                           for i, table in zip(range(-2, 4), _LANCZOS3_TABLES))
+    return values
+
+
+def _lanczos3_two_pass(flat, shape, inverse, ys, sx):
+    """Separable Lanczos resampling of a block of output rows (ys), in two passes of
+    one dimension: first along the columns of the frame, to the rows of the output
+    (the source row of column u in output row y is linear in u and y), and then
+    along those rows, to the source columns sx."""
+    ny, nx = shape
+    a, b, c = inverse[0]
+    d, e, f = inverse[1]
+    u = np.arange(nx, dtype=np.float64)[None, :]
+    # Source row of the column u in the output row y (x eliminated from sy).
+    sy_u = (d / a) * u + (e - d * b / a) * ys + (f - d * c / a)
+    rows = _interpolate(flat, u.astype(np.intp), nx, sy_u, ny)
+    # Second pass, along the rows of the intermediate block.
+    start = (np.arange(len(ys), dtype=np.intp) * nx)[:, None]
+    return _interpolate(rows.ravel(), start, 1, sx, nx)
+
+
+def _resample_rows(data, inverse, first, last, out, footprint, kernel, fill, accumulate):
+    """Resamples the rows [first, last) of the output (see resample)."""
+    ny, nx = data.shape
+    flat = data.ravel()
+    ys = np.arange(first, last, dtype=np.float64)[:, None]
+    xs = np.arange(out.shape[1], dtype=np.float64)[None, :]
+    sx = inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]
+    sy = inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]
+    outside = ((sx < -FOOTPRINT_MARGIN) | (sx > nx - 1 + FOOTPRINT_MARGIN) |
+               (sy < -FOOTPRINT_MARGIN) | (sy > ny - 1 + FOOTPRINT_MARGIN))
+
+    if kernel == 'nearest':
+        ix = np.clip(np.rint(sx), 0, nx - 1).astype(np.intp)
+        iy = np.clip(np.rint(sy), 0, ny - 1).astype(np.intp)
+        values = flat.take(iy * nx + ix)
+    elif kernel == 'bilinear':
+        x0 = np.clip(np.floor(sx), 0, nx - 2)
+        y0 = np.clip(np.floor(sy), 0, ny - 2)
+        fx = np.clip(sx - x0, 0., 1.)
+        fy = np.clip(sy - y0, 0., 1.)
+        index = y0.astype(np.intp) * nx + x0.astype(np.intp)
+        top = flat.take(index) * (1. - fx) + flat.take(index + 1) * fx
+        index += nx
+        bottom = flat.take(index) * (1. - fx) + flat.take(index + 1) * fx
+        values = top * (1. - fy) + bottom * fy
+    elif abs(inverse[0, 0]) >= 0.5:
+        values = _lanczos3_two_pass(flat, data.shape, inverse, ys, sx)
+    else:
+        # Rotations of more than 60 degrees: the 6x6 taps are gathered directly.
+        x0, y0 = np.floor(sx), np.floor(sy)
+        wx, wy = _lanczos3_weights(sx - x0), _lanczos3_weights(sy - y0)
+        cols = [np.clip(x0 + i, 0, nx - 1).astype(np.intp) for i in range(-2, 4)]
+        values = np.zeros(sx.shape, dtype=np.float64)
+        for j, w_row in zip(range(-2, 4), wy):
+            row = np.clip(y0 + j, 0, ny - 1).astype(np.intp) * nx
+            for col, w_col in zip(cols, wx):
+                values += w_row * w_col * flat.take(row + col)
+
+    if footprint is not None:
+        footprint[first:last] = outside | ~np.isfinite(values)
+    values[outside] = fill
+    if accumulate:
+        out[first:last] += values
+    else:
+        out[first:last] = values
+
+
+def resample(data, matrix, shape=None, out=None, footprint=None, kernel='bilinear', fill=None,
+             accumulate=False, workers=None, block=128):
+    """Resamples a frame with an affine transform (e.g. the similarity transforms of
+    the alignment). The output is processed by blocks of rows, in a pool of threads,
+    and written directly into out, so no full-size intermediate frame is allocated.
+    The footprint is computed from the transformed coordinates, without a second
+    warp as in astroalign.
+
+    Args:
+        data (array): Frame.
+        matrix (array): 3x3 matrix of the transform from the pixels (x, y) of the
+        frame to the pixels of the output (as the params of the skimage transforms).
+        shape (tuple, optional): Shape of the output. Defaults to None (the shape of
+        out, or of the frame).
+        out (array, optional): Output (or accumulator) frame. Defaults to None (a new
+        frame of the type of data).
+        footprint (array, optional): Boolean output for the footprint. Defaults to
+        None (a new one).
+        kernel (str, optional): One of RESAMPLE_KERNELS. Defaults to 'bilinear'.
+        fill (float, optional): Value of the pixels without data. Defaults to None
+        (median of the frame, as astroalign, estimated from one pixel in 16).
+        accumulate (bool, optional): Add the resampled frame to out instead of
+        writing it. Defaults to False.
+        workers (int, optional): Number of threads. Defaults to None (the number of CPUs).
+        block (int, optional): Rows per block. Defaults to 128.
+
+    Raises:
+        ValueError: If the kernel is not available.
+
+    Returns:
+        tuple: Output frame and footprint (True where it has no data: outside the
+        frame, or not finite).
+    """
+    if kernel not in RESAMPLE_KERNELS:
+        raise ValueError(f"Unknown resample kernel '{kernel}'. Options: {', '.join(RESAMPLE_KERNELS)}")
+    if shape is None:
+        shape = data.shape if out is None else out.shape
+    if out is None:
+        out = np.zeros(shape, dtype=data.dtype) if accumulate else np.empty(shape, dtype=data.dtype)
+    if footprint is None:
+        footprint = np.empty(shape, dtype=bool)
+    data = np.ascontiguousarray(data)
+    fill = np.nanmedian(data[::4, ::4]) if fill is None else fill
+    inverse = np.linalg.inv(np.asarray(matrix, dtype=np.float64))
+
+    blocks = [(first, min(first + block, shape[0])) for first in range(0, shape[0], block)]
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        for first, last in blocks:
+            _resample_rows(data, inverse, first, last, out, footprint, kernel, fill, accumulate)
+    else:
+        # The gathers and arithmetic of numpy release the GIL, so the blocks run in parallel.
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda rows: _resample_rows(data, inverse, *rows, out, footprint, kernel, fill,
+                                                      accumulate), blocks))
+    return out, footprint
@@ -0,0 +1,202 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import numpy as np
+from scipy import fft
+from scipy.spatial import cKDTree
+
+from loguru import logger
+
+
+def _fast_length(size):
+    """Largest length not above size whose FFT is fast (factors 2, 3 and 5)."""
+    while fft.next_fast_len(size, real=True) != size:
+        size -= 1
+    return size
+
+
+def _prepare(image, border):
+    """Trims the border of a frame (to a size with a fast FFT), replaces its NaN
+    values and subtracts its median, and applies a Hann window so the edges do not
+    correlate."""
+    ny, nx = _fast_length(image.shape[0] - 2 * border), _fast_length(image.shape[1] - 2 * border)
+    data = np.array(image[border:border + ny, border:border + nx], dtype=np.float32)
+    median = np.nanmedian(data[::4, ::4])
+    data[~np.isfinite(data)] = median
+    data -= median
+    data *= np.hanning(ny).astype(np.float32)[:, None]
+    data *= np.hanning(nx).astype(np.float32)[None, :]
+    return data
+
+
+def _parabola(minus, centre, plus):
+    """Offset of the vertex of the parabola through three points."""
+    den = minus - 2. * centre + plus
+    return 0. if den == 0 else 0.5 * (minus - plus) / den
+
+
+def phase_correlation(reference, image, border=64):
+    """Estimates the translation between two frames by FFT phase correlation, with
+    a sub-pixel refinement of the correlation peak.
+
+    Args:
+        reference (array): Reference frame.
+        image (array): Frame to align (same shape).
+        border (int, optional): Pixels trimmed at each side. Defaults to 64.
+
+    Returns:
+        tuple: Shift (dy, dx) of the image with respect to the reference (the
+        aligned frame is image[y + dy, x + dx]) and significance of the peak
+        (in standard deviations of the correlation surface).
+    """
+    ref = _prepare(reference, border)
+    img = _prepare(image, border)
+    cross = fft.rfft2(img)
+    cross *= np.conj(fft.rfft2(ref))
+    cross /= np.maximum(np.abs(cross), 1e-30)
+    corr = fft.irfft2(cross, s=ref.shape)
+
+    py, px = np.unravel_index(np.argmax(corr), corr.shape)
+    ny, nx = corr.shape
+    dy = py + _parabola(corr[(py - 1) % ny, px], corr[py, px], corr[(py + 1) % ny, px])
+    dx = px + _parabola(corr[py, (px - 1) % nx], corr[py, px], corr[py, (px + 1) % nx])
+    # The correlation is periodic: the shifts larger than half the frame are negative.
+    dy = dy - ny if dy > ny / 2 else dy
+    dx = dx - nx if dx > nx / 2 else dx
+    significance = (corr[py, px] - corr.mean()) / corr.std()
+    return (float(dy), float(dx)), float(significance)
+
+
+def shift_frame(image, dy, dx, fill=None):
+    """Shifts a frame by a translation, with a separable linear interpolation of
+    the fractional part (no general resampling).
+
+    Args:
+        image (array): Frame.
+        dy (float): Shift along the rows (the result is image[y + dy, x + dx]).
+        dx (float): Shift along the columns.
+        fill (float, optional): Value of the pixels without data. Defaults to None
+        (median of the frame, as astroalign, estimated from one pixel in 16).
+
+    Returns:
+        tuple: Shifted frame and its footprint (True where it has no data).
+    """
+    ny, nx = image.shape
+    fill = np.nanmedian(image[::4, ::4]) if fill is None else fill
+    out = np.full(image.shape, fill, dtype=image.dtype)
+    footprint = np.ones(image.shape, dtype=bool)
+    iy, ix = int(np.floor(dy)), int(np.floor(dx))
+    fy, fx = dy - iy, dx - ix
+    # Rows and columns of the result whose four neighbours are in the frame.
+    y0, y1 = max(0, -iy), min(ny, ny - iy - 1)
+    x0, x1 = max(0, -ix), min(nx, nx - ix - 1)
+    if y1 <= y0 or x1 <= x0:
+        return out, footprint
+    rows = ((1. - fy) * image[y0 + iy:y1 + iy, x0 + ix:x1 + ix + 1] +
+            fy * image[y0 + iy + 1:y1 + iy + 1, x0 + ix:x1 + ix + 1])
+    out[y0:y1, x0:x1] = (1. - fx) * rows[:, :-1] + fx * rows[:, 1:]
+    footprint[y0:y1, x0:x1] = False
+    return out, footprint
+
+
+def check_translation(sources, ref_sources, dy, dx, shape, max_residual=0.5, max_sources=60,
+                      min_matches=5):
+    """Validates a translation with the source catalogs: the brightest sources of the
+    reference are matched with the shifted sources of the frame, and a similarity
+    transform is fitted to the pairs. The translation is accepted if enough sources
+    are matched, their residual is small and the fitted rotation and scale do not
+    move the corners of the frame more than max_residual pixels.
+
+    Args:
+        sources (array): Sources of the frame (x, y).
+        ref_sources (array): Sources of the reference (x, y).
+        dy (float): Shift along the rows.
+        dx (float): Shift along the columns.
+        shape (tuple): Shape of the frames.
+        max_residual (float, optional): Maximum residual (pixels). Defaults to 0.5.
+        max_sources (int, optional): Number of sources used. Defaults to 60.
+        min_matches (int, optional): Minimum number of matched sources. Defaults to 5.
+
+    Returns:
+        tuple: True if the translation is valid, and a description of the check.
+    """
+    if len(sources) < min_matches or len(ref_sources) < min_matches:
+        return False, "not enough sources"
+    img = np.column_stack([sources['x'] - dx, sources['y'] - dy])[:2 * max_sources]
+    ref = np.column_stack([ref_sources['x'], ref_sources['y']])[:max_sources]
+    dist, idx = cKDTree(img).query(ref, distance_upper_bound=max(3. * max_residual, 2.))
+    matched = np.isfinite(dist)
+    if matched.sum() < min_matches:
+        return False, f"{matched.sum()} sources matched"
+
+    # Similarity transform (complex form: z_ref = a * z_img + b) of the pairs.
+    z_ref = ref[matched, 0] + 1j * ref[matched, 1]
+    z_img = img[idx[matched], 0] + 1j * img[idx[matched], 1]
+    z_ref_c, z_img_c = z_ref - z_ref.mean(), z_img - z_img.mean()
+    a = np.vdot(z_img_c, z_ref_c) / np.vdot(z_img_c, z_img_c).real
+    rms = np.sqrt(np.median(np.abs(z_ref - z_img) ** 2))
+    distortion = abs(a - 1.) * 0.5 * np.hypot(*shape)
+    info = (f"{matched.sum()} sources, residual {rms:.3f} px, rotation {np.degrees(np.angle(a)):.4f} deg, "
+            f"scale {abs(a):.5f}")
+    return rms <= max_residual and distortion <= max_residual, info
+
+
+def find_shift(data, target, sources, ref_sources, border=64, min_significance=8., max_residual=0.5):
+    """Finds the translation of a frame with respect to a target (FFT phase
+    correlation, validated with the source catalogs).
+
+    Args:
+        data (array): Frame.
+        target (array): Target frame (same shape).
+        sources (array): Sources of the frame.
+        ref_sources (array): Sources of the target (in its pixel grid).
+        border (int, optional): Pixels trimmed for the correlation. Defaults to 64.
+        min_significance (float, optional): Minimum significance of the correlation
+        peak. Defaults to 8.
+        max_residual (float, optional): Maximum residual (pixels). Defaults to 0.5.
+
+    Returns:
+        tuple: Shift (dy, dx) (see shift_frame), or None if the translation is not
+        valid (rotation, scale or low confidence) and the full registration is needed.
+    """
+    if data.shape != target.shape:
+        return None
+    (dy, dx), significance = phase_correlation(target, data, border=border)
+    if significance < min_significance:
+        logger.info(f"FFT shift rejected: peak of {significance:.1f} sigma")
+        return None
+    valid, info = check_translation(sources, ref_sources, dy, dx, data.shape, max_residual=max_residual)
+    if not valid:
+        logger.info(f"FFT shift ({dx:.2f}, {dy:.2f}) rejected: {info}")
+        return None
+    logger.info(f"FFT shift ({dx:.2f}, {dy:.2f}) px: {info}")
+    return dy, dx
+
+
+def register_shift(data, target, sources, ref_sources, border=64, min_significance=8.,
+                   max_residual=0.5):
+    """Registers a frame against a target that differs only by a translation (see
+    find_shift for the parameters).
+
+    Returns:
+        tuple: Aligned frame and footprint, or None if the translation is not valid
+        and the full registration is needed.
+    """
+    found = find_shift(data, target, sources, ref_sources, border=border, min_significance=min_significance,
+                       max_residual=max_residual)
+    return None if found is None else shift_frame(data, *found)
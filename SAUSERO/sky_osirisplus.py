@@ -0,0 +1,153 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import sep
+
+from SAUSERO.combine_osirisplus import combine, stack_frames
+
+
+def _subtract_sky(frame, neighbours, method, sigma):
+    """Subtracts from a frame the background (sep) of the combination of its neighbours."""
+    sky = combine(stack_frames(neighbours), method=method, sigma=sigma)
+    bkg = sep.Background(sky.astype(frame.dtype, copy=False))
+    return frame - bkg
+
+
+class RunningSky:
+    """Running-window sky model. The background of each frame is estimated from the
+    combination of the K frames nearest in time (the frame itself is excluded), so
+    the sky can drift along a long sequence. The frames are pushed in time order and
+    each one is processed as soon as the K frames after it have arrived, so only
+    about 2K+1 frames are kept and the frames can be processed as they are taken.
+    The sep.Background evaluations run on a pool of threads.
+    """
+
+    def __init__(self, k=5, method='median', sigma=3.0, workers=1):
+        """Sky model initialization.
+
+        Args:
+            k (int, optional): Number of neighbours. Defaults to 5.
+            method (str, optional): Combine method of the neighbours. Defaults to 'median'.
+            sigma (float, optional): Rejection threshold for 'sigclip'. Defaults to 3.0.
+            workers (int, optional): Number of threads. Defaults to 1 (serial).
+        """
+        self.k = max(int(k), 1)
+        self.method = method
+        self.sigma = sigma
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.frames = {}    # position -> frame (only the window is kept)
+        self.mjds = {}      # position -> time of the frame
+        self.count = 0      # frames pushed
+        self.done = 0       # frames processed (positions below are finished)
+
+
+    def _neighbours(self, pos):
+        """Positions of the K frames nearest in time to a frame."""
+        candidates = [p for p in range(max(pos - self.k, 0), min(pos + self.k + 1, self.count))
+                      if p != pos]
+        candidates.sort(key=lambda p: (abs(self.mjds[p] - self.mjds[pos]), p))
+        return sorted(candidates[:self.k])
+
+
+    def _submit(self, pos):
+        neighbours = [self.frames[p] for p in self._neighbours(pos)]
+        if len(neighbours) == 0:
+            neighbours = [self.frames[pos]]
+        args = (self.frames[pos], neighbours, self.method, self.sigma)
+        if self.pool is None:
+            future = Future()
+            future.set_result(_subtract_sky(*args))
+            return future
+        return self.pool.submit(_subtract_sky, *args)
+
+
+    def _process(self, last):
+        """Processes the frames up to a position (not included) and drops the frames 
+        that are not needed any more."""
+        ready = []
+        for pos in range(self.done, last):
+            ready.append((pos, self._submit(pos)))
+        self.done = max(self.done, last)
+        for pos in [p for p in self.frames if p < self.done - self.k]:
+            del self.frames[pos], self.mjds[pos]
+        return ready
+
+
+    def push(self, frame, mjd=None):
+        """Adds the next frame of the sequence.
+
+        Args:
+            frame (array): Frame (later in time than the previous ones).
+            mjd (float, optional): Time of the frame. Defaults to None (its position).
+
+        Returns:
+            list: Frames whose window is complete: (position, future with the frame 
+            without sky).
+        """
+        self.frames[self.count] = frame
+        self.mjds[self.count] = self.count if mjd is None else mjd
+        self.count += 1
+        return self._process(self.count - self.k)
+
+
+    def finish(self):
+        """Processes the remaining frames at the end of the sequence.
+
+        Returns:
+            list: (position, future with the frame without sky).
+        """
+        ready = self._process(self.count)
+        self.frames, self.mjds = {}, {}
+        return ready
+
+
+    def close(self):
+        """Stops the pool of threads."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+
+def subtract_running_sky(frames, mjds, k=5, method='median', sigma=3.0, workers=1):
+    """Subtracts the running-window sky from a list of frames.
+
+    Args:
+        frames (list): Frames (in any order).
+        mjds (list): Time of each frame.
+        k (int, optional): Number of neighbours. Defaults to 5.
+        method (str, optional): Combine method of the neighbours. Defaults to 'median'.
+        sigma (float, optional): Rejection threshold for 'sigclip'. Defaults to 3.0.
+        workers (int, optional): Number of threads. Defaults to 1.
+
+    Returns:
+        list: Frames without sky, in the same order as the input.
+    """
+    order = sorted(range(len(frames)), key=lambda i: (mjds[i], i))
+    model = RunningSky(k=k, method=method, sigma=sigma, workers=workers)
+    jobs = []
+    for i in order:
+        jobs.extend(model.push(frames[i], mjds[i]))
+    jobs.extend(model.finish())
+
+    results = [None] * len(frames)
+    for pos, future in jobs:
+        results[order[pos]] = future.result()
+    model.close()
+    return results
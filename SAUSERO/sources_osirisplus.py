@@ -0,0 +1,230 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import hashlib, json, os, threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import sep
+
+from SAUSERO.precision_osirisplus import to_native
+from loguru import logger
+
+# Fields of the sources kept in the catalogs.
+SOURCE_FIELDS = ('x', 'y', 'flux', 'a', 'b', 'theta')
+
+# Filter used to detect the sources of the STD frames and stacked images.
+PHOTOMETRY_KERNEL = [[1., 2., 3., 2., 1.],
+                     [2., 3., 5., 3., 2.],
+                     [3., 5., 8., 5., 3.],
+                     [2., 3., 5., 3., 2.],
+                     [1., 2., 3., 2., 1.]]
+
+
+def extract_sources(data, threshold=5.0, minarea=5, kernel=None, err=False, dtype='float32'):
+    """Detects the sources of a frame with sep, after subtracting its background.
+
+    Args:
+        data (array): Frame.
+        threshold (float, optional): Detection threshold, in units of the global rms of
+        the background. Defaults to 5.0.
+        minarea (int, optional): Minimum number of pixels of a source. Defaults to 5.
+        kernel (list, optional): Filter kernel. Defaults to None (the default of sep).
+        err (bool, optional): Give the global rms to sep as the error of the pixels
+        (matched filter) instead of an absolute threshold. Defaults to False.
+        dtype (str, optional): Floating point type of the detection. Defaults to 'float32'.
+
+    Returns:
+        array: Sources (SOURCE_FIELDS), sorted by decreasing flux.
+    """
+    image = np.ascontiguousarray(to_native(data, dtype))
+    bkg = sep.Background(image)
+    kwargs = {} if kernel is None else {'filter_kernel': np.array(kernel)}
+    if err:
+        objects = sep.extract(image - bkg, threshold, err=bkg.globalrms, minarea=minarea, **kwargs)
+    else:
+        objects = sep.extract(image - bkg.back(), threshold * bkg.globalrms, minarea=minarea, **kwargs)
+    # Same order as astroalign, so its control points are the brightest sources.
+    objects.sort(order='flux')
+    objects = objects[::-1]
+    sources = np.empty(len(objects), dtype=[(field, 'f8') for field in SOURCE_FIELDS])
+    for field in SOURCE_FIELDS:
+        sources[field] = objects[field]
+    return sources
+
+
+class SourceCache:
+    """Cache of the source catalogs of the frames. A catalog is stored under a key
+    built from the pixels of the frame and the detection parameters, so the sources
+    of a frame are detected once, whatever the stage that needs them (alignment,
+    astrometry, photometry) and even if its header has been rewritten. The catalogs
+    are kept in memory and, with a directory, on disk between runs, where the least
+    recently used ones are removed when the directory exceeds max_size.
+    """
+
+    def __init__(self, path=None, max_memory=64, max_size=256):
+        """Cache initialization.
+
+        Args:
+            path (str, optional): Directory of the catalogs. Defaults to None (only in memory).
+            max_memory (int, optional): Number of catalogs kept in memory. Defaults to 64.
+            max_size (float, optional): Maximum size of the directory in MB. Defaults to 256.
+        """
+        self.PATH = Path(path) if path else None
+        if self.PATH is not None:
+            self.PATH.mkdir(parents=True, exist_ok=True)
+        self.max_memory = max_memory
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def key(data, params):
+        """Returns the key (SHA-256) of the catalog of a frame.
+
+        Args:
+            data (array): Frame (with the floating point type of the detection).
+            params (dict): Detection parameters.
+
+        Returns:
+            str: Key.
+        """
+        h = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+        h.update(str(data.shape).encode())
+        h.update(np.ascontiguousarray(data).data)
+        return h.hexdigest()
+
+
+    def _remember(self, key, sources):
+        with self._lock:
+            self._memory[key] = sources
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+
+    def _evict(self):
+        """Removes the least recently used catalogs (by modification time, updated
+        when they are read) until the directory fits in max_size."""
+        entries = []
+        for entry in os.scandir(self.PATH):
+            if entry.name.endswith('.npy'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for __, size, __ in entries)
+        for __, size, path in sorted(entries):
+            if total <= self.max_size * 2**20:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+    def sources(self, data, threshold=5.0, minarea=5, kernel=None, err=False, dtype='float32'):
+        """Returns the sources of a frame, detecting them only if they are not in
+        the cache (see extract_sources for the parameters).
+
+        Returns:
+            array: Sources (SOURCE_FIELDS), sorted by decreasing flux.
+        """
+        params = {'threshold': threshold, 'minarea': minarea, 'kernel': kernel, 'err': err,
+                  'dtype': np.dtype(dtype).name}
+        image = np.ascontiguousarray(to_native(data, dtype))
+        key = self.key(image, params)
+        with self._lock:
+            sources = self._memory.get(key)
+        if sources is not None:
+            return sources
+
+        fname = self.PATH/f'{key}.npy' if self.PATH is not None else None
+        if fname is not None and fname.exists():
+            try:
+                sources = np.load(fname)
+                os.utime(fname)
+            except (OSError, ValueError):
+                sources = None
+        if sources is None:
+            sources = extract_sources(image, **params)
+            if fname is not None:
+                tmp = fname.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+                with open(tmp, 'wb') as file:
+                    np.save(file, sources)
+                os.replace(tmp, fname)
+                self._evict()
+        self._remember(key, sources)
+        return sources
+
+
+    def photometry_sources(self, data, conf):
+        """Returns the sources of a STD frame or stacked image with the parameters of
+        the photometry (PHOTOMETRY section), shared by the astrometry and photometry.
+
+        Args:
+            data (array): Frame.
+            conf (dict): Collection of configuration parameters.
+
+        Returns:
+            array: Sources.
+        """
+        return self.sources(data, threshold=conf["PHOTOMETRY"]["threshold"], kernel=PHOTOMETRY_KERNEL,
+                            err=True, dtype=data.dtype)
+
+
+def control_points(sources, max_control_points=60):
+    """Returns the positions (x, y) of the brightest sources, as control points for
+    astroalign.
+    """
+    return np.column_stack([sources['x'], sources['y']])[:max_control_points]
+
+
+# Cache shared by all the stages of a run. It is only in memory until configure_sources() is called.
+SOURCES = SourceCache()
+
+
+def configure_sources(conf):
+    """Replaces the shared cache by the one described in the configuration (SOURCES
+    section): on disk, by default in the .sources directory of the reduced frames
+    (at most max_size MB), or only in memory.
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+
+    Returns:
+        SourceCache: The new cache.
+    """
+    global SOURCES
+    src_conf = conf.get('SOURCES', {})
+    if src_conf.get('use_cache', True):
+        path = src_conf.get('PATH') or Path(conf['DIRECTORIES']['PATH_OUTPUT'])/'.sources'
+        SOURCES = SourceCache(path, max_size=src_conf.get('max_size', 256))
+    else:
+        SOURCES = SourceCache()
+    logger.info(f"Source catalogs cached in {SOURCES.PATH if SOURCES.PATH else 'memory'}")
+    return SOURCES
+
+
+def get_sources():
+    """Returns the shared cache."""
+    return SOURCES
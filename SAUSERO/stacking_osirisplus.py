@@ -0,0 +1,196 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import os, tempfile
+
+import numpy as np
+
+from SAUSERO.combine_osirisplus import COMBINE_METHODS, combine, sigclip_mask
+from loguru import logger
+
+# Methods available to combine the aligned frames (besides the running sum):
+#   the methods of combine_osirisplus,
+#   weighted: mean weighted by the inverse variance of the background of each frame.
+#   weighted_sigclip: weighted mean of the values kept by the sigma clipping.
+STACK_METHODS = COMBINE_METHODS + ('weighted', 'weighted_sigclip')
+
+
+def background_variance(frame):
+    """Robust variance of the background of a frame (median absolute deviation of
+    one pixel in 16, so the stars do not contribute).
+
+    Args:
+        frame (array): Aligned frame (NaN where it has no data).
+
+    Returns:
+        float: Variance.
+    """
+    sample = frame[::4, ::4]
+    sample = sample[np.isfinite(sample)]
+    if len(sample) == 0:
+        return np.inf
+    return float((1.4826 * np.median(np.abs(sample - np.median(sample))))**2)
+
+
+def extremes_mask(cube):
+    """Values kept when the minimum and the maximum value of each pixel are rejected
+    (as trimmed_median and minmax do). The pixels with fewer than 3 values keep all of them.
+
+    Args:
+        cube (array): Frame-major data cube (NaN where a frame has no data).
+
+    Returns:
+        array: Boolean cube of the kept values.
+    """
+    keep = ~np.isnan(cube)
+    trim = np.count_nonzero(keep, axis=0) > 2
+    lo = np.argmin(np.where(keep, cube, np.inf), axis=0)[None]
+    high = np.where(keep, cube, -np.inf)
+    # With equal values the maximum is another frame than the minimum.
+    np.put_along_axis(high, lo, -np.inf, axis=0)
+    hi = np.argmax(high, axis=0)[None]
+    del high
+    for index in (lo, hi):
+        np.put_along_axis(keep, index, np.take_along_axis(keep, index, axis=0) & ~trim, axis=0)
+    return keep
+
+
+class ScratchCube:
+    """Data cube of the aligned frames (frames, rows, columns) kept in a scratch
+    file on disk instead of in memory. The frames are written one at a time, as
+    they are aligned, and the cube is combined by blocks of rows (see combine), so
+    the memory used does not depend on the number of frames. The file is removed
+    with close().
+    """
+
+    def __init__(self, nframes, dtype=np.float64, path=None):
+        """Cube initialization. The file is created with the first frame.
+
+        Args:
+            nframes (int): Maximum number of frames.
+            dtype (dtype, optional): Floating point type of the cube. Defaults to float64.
+            path (str, optional): Directory of the scratch file. Defaults to None
+            (the temporary directory of the system).
+        """
+        self.nframes = nframes
+        self.dtype = np.dtype(dtype)
+        self.PATH = path
+        self.data = None
+        self.num = 0
+        self.exptimes = []
+        self.weights = []
+        self._dir = None
+
+
+    def append(self, frame, footprint=None, exptime=0.):
+        """Writes an aligned frame in the cube.
+
+        Args:
+            frame (array): Aligned frame.
+            footprint (array, optional): True where the frame has no data (NaN in the cube).
+            Defaults to None.
+            exptime (float, optional): Exposure time of the frame. Defaults to 0.
+        """
+        if self.data is None:
+            self._dir = tempfile.TemporaryDirectory(prefix='sausero_stack_', dir=self.PATH)
+            self.data = np.lib.format.open_memmap(os.path.join(self._dir.name, 'cube.npy'), mode='w+',
+                                                  dtype=self.dtype, shape=(self.nframes,) + frame.shape)
+        if self.num == self.nframes:
+            raise ValueError(f"The scratch cube is full ({self.nframes} frames)")
+        plane = self.data[self.num]
+        plane[...] = frame
+        if footprint is not None:
+            plane[footprint] = np.nan
+        var = background_variance(plane)
+        self.weights.append(1. / var if var > 0 else 0.)
+        self.exptimes.append(exptime)
+        self.num += 1
+
+
+    def combine(self, method='weighted', sigma=3.0, maxiters=5, memory_limit=None):
+        """Combines the frames of the cube by blocks of rows.
+
+        Args:
+            method (str, optional): One of STACK_METHODS. Defaults to 'weighted'.
+            sigma (float, optional): Rejection threshold of the clipping. Defaults to 3.0.
+            maxiters (int, optional): Maximum number of iterations of the clipping. Defaults to 5.
+            memory_limit (float, optional): Memory budget in MB for a block. Defaults to
+            None (all the rows at once).
+
+        Raises:
+            ValueError: If the method is not available.
+
+        Returns:
+            array, array, array: Combined image, exposure map (exposure time of the
+            values kept by the method in each pixel) and weight map (sum of their weights).
+            The median keeps every valid value; trimmed_median and minmax reject the
+            minimum and the maximum (with 3 or more values) and the clipping the outliers.
+        """
+        if method not in STACK_METHODS:
+            raise ValueError(f"Unknown stack method '{method}'. Options: {', '.join(STACK_METHODS)}")
+        cube = self.data[:self.num]
+        nrows, ncols = cube.shape[1:]
+        if memory_limit:
+            # The block is copied by the selection and the clipping (residuals and masks).
+            block = int(memory_limit * 2**20 // (4 * self.dtype.itemsize * self.num * ncols))
+            block = min(max(block, 1), nrows)
+        else:
+            block = nrows
+        logger.info(f"Combining {self.num} frames by blocks of {block} rows")
+
+        exptimes = np.array(self.exptimes, dtype=np.float64)[:, None, None]
+        weights = np.array(self.weights, dtype=np.float64)[:, None, None]
+        image = np.empty((nrows, ncols), dtype=self.dtype)
+        exposure = np.empty((nrows, ncols), dtype=np.float32)
+        weight = np.empty((nrows, ncols), dtype=np.float32)
+        for first in range(0, nrows, block):
+            last = min(first + block, nrows)
+            tile = np.array(cube[:, first:last])
+            if method in ('sigclip', 'weighted_sigclip'):
+                keep, __ = sigclip_mask(tile, sigma=sigma, maxiters=maxiters)
+            elif method in ('trimmed_median', 'minmax'):
+                keep = extremes_mask(tile)
+            else:
+                keep = ~np.isnan(tile)
+            if method in ('weighted', 'weighted_sigclip'):
+                w = np.where(keep, weights, 0.)
+                wsum = w.sum(axis=0)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    image[first:last] = np.sum(tile * w, axis=0, where=keep) / wsum
+            else:
+                image[first:last] = combine(tile, method=method, sigma=sigma, maxiters=maxiters)
+                wsum = np.sum(np.where(keep, weights, 0.), axis=0)
+            exposure[first:last] = np.sum(np.where(keep, exptimes, 0.), axis=0)
+            weight[first:last] = wsum
+        return image, exposure, weight
+
+
+    def close(self):
+        """Removes the scratch file."""
+        self.data = None
+        if self._dir is not None:
+            self._dir.cleanup()
+            self._dir = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,294 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import hashlib, json, os, shutil, sys, time
+from pathlib import Path
+
+import numpy as np
+
+from SAUSERO.Color_Codes import bcolors as bcl
+from loguru import logger
+
+
+class Stage:
+    """A step of the pipeline. Its fingerprint is built from the configuration keys
+    it uses, its input files and the fingerprints of the stages it depends on.
+
+    The in-memory results of a stage (e.g. the reduced frames) are returned by run()
+    as a dictionary (name: array, list of arrays, None or a JSON value), stored as a
+    checkpoint and given back to restore() when the stage is skipped and a later
+    stage needs them. A stage whose run() returns None has not changed the data of
+    the stages it depends on, so restoring it restores them. The files produced by
+    a stage are declared by its outputs() function.
+    """
+
+    def __init__(self, name, run, deps=(), config=(), inputs=None, restore=None, outputs=None):
+        """Stage initialization.
+
+        Args:
+            name (str): Name of the stage (e.g. masterflat:Sloan_r).
+            run (callable): Function without arguments that executes the stage.
+            deps (list, optional): Names of the stages it depends on. Defaults to ().
+            config (list, optional): Configuration keys used ('SECTION' or
+            'SECTION.key'). Defaults to ().
+            inputs (callable, optional): Function that returns the input files. Defaults to None.
+            restore (callable, optional): Function that takes the state saved by run().
+            Defaults to None (the stage only produces files).
+            outputs (callable, optional): Function that returns the files produced by
+            the stage, called after run(). Defaults to None (no files).
+        """
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.config = list(config)
+        self.inputs = inputs
+        self.restore = restore
+        self.outputs = outputs
+
+
+class StageGraph:
+    """Executor of a graph of stages with checkpoints. The stages are run in the
+    order they were added (each one after its dependencies). The fingerprint and
+    the products of every stage are recorded in stages.json; in the next run the
+    stages whose fingerprint has not changed and whose products exist are skipped,
+    so the pipeline resumes from the first stage that is not up to date. The
+    in-memory results are only stored (checkpoints) on request, since they are
+    full copies of the frames (the JSON values are always stored): without them, a
+    stage that is up to date is run again when a later stage that runs needs its results.
+    """
+
+    def __init__(self, conf, path, version='', checkpoint=False):
+        """Graph initialization.
+
+        Args:
+            conf (dict): Collection of configuration parameters.
+            path (str): Directory of the records and checkpoints.
+            version (str, optional): Version of the pipeline (part of the fingerprints).
+            checkpoint (bool, optional): Store the in-memory results of the stages.
+            Defaults to False.
+        """
+        self.conf = conf
+        self.PATH = Path(path)
+        self.version = version
+        self.checkpoint = checkpoint
+        self.stages = {}
+        self.status_path = self.PATH/'stages.json'
+        self.status = {}
+        if self.status_path.exists():
+            with open(self.status_path) as file:
+                self.status = json.load(file)
+        self._fingerprints = {}
+        self._ready = set()
+
+
+    def add(self, stage):
+        """Adds a stage. Its dependencies must have been added before."""
+        missing = [dep for dep in stage.deps if dep not in self.stages]
+        if len(missing) != 0:
+            raise ValueError(f"Unknown dependencies of the stage {stage.name}: {', '.join(missing)}")
+        self.stages[stage.name] = stage
+
+
+    def _config_value(self, item):
+        value = self.conf
+        for key in item.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        return value
+
+
+    def fingerprint(self, name):
+        """Returns the fingerprint (SHA-256) of a stage.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            str: Fingerprint.
+        """
+        if name not in self._fingerprints:
+            stage = self.stages[name]
+            files = []
+            for fname in (stage.inputs() if stage.inputs is not None else []):
+                st = os.stat(fname)
+                files.append([os.path.basename(str(fname)), st.st_size, st.st_mtime_ns])
+            # The order of the inputs and dependencies does not change the fingerprint.
+            content = {'stage': name, 'version': self.version,
+                       'config': {item: self._config_value(item) for item in stage.config},
+                       'inputs': sorted(files),
+                       'deps': sorted(self.fingerprint(dep) for dep in stage.deps)}
+            self._fingerprints[name] = hashlib.sha256(json.dumps(content, sort_keys=True,
+                                                                 default=str).encode()).hexdigest()
+        return self._fingerprints[name]
+
+
+    def up_to_date(self, name):
+        """Checks if a stage has been run with the same fingerprint and its product
+        files still exist."""
+        record = self.status.get(name)
+        if record is None or record['fingerprint'] != self.fingerprint(name):
+            return False
+        return all(os.path.exists(fname) for fname in record['outputs'])
+
+
+    def restorable(self, name):
+        """Checks if the in-memory results of a stage that is up to date can be given
+        back without running it: from its checkpoint or, if it has not changed the
+        data, from those of the stages it depends on."""
+        stage = self.stages[name]
+        if stage.restore is None:
+            return True
+        if not self.up_to_date(name):
+            return False
+        if self.status[name]['state']:
+            return (self.PATH/name.replace(':', '_')/'state.json').exists()
+        return all(self.restorable(dep) for dep in stage.deps)
+
+
+    def _save_state(self, name, state):
+        directory = self.PATH/name.replace(':', '_')
+        if directory.exists():
+            shutil.rmtree(directory)
+        directory.mkdir(parents=True)
+        manifest = {}
+        for i, (key, value) in enumerate(state.items()):
+            if isinstance(value, np.ndarray):
+                np.save(directory/f'{i}.npy', value)
+                manifest[key] = {'type': 'array', 'file': f'{i}.npy'}
+            elif isinstance(value, list) and len(value) != 0 and all(isinstance(v, np.ndarray) for v in value):
+                files = []
+                for j, frame in enumerate(value):
+                    np.save(directory/f'{i}_{j}.npy', frame)
+                    files.append(f'{i}_{j}.npy')
+                manifest[key] = {'type': 'frames', 'files': files}
+            else:
+                manifest[key] = {'type': 'json', 'value': value}
+        with open(directory/'state.json', 'w') as file:
+            json.dump(manifest, file)
+
+
+    def _load_state(self, name):
+        directory = self.PATH/name.replace(':', '_')
+        with open(directory/'state.json') as file:
+            manifest = json.load(file)
+        state = {}
+        for key, entry in manifest.items():
+            if entry['type'] == 'array':
+                state[key] = np.load(directory/entry['file'])
+            elif entry['type'] == 'frames':
+                state[key] = [np.load(directory/fname) for fname in entry['files']]
+            else:
+                state[key] = entry['value']
+        return state
+
+
+    def _write_status(self):
+        self.PATH.mkdir(parents=True, exist_ok=True)
+        tmp = self.status_path.with_suffix('.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(self.status, file, indent=4)
+        os.replace(tmp, self.status_path)
+
+
+    def require(self, name):
+        """Makes the results of a stage available, loading its checkpoint if it has
+        not been run in this execution.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        if name in self._ready:
+            return
+        stage = self.stages[name]
+        if stage.restore is not None:
+            if not self.up_to_date(name) or not self.restorable(name):
+                logger.critical(f"{bcl.ERROR}The stage {name} has no valid checkpoint. Run the "
+                                f"previous stages first (with checkpoint in STAGES){bcl.ENDC}")
+                sys.exit()
+            if self.status[name]['state']:
+                logger.info(f"Loading the checkpoint of the stage {name}")
+                stage.restore(self._load_state(name))
+            else:
+                for dep in stage.deps:
+                    self.require(dep)
+        self._ready.add(name)
+
+
+    def run_stage(self, name):
+        """Runs a stage (after making its dependencies available) and records it
+        with the files it declares as its products.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        stage = self.stages[name]
+        for dep in stage.deps:
+            self.require(dep)
+        logger.info(f"{bcl.OKCYAN}>>> Running the stage {name}{bcl.ENDC}")
+        start = time.time()
+        state = stage.run()
+        outputs = stage.outputs() if stage.outputs is not None else []
+        self._ready.add(name)
+        # Small results (JSON values, e.g. the zeropoints) are always stored.
+        if state is not None and (self.checkpoint or not any(isinstance(value, (np.ndarray, list))
+                                                             for value in state.values())):
+            self._save_state(name, state)
+        elif (self.PATH/name.replace(':', '_')).exists():
+            # The checkpoint of a previous run does not match this one.
+            shutil.rmtree(self.PATH/name.replace(':', '_'))
+        self.status[name] = {'fingerprint': self.fingerprint(name), 'state': state is not None,
+                             'outputs': sorted(set(str(fname) for fname in outputs)),
+                             'time': time.time() - start,
+                             'date': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime())}
+        self._write_status()
+
+
+    def run(self, only=None, force=False):
+        """Runs the stages that are not up to date.
+
+        Args:
+            only (str, optional): Run only this stage (its dependencies are loaded
+            from their checkpoints). Defaults to None (all the stages).
+            force (bool, optional): Run every stage. Defaults to False.
+        """
+        if only is not None:
+            if only not in self.stages:
+                logger.critical(f"{bcl.ERROR}Unknown stage {only}. Stages: {', '.join(self.stages)}{bcl.ENDC}")
+                sys.exit()
+            stale = [dep for dep in self.stages[only].deps
+                     if not self.up_to_date(dep) or not self.restorable(dep)]
+            if len(stale) != 0:
+                logger.critical(f"{bcl.ERROR}The stages {', '.join(stale)} are not up to date or have "
+                                f"no checkpoint (checkpoint in STAGES). Run them first{bcl.ENDC}")
+                sys.exit()
+            self.run_stage(only)
+            return
+
+        # A stage that is up to date also runs when a stage that runs needs its
+        # results and they cannot be restored (e.g. without checkpoints).
+        pending = set()
+        for name in reversed(list(self.stages)):
+            if force or not self.up_to_date(name):
+                pending.add(name)
+            elif not self.restorable(name) and any(name in self.stages[other].deps for other in pending):
+                pending.add(name)
+
+        for name in self.stages:
+            if name not in pending:
+                logger.info(f"{bcl.OKGREEN}The stage {name} is up to date{bcl.ENDC}")
+                continue
+            self.run_stage(name)
@@ -0,0 +1,337 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import os, time
+from pathlib import Path
+
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from SAUSERO.Color_Codes import bcolors as bcl
+from SAUSERO.aligning_osirisplus import StackAccumulator
+from SAUSERO.headers_osirisplus import FITS_EXTENSIONS, HEADERS
+from SAUSERO.reduction_osirisplus import Reduction, calibrate_frame, filter_wheel, remove_cosmics
+from SAUSERO.writer_osirisplus import get_writer
+from loguru import logger
+
+# Keywords of the headers that classify a frame (see Reduction.get_imagetypes).
+CLASSIFY_KEYWORDS = ('obsmode', 'filter1', 'filter2', 'filter3', 'filter4')
+
+
+class NightWatcher:
+    """Quick-look reduction of an OB while it is being observed. The raw directory
+    is polled and each new frame (once its size does not change) is classified from
+    its header. The masters are created when their frames have stopped arriving
+    (or taken from the calibration library) and then each new science frame is
+    calibrated, cleaned of cosmic rays and added to the running stack of its filter
+    (a StackAccumulator, saved in reduced/quicklook/.stacks, so a restarted watcher
+    extends it), without processing again the previous frames. The quick-look
+    products are saved in reduced/quicklook. When no frame arrives during the quiet
+    period, the OB is finished.
+    """
+
+    def __init__(self, conf, bpm_path):
+        """Watcher initialization.
+
+        Args:
+            conf (dict): Collection of configuration parameters (DIRECTORIES must be set).
+            bpm_path (str): Path to the BPM.
+        """
+        self.conf = conf
+        self.bpm_path = bpm_path
+        self.PATH = Path(conf['DIRECTORIES']['PATH_DATA'])
+        self.PATH_QL = Path(conf['DIRECTORIES']['PATH_OUTPUT'])/'quicklook'
+        self.PATH_QL.mkdir(parents=True, exist_ok=True)
+
+        watch_conf = conf.get('WATCH', {})
+        self.poll_interval = watch_conf.get('poll_interval', 10.)
+        self.quiet_period = watch_conf.get('quiet_period', 1800.)
+        self.calib_quiet = watch_conf.get('calib_quiet', 60.)
+        self.max_control_points = conf.get('ALIGNING', {}).get('max_control_points', 60)
+        self.seed = None
+        if conf.get('ALIGNING', {}).get('wcs_seed', False):
+            self.seed = {'search_radius': conf['ALIGNING'].get('wcs_search_radius', 10.0),
+                         'max_residual': conf['ALIGNING'].get('wcs_max_residual', 1.0)}
+
+        self.o = None                 # Reduction object, created with the first frames
+        self.DATA_DICT = {'bias': []} # Frames of each type, as Reduction.DATA_DICT
+        self.sizes = {}               # Size of the frames that are still being copied
+        self.frames = set()           # Frames already classified
+        self.setups = []              # OBSMODE and filter wheels of the frames (not bias)
+        self.wheel = None             # Filter wheel used by the OB (see filter_wheel)
+        self.last_arrival = {}        # Time of the last frame of each type (bias, flat+FILTER, ...)
+        self.last_frame = None        # Time of the last frame
+        self.pending = []             # Science frames waiting for their masters
+        self.stacks = {}              # Running stack (StackAccumulator) of each filter
+        self.library_tried = set()    # Masters already looked for in the library
+
+
+    def poll(self):
+        """Returns the new frames of the raw directory whose size has not changed
+        since the previous poll (so they have been completely copied).
+
+        Returns:
+            list: Paths to the new frames.
+        """
+        landed = []
+        for name in sorted(os.listdir(self.PATH)):
+            path = str(self.PATH/name)
+            if path in self.frames or not name.lower().endswith(FITS_EXTENSIONS):
+                continue
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                # Removed or renamed since the listing of the directory.
+                self.sizes.pop(path, None)
+                continue
+            if self.sizes.get(path) == size:
+                landed.append(path)
+                del self.sizes[path]
+            else:
+                self.sizes[path] = size
+        return landed
+
+
+    def classify(self, path):
+        """Returns the type of a raw frame as the keys of Reduction.DATA_DICT
+        (bias, flat+FILTER, std+FILTER or target+FILTER). The filter is the value of
+        the wheel that Reduction.get_imagetypes chooses for the frames received so far.
+
+        Args:
+            path (str): Path to the raw frame.
+
+        Returns:
+            str: Key of the frame, or None if it is not used.
+        """
+        obsmode = HEADERS.value(path, 'OBSMODE')
+        if obsmode == 'OsirisBias':
+            return 'bias'
+        self.setups.append([str(HEADERS.value(path, key.upper(), '')) for key in CLASSIFY_KEYWORDS])
+        wheel = filter_wheel(Table(rows=self.setups, names=CLASSIFY_KEYWORDS))
+        if wheel is None:
+            logger.warning(f"{bcl.WARNING}Incompatible filter setup in {os.path.basename(path)}{bcl.ENDC}")
+            return None
+        if self.wheel is not None and wheel != self.wheel:
+            logger.warning(f"{bcl.WARNING}The frames of the OB use the wheel {wheel}, but the previous "
+                           f"frames were classified with {self.wheel}{bcl.ENDC}")
+        self.wheel = wheel
+        filt = str(HEADERS.value(path, wheel.upper(), ''))
+        if obsmode == 'OsirisSkyFlat':
+            return 'flat+' + filt
+        if obsmode == 'OsirisBroadBandImage':
+            return ('std+' if 'STD' in str(HEADERS.value(path, 'OBJECT', '')) else 'target+') + filt
+        return None
+
+
+    def add(self, path):
+        """Classifies a new frame and adds it to the frames of the OB."""
+        self.frames.add(path)
+        key = self.classify(path)
+        if key is None:
+            logger.warning(f"{bcl.WARNING}Frame {os.path.basename(path)} of unknown type{bcl.ENDC}")
+            return
+        logger.info(f"{bcl.OKGREEN}New frame {os.path.basename(path)}: {key}{bcl.ENDC}")
+
+        for kind in ['flat', 'std', 'target']:
+            if '+' in key:
+                self.DATA_DICT.setdefault(kind + '+' + key.split('+')[1], [])
+        self.DATA_DICT[key].append(path)
+        self.last_arrival[key] = self.last_frame = time.time()
+        if key.startswith('target+'):
+            self.pending.append((path, key.split('+')[1]))
+
+
+    def _settled(self, key):
+        """Checks if the frames of a type have stopped arriving."""
+        return (len(self.DATA_DICT.get(key, [])) != 0 and
+                time.time() - self.last_arrival[key] >= self.calib_quiet)
+
+
+    def update_masters(self, filters):
+        """Creates the masters needed by the pending science frames, if their frames
+        have stopped arriving or the calibration library has them.
+
+        Args:
+            filters (set): Filters of the pending science frames.
+        """
+        R = self.conf['REDUCTION']
+        if 'bias' not in self.o.master_dict:
+            if self._settled('bias'):
+                self.o.do_masterbias()
+            elif len(self.DATA_DICT['bias']) == 0 and self.o.library is not None \
+                    and 'bias' not in self.library_tried:
+                self.library_tried.add('bias')
+                data, key = self.o.library.nearest('bias', self.o.obs_mjd(),
+                                                   params=self.o.combine_params('bias'))
+                if data is not None:
+                    self.o.masterbias = self.o.master_dict['bias'] = data
+                    self.o.masterbias_key = key
+            if 'bias' not in self.o.master_dict:
+                return
+
+        for filt in filters:
+            key = 'flat+' + filt
+            if key in self.o.master_dict:
+                continue
+            if not R['use_FLAT'] or filt == 'OPEN':
+                self.o.master_dict[key] = None
+            elif self._settled(key) or (len(self.DATA_DICT[key]) == 0 and self.o.library is not None
+                                        and key not in self.library_tried):
+                self.library_tried.add(key)
+                masterflat = self.o.filter_masterflat(key)
+                if masterflat is not None:
+                    self.o.master_dict[key] = masterflat
+
+
+    def process_pending(self):
+        """Reduces the pending science frames whose masters are ready."""
+        if len(self.pending) == 0:
+            return
+        self.update_masters(set(filt for __, filt in self.pending))
+        waiting = []
+        for path, filt in self.pending:
+            # Frames reduced before a restart of the watcher are not reduced again.
+            raw_name = os.path.basename(path).split('.')[0]
+            ql_path = self.PATH_QL/f'QL_{raw_name}_{filt}.fits'
+            if raw_name in self.get_stack(filt).frames:
+                logger.info(f"{raw_name} is already in the running stack for {filt}")
+            elif ql_path.exists():
+                logger.info(f"{raw_name} already reduced: its quick-look frame is added to the stack")
+                with fits.open(ql_path) as hdul:
+                    frame, header = hdul[0].data.astype(self.o.dtype), hdul[0].header
+                self.add_to_stack(frame, header, filt, name=raw_name)
+            elif 'bias' in self.o.master_dict and 'flat+' + filt in self.o.master_dict:
+                self.process_frame(path, filt)
+            else:
+                waiting.append((path, filt))
+        self.pending = waiting
+
+
+    def process_frame(self, path, filt):
+        """Calibrates a science frame, removes its cosmic rays, saves it and adds it
+        to the running stack of its filter.
+
+        Args:
+            path (str): Path to the raw science frame.
+            filt (str): Filter of the frame.
+        """
+        R = self.conf['REDUCTION']
+        frame = calibrate_frame(path, self.o.master_dict['bias'], self.o.master_dict['flat+' + filt],
+                                fill_nan=True, dtype=self.o.dtype, workers=self.o.calib_workers,
+                                block=self.o.calib_block)
+        if R['no_CRs']:
+            frame = remove_cosmics([frame], workers=self.o.cr_workers, tiles=self.o.cr_tiles,
+                                   halo=self.o.cr_halo, contrast=R['contrast'],
+                                   cr_threshold=R['cr_threshold'],
+                                   neighbor_threshold=R['neighbor_threshold'],
+                                   effective_gain=1.9, readnoise=4.3)[0]
+
+        hd = HEADERS.header(path)
+        hd_wcs = HEADERS.wcs_header(path)
+        hd['imgtype'] = 'SCIENCE'
+        hd['STATUS'] = 'QUICKLOOK'
+        hd['SSKY'] = 'SKY'
+        hd['filtro'] = filt
+        raw_name = os.path.basename(path).split('.')[0]
+        get_writer().write('watch', fits.HDUList([fits.PrimaryHDU(frame, header=hd+hd_wcs)]),
+                           str(self.PATH_QL/f'QL_{raw_name}_{filt}.fits'))
+        logger.info(f"{bcl.OKGREEN}Quick-look frame QL_{raw_name}_{filt} reduced{bcl.ENDC}")
+
+        self.add_to_stack(frame, hd + hd_wcs, filt, name=raw_name)
+
+
+    def get_stack(self, filt):
+        """Returns the running stack of a filter: the one saved by a previous run of
+        the watcher if it has the same settings, or a new one.
+
+        Args:
+            filt (str): Filter name.
+
+        Returns:
+            StackAccumulator: Running stack.
+        """
+        acc = self.stacks.get(filt)
+        if acc is None:
+            new = StackAccumulator(max_control_points=self.max_control_points, dtype=self.o.dtype, seed=self.seed)
+            acc = StackAccumulator.load(self.PATH_QL/'.stacks'/f'{filt}.npz')
+            if acc is None or acc.settings() != new.settings():
+                acc = new
+            self.stacks[filt] = acc
+        return acc
+
+
+    def add_to_stack(self, frame, header, filt, name=None):
+        """Registers a frame against the running stack of its filter and adds it.
+
+        Args:
+            frame (array): Reduced science frame.
+            header (Header): Header (with the WCS) of the frame.
+            filt (str): Filter of the frame.
+            name (str, optional): Name of the frame. Defaults to None.
+        """
+        acc = self.get_stack(filt)
+        if name in acc.frames:
+            return
+        if acc.add(frame, exptime=header.get('EXPTIME', 0.), name=name, wcs=WCS(header), header=header) is None:
+            return
+        acc.save(self.PATH_QL/'.stacks'/f'{filt}.npz')
+        self.write_stack(filt)
+
+
+    def write_stack(self, filt):
+        """Saves the running stack of a filter."""
+        acc = self.stacks[filt]
+        # Header of the first frame of the stack (saved with it).
+        hd = acc.base_header.copy()
+        hd['STACKED'] = (True, 'Stacked image')
+        hd['NCOMBINE'] = (acc.num, 'Number of stacked frames')
+        hd['exptime'] = acc.total_exptime
+        name = f"{hd.get('GTCPRGID', 'PRG')}_{hd.get('GTCOBID', 'OB')}_{filt}_quicklook.fits"
+        get_writer().write('watch', fits.HDUList([fits.PrimaryHDU(acc.stacked(), header=hd)]),
+                           str(self.PATH_QL/name))
+        logger.info(f"{bcl.OKCYAN}Running stack for {filt}: {acc.num} frames{bcl.ENDC}")
+
+
+    def run(self):
+        """Polls the raw directory until no frame arrives during the quiet period.
+        """
+        logger.info(f"{bcl.OKBLUE}---------- Watching {self.PATH} (quiet period: {self.quiet_period} s) ----------{bcl.ENDC}")
+        while True:
+            for path in self.poll():
+                self.add(path)
+            # The Reduction object reads the headers of the raw directory, so it is 
+            # created when no frame is being copied.
+            if self.o is None and len(self.frames) != 0 and len(self.sizes) == 0:
+                self.o = Reduction(main_path=self.PATH, path_mask=self.bpm_path, conf=self.conf)
+                self.o.load_BPM()
+                self.o.DATA_DICT = self.DATA_DICT
+            if self.o is not None:
+                self.process_pending()
+            if self.last_frame is not None and len(self.sizes) == 0 \
+                    and time.time() - self.last_frame >= self.quiet_period:
+                break
+            time.sleep(self.poll_interval)
+
+        # The masters are created now with all their frames, whatever calib_quiet.
+        self.calib_quiet = 0.
+        self.process_pending()
+        for path, filt in self.pending:
+            logger.warning(f"{bcl.WARNING}No masters to reduce {os.path.basename(path)} ({filt}){bcl.ENDC}")
+        get_writer().flush('watch')
+        logger.info(f"{bcl.OKBLUE}---------- No new frames in {self.quiet_period} s: end of the OB ----------{bcl.ENDC}")
@@ -0,0 +1,132 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import astroalign as aa
+import numpy as np
+from scipy.spatial import cKDTree
+
+from loguru import logger
+
+
+def predict_transform(wcs, ref_wcs, shape, grid=5):
+    """Predicts the transform (offset, rotation and scale) between a frame and the
+    reference from the WCS of their headers (the telescope pointing).
+
+    Args:
+        wcs (WCS): WCS of the frame.
+        ref_wcs (WCS): WCS of the reference.
+        shape (tuple): Shape of the frame.
+        grid (int, optional): Points per axis used to fit the transform. Defaults to 5.
+
+    Returns:
+        SimilarityTransform: Transform from the pixels of the frame to the pixels
+        of the reference, or None if a WCS is not valid.
+    """
+    if wcs is None or ref_wcs is None or not (wcs.has_celestial and ref_wcs.has_celestial):
+        return None
+    ys, xs = np.mgrid[0:shape[0] - 1:grid * 1j, 0:shape[1] - 1:grid * 1j]
+    src = np.column_stack([xs.ravel(), ys.ravel()])
+    try:
+        world = wcs.celestial.pixel_to_world_values(src[:, 0], src[:, 1])
+        dst = np.column_stack(ref_wcs.celestial.world_to_pixel_values(*world))
+    except Exception as e:
+        logger.warning(f"The transform cannot be predicted from the WCS: {e}")
+        return None
+    if not np.all(np.isfinite(dst)):
+        return None
+    return aa.estimate_transform('similarity', src, dst)
+
+
+def refine_transform(transform, sources, ref_sources, search_radius=10., max_residual=1.,
+                     min_matches=5, max_sources=60):
+    """Refines a predicted transform with the source catalogs: the sources of the
+    frame, moved by the transform, are matched with the closest sources of the
+    reference (within search_radius, then within 2 * max_residual) and the
+    transform is fitted again to the pairs. There is no combinatorial search, so
+    sparse fields with a few stars are aligned too.
+
+    Args:
+        transform (SimilarityTransform): Predicted transform.
+        sources (array): Sources of the frame (x, y).
+        ref_sources (array): Sources of the reference (x, y).
+        search_radius (float, optional): Error of the prediction (pixels). Defaults to 10.
+        max_residual (float, optional): Maximum residual of the fit (pixels). Defaults to 1.
+        min_matches (int, optional): Minimum number of matched sources. Defaults to 5.
+        max_sources (int, optional): Number of sources of the reference used. Defaults to 60.
+
+    Returns:
+        tuple: Refined transform (None if it is not valid) and a description of the fit.
+    """
+    src = np.column_stack([sources['x'], sources['y']])[:2 * max_sources]
+    ref = np.column_stack([ref_sources['x'], ref_sources['y']])[:max_sources]
+    if len(src) < min_matches or len(ref) < min_matches:
+        return None, "not enough sources"
+    for radius in (search_radius, 2. * max_residual):
+        dist, idx = cKDTree(aa.matrix_transform(src, transform.params)).query(ref, distance_upper_bound=radius)
+        matched = np.isfinite(dist)
+        if matched.sum() < min_matches:
+            return None, f"{matched.sum()} sources matched"
+        transform = aa.estimate_transform('similarity', src[idx[matched]], ref[matched])
+
+    residual = np.linalg.norm(aa.matrix_transform(src[idx[matched]], transform.params) - ref[matched], axis=1)
+    rms = np.sqrt(np.median(residual ** 2))
+    info = (f"{matched.sum()} sources, residual {rms:.3f} px, offset ({transform.translation[0]:.2f}, "
+            f"{transform.translation[1]:.2f}) px, rotation {np.degrees(transform.rotation):.4f} deg")
+    return (transform if rms <= max_residual else None), info
+
+
+def find_wcs_transform(shape, wcs, sources, ref_wcs, ref_sources, search_radius=10., max_residual=1.):
+    """Finds the transform of a frame with respect to a target, predicted by their
+    WCS and refined with their sources.
+
+    Args:
+        shape (tuple): Shape of the frame.
+        wcs (WCS): WCS of the frame.
+        sources (array): Sources of the frame.
+        ref_wcs (WCS): WCS of the target.
+        ref_sources (array): Sources of the target.
+        search_radius (float, optional): Error of the prediction (pixels). Defaults to 10.
+        max_residual (float, optional): Maximum residual of the fit (pixels). Defaults to 1.
+
+    Returns:
+        SimilarityTransform: Transform, or None if the prediction cannot be refined
+        and the full search is needed.
+    """
+    transform = predict_transform(wcs, ref_wcs, shape)
+    if transform is None:
+        return None
+    transform, info = refine_transform(transform, sources, ref_sources, search_radius=search_radius,
+                                       max_residual=max_residual)
+    if transform is None:
+        logger.info(f"WCS-seeded transform rejected: {info}")
+        return None
+    logger.info(f"WCS-seeded transform: {info}")
+    return transform
+
+
+def register_wcs(data, target, wcs, sources, ref_wcs, ref_sources, search_radius=10., max_residual=1.):
+    """Registers a frame against a target with the transform predicted by their WCS
+    and refined with their sources (see find_wcs_transform for the parameters).
+
+    Returns:
+        tuple: Aligned frame and footprint, or None if the prediction cannot be
+        refined and the full search is needed.
+    """
+    transform = find_wcs_transform(data.shape, wcs, sources, ref_wcs, ref_sources,
+                                   search_radius=search_radius, max_residual=max_residual)
+    return None if transform is None else aa.apply_transform(transform, data, target)
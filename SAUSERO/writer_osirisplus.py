@@ -0,0 +1,161 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+import os, queue, threading
+
+from SAUSERO.Color_Codes import bcolors as bcl
+from loguru import logger
+
+
+class WriteError(Exception):
+    """Raised by FitsWriter.flush when some of the queued frames could not be written.
+    """
+
+
+class FitsWriter:
+    """Background writer for the FITS products. The frames are queued and written by
+    a pool of threads while the computation continues. The queue is bounded: when it
+    is full, the stage that queues a new frame waits, so the frames waiting to be
+    written cannot exhaust the memory. Before a stage reads the files back, flush()
+    waits for all the pending writes and reports the errors against the stage that
+    queued each frame. With workers=0 the frames are written immediately.
+    """
+
+    def __init__(self, workers=0, max_queue=4):
+        """Writer initialization.
+
+        Args:
+            workers (int, optional): Number of writing threads. Defaults to 0 (synchronous).
+            max_queue (int, optional): Maximum number of frames waiting. Defaults to 4.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.errors = []
+        self._lock = threading.Lock()
+        self._threads = []
+        self._queue = None
+        if self.workers > 0:
+            self._queue = queue.Queue(maxsize=max(self.max_queue, 1))
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            self._write(*job)
+            self._queue.task_done()
+
+
+    def _write(self, stage, hdul, fname):
+        try:
+            hdul.writeto(fname, overwrite=True)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((stage, fname, e))
+            logger.error(f"{bcl.ERROR}[{stage}] The frame {os.path.basename(str(fname))} "
+                         f"could not be written: {e}{bcl.ENDC}")
+
+
+    def write(self, stage, hdul, fname):
+        """Queues an HDUList to be written.
+
+        Args:
+            stage (str): Name of the stage that produces the frame.
+            hdul (HDUList): Frame to write. It must not be modified afterwards.
+            fname (str): Path to the output file.
+        """
+        if self._queue is None:
+            self._write(stage, hdul, fname)
+        else:
+            self._queue.put((stage, hdul, fname))
+
+
+    def write_ccd(self, stage, ccd, fname):
+        """Queues a CCDData to be written. It is converted to an HDUList here, so
+        later changes of its header do not affect the written frame.
+
+        Args:
+            stage (str): Name of the stage that produces the frame.
+            ccd (CCDData): Frame to write.
+            fname (str): Path to the output file.
+        """
+        self.write(stage, ccd.to_hdu(), fname)
+
+
+    def flush(self, stage=None):
+        """Waits until all the queued frames have been written.
+
+        Args:
+            stage (str, optional): Only the errors of this stage are raised.
+            Defaults to None (all of them).
+
+        Raises:
+            WriteError: If some frame could not be written.
+        """
+        if self._queue is not None:
+            self._queue.join()
+        with self._lock:
+            failed = [err for err in self.errors if stage is None or err[0] == stage]
+            self.errors = [err for err in self.errors if err not in failed]
+        if len(failed) != 0:
+            raise WriteError("; ".join(f"[{st}] {os.path.basename(str(fname))}: {e}"
+                                       for st, fname, e in failed))
+
+
+    def close(self):
+        """Writes the pending frames and stops the threads."""
+        if self._queue is not None:
+            self._queue.join()
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._queue = None
+            self._threads = []
+
+
+# Writer shared by all the stages. It is synchronous until configure_writer() is called.
+WRITER = FitsWriter()
+
+
+def configure_writer(conf):
+    """Replaces the shared writer by the one described in the configuration.
+
+    Args:
+        conf (dict): Collection of configuration parameters.
+
+    Returns:
+        FitsWriter: The new writer.
+    """
+    global WRITER
+    WRITER.close()
+    writing = conf.get('WRITING', {})
+    workers = writing.get('writer_threads', 1) if writing.get('async_writer', False) else 0
+    WRITER = FitsWriter(workers=workers, max_queue=writing.get('writer_queue', 4))
+    return WRITER
+
+
+def get_writer():
+    """Returns the shared writer."""
+    return WRITER
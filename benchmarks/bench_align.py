@@ -0,0 +1,86 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+# Benchmark of the FFT shift (shift_osirisplus) against astroalign (aa.register)
+# for the registration of dithered frames (pure translations).
+#
+#   python -m benchmarks.bench_align --frames 5 --rows 1796 --cols 2032
+
+import argparse, time
+
+import astroalign as aa
+import numpy as np
+
+from SAUSERO.shift_osirisplus import register_shift
+from SAUSERO.sources_osirisplus import extract_sources
+
+
+def star_field(rows, cols, stars, shift, rng):
+    """Simulated frame: Gaussian stars (the same field, shifted) over a noisy sky."""
+    image = rng.normal(1000., 10., (rows, cols))
+    field = np.random.default_rng(1)
+    ys, xs = field.uniform(0, rows, stars) + shift[0], field.uniform(0, cols, stars) + shift[1]
+    fluxes = field.uniform(500., 20000., stars)
+    for y, x, flux in zip(ys, xs, fluxes):
+        y0, y1 = max(int(y) - 10, 0), min(int(y) + 11, rows)
+        x0, x1 = max(int(x) - 10, 0), min(int(x) + 11, cols)
+        if y1 <= y0 or x1 <= x0:
+            continue
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        image[y0:y1, x0:x1] += flux / (2 * np.pi * 2.5**2) * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * 2.5**2))
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the FFT shift registration.')
+    parser.add_argument('--frames', type=int, default=5, help='Number of dithered frames.')
+    parser.add_argument('--rows', type=int, default=1796, help='Rows per frame.')
+    parser.add_argument('--cols', type=int, default=2032, help='Columns per frame.')
+    parser.add_argument('--stars', type=int, default=300, help='Stars in the field.')
+    parser.add_argument('--max-control-points', type=int, default=60,
+                        help='Control points of astroalign.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    reference = star_field(args.rows, args.cols, args.stars, (0., 0.), rng)
+    shifts = [tuple(rng.uniform(-20., 20., 2)) for _ in range(args.frames)]
+    frames = [star_field(args.rows, args.cols, args.stars, shift, rng) for shift in shifts]
+    ref_sources = extract_sources(reference)
+    border = (slice(40, -40), slice(40, -40))
+
+    print(f"{args.frames} frames of {args.rows}x{args.cols}, {args.stars} stars")
+    print(f"{'method':<12}{'time (s)':>10}{'speed-up':>10}{'rms (ADU)':>12}")
+    results = {}
+    for method in ['astroalign', 'fft']:
+        start = time.perf_counter()
+        rms = []
+        for frame in frames:
+            if method == 'astroalign':
+                aligned, __ = aa.register(frame, reference, max_control_points=args.max_control_points)
+            else:
+                # The detection of the sources of the frame is included in the time.
+                aligned, __ = register_shift(frame, reference, extract_sources(frame), ref_sources)
+            rms.append(np.std((aligned - reference)[border]))
+        results[method] = (time.perf_counter() - start) / args.frames, np.mean(rms)
+    t_aa = results['astroalign'][0]
+    for method, (t, rms) in results.items():
+        print(f"{method:<12}{t:>10.3f}{t_aa / t:>10.2f}{rms:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
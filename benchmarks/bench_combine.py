@@ -0,0 +1,89 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+# Benchmark of the combine engine (combine_osirisplus) against the previous
+# implementation (dstack + sort + nanmedian of cube[:,:,1:-1]).
+#
+#   python -m benchmarks.bench_combine --frames 20 --rows 1796 --cols 2032
+
+import argparse, time, warnings
+
+import numpy as np
+
+from SAUSERO.combine_osirisplus import COMBINE_METHODS, combine, stack_frames
+
+
+def legacy_combining(lst_frames):
+    """Previous implementation of Reduction.combining."""
+    cube = np.dstack(lst_frames)
+    cube.sort(axis=2)
+    return np.nanmedian(cube[:,:,1:-1], axis=2)
+
+
+def timeit(func, repeat):
+    """Returns the best time of several executions and the last result."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the combine engine.')
+    parser.add_argument('--frames', type=int, default=20, help='Number of frames.')
+    parser.add_argument('--rows', type=int, default=1796, help='Rows per frame.')
+    parser.add_argument('--cols', type=int, default=2032, help='Columns per frame.')
+    parser.add_argument('--repeat', type=int, default=3, help='Executions per method.')
+    parser.add_argument('--nan-fraction', type=float, default=0.001,
+                        help='Fraction of NaN pixels (e.g. BPM) in each frame.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(args.frames):
+        fr = rng.normal(1000., 10., (args.rows, args.cols))
+        fr[rng.random(fr.shape) < args.nan_fraction] = np.nan
+        frames.append(fr)
+
+    t_legacy, ref = timeit(lambda: legacy_combining(frames), args.repeat)
+    print(f"{args.frames} frames of {args.rows}x{args.cols}")
+    print(f"{'method':<16}{'time (s)':>10}{'speed-up':>10}{'max |diff|':>14}")
+    print(f"{'legacy':<16}{t_legacy:>10.3f}{1.0:>10.2f}{0.0:>14.3e}")
+
+    for method in COMBINE_METHODS:
+        t, result = timeit(lambda: combine(stack_frames(frames), method=method), args.repeat)
+        diff = np.nanmax(np.abs(result - ref))
+        print(f"{method:<16}{t:>10.3f}{t_legacy / t:>10.2f}{diff:>14.3e}")
+
+    # With fewer than 3 frames nothing is left after rejecting the minimum and the
+    # maximum: the legacy implementation returns NaN, trimmed_median the median.
+    print(f"\n{'frames':<16}{'legacy NaN':>12}{'trimmed NaN':>13}{'max |diff| to median':>22}")
+    for num in (1, 2):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            legacy = legacy_combining(frames[:num])
+        cube = stack_frames(frames[:num])
+        result = combine(cube, method='trimmed_median')
+        diff = np.nanmax(np.abs(result - combine(cube, method='median')))
+        print(f"{num:<16}{np.isnan(legacy).mean():>12.3f}{np.isnan(result).mean():>13.3f}{diff:>22.3e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2026 Gran Telescopio Canarias <https://www.gtc.iac.es>
+Fabricio Manuel Pérez Toledo <fabricio.perez@gtc.iac.es>
+"""
+
+# Benchmark of the resampling kernels (resample_osirisplus) against astroalign
+# (aa.apply_transform) for the transforms of the alignment (offset and rotation).
+# The accuracy is the rms against the field rendered at the transformed positions.
+#
+#   python -m benchmarks.bench_resample --frames 3 --rows 1796 --cols 2032 --workers 4
+
+import argparse, time
+
+import astroalign as aa
+import numpy as np
+from skimage.transform import SimilarityTransform
+
+from SAUSERO.resample_osirisplus import RESAMPLE_KERNELS, resample
+
+
+def render(rows, cols, xs, ys, fluxes, sigma=2.5):
+    """Noiseless frame: Gaussian stars at (xs, ys) over a flat sky."""
+    image = np.full((rows, cols), 1000.)
+    for y, x, flux in zip(ys, xs, fluxes):
+        y0, y1 = max(int(y) - 12, 0), min(int(y) + 13, rows)
+        x0, x1 = max(int(x) - 12, 0), min(int(x) + 13, cols)
+        if y1 <= y0 or x1 <= x0:
+            continue
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        image[y0:y1, x0:x1] += flux / (2 * np.pi * sigma**2) * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * sigma**2))
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the resampling of the aligned frames.')
+    parser.add_argument('--frames', type=int, default=3, help='Number of transformed frames.')
+    parser.add_argument('--rows', type=int, default=1796, help='Rows per frame.')
+    parser.add_argument('--cols', type=int, default=2032, help='Columns per frame.')
+    parser.add_argument('--stars', type=int, default=300, help='Stars in the field.')
+    parser.add_argument('--rotation', type=float, default=0.5, help='Maximum rotation (degrees).')
+    parser.add_argument('--workers', type=int, default=1, help='Threads of resample.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(0, args.cols, args.stars), rng.uniform(0, args.rows, args.stars)
+    fluxes = rng.uniform(500., 20000., args.stars)
+    frame = render(args.rows, args.cols, xs, ys, fluxes)
+    transforms, truths = [], []
+    for _ in range(args.frames):
+        transform = SimilarityTransform(rotation=np.radians(rng.uniform(-args.rotation, args.rotation)),
+                                        translation=rng.uniform(-20., 20., 2))
+        moved = transform(np.column_stack([xs, ys]))
+        transforms.append(transform)
+        truths.append(render(args.rows, args.cols, moved[:, 0], moved[:, 1], fluxes))
+
+    print(f"{args.frames} frames of {args.rows}x{args.cols}, {args.stars} stars, {args.workers} threads")
+    print(f"{'method':<12}{'time (s)':>10}{'speed-up':>10}{'rms (ADU)':>12}{'vs aa (ADU)':>13}{'footprint':>11}")
+    results = {}
+    for method in ('astroalign',) + RESAMPLE_KERNELS:
+        elapsed, rms, diff, footprints = 0., [], [], 0
+        for i, (transform, truth) in enumerate(zip(transforms, truths)):
+            start = time.perf_counter()
+            if method == 'astroalign':
+                aligned, footprint = aa.apply_transform(transform, frame, frame)
+            else:
+                aligned, footprint = resample(frame, transform.params, kernel=method, workers=args.workers)
+            elapsed += time.perf_counter() - start
+            # Away from the edges, where the rendering is not complete.
+            inside = ~footprint
+            inside[:25], inside[-25:], inside[:, :25], inside[:, -25:] = False, False, False, False
+            rms.append(np.std((aligned - truth)[inside]))
+            if method == 'astroalign':
+                results.setdefault('aa', []).append((aligned, footprint))
+            else:
+                reference, ref_footprint = results['aa'][i]
+                diff.append(np.std((aligned - reference)[inside]))
+                footprints += np.count_nonzero(footprint != ref_footprint)
+        results[method] = elapsed / args.frames, np.mean(rms), np.mean(diff) if diff else 0., footprints
+    t_aa = results['astroalign'][0]
+    for method in ('astroalign',) + RESAMPLE_KERNELS:
+        t, rms, diff, footprints = results[method]
+        print(f"{method:<12}{t:>10.3f}{t_aa / t:>10.2f}{rms:>12.3f}{diff:>13.3f}{footprints:>11d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+
+def render(shape, xs, ys, fluxes, sky=1000., sigma=2.0):
+    """Noiseless frame: Gaussian stars at (xs, ys) over a flat sky."""
+    image = np.full(shape, sky)
+    for x, y, flux in zip(xs, ys, fluxes):
+        y0, y1 = max(int(y) - 12, 0), min(int(y) + 13, shape[0])
+        x0, x1 = max(int(x) - 12, 0), min(int(x) + 13, shape[1])
+        if y1 <= y0 or x1 <= x0:
+            continue
+        yy, xx = np.mgrid[y0:y1, x0:x1]
+        image[y0:y1, x0:x1] += flux / (2 * np.pi * sigma**2) * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * sigma**2))
+    return image
+
+
+class StarField:
+    """Stars over a sky, observed with a transform (pixels of the frame = transform
+    of the pixels of the first frame)."""
+
+    def __init__(self, shape=(400, 440), nstars=40, seed=0):
+        self.shape = shape
+        self.rng = np.random.default_rng(seed)
+        self.xs = self.rng.uniform(20, shape[1] - 20, nstars)
+        self.ys = self.rng.uniform(20, shape[0] - 20, nstars)
+        self.fluxes = self.rng.uniform(5000., 50000., nstars)
+
+    def positions(self, transform=None):
+        points = np.column_stack([self.xs, self.ys])
+        return points if transform is None else transform(points)
+
+    def frame(self, transform=None, noise=5., sky=1000.):
+        points = self.positions(transform)
+        image = render(self.shape, points[:, 0], points[:, 1], self.fluxes, sky=sky)
+        if noise:
+            image += self.rng.normal(0., noise, self.shape)
+        return image
+
+
+@pytest.fixture
+def field():
+    return StarField()
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+from skimage.transform import SimilarityTransform
+
+from SAUSERO.aligning_osirisplus import StackAccumulator, raw_exposure
+
+OFFSETS = [(0., 0.), (8., -5.), (-6., 7.), (4., 9.)]
+
+
+@pytest.fixture
+def frames(field):
+    return [field.frame(SimilarityTransform(translation=offset)) for offset in OFFSETS]
+
+
+def add_frames(acc, frames, names):
+    for frame, name in zip(frames, names):
+        assert acc.add(frame, exptime=30., name=name, stamp=[1, 2], header=fits.Header({'OBJECT': 'M31'})) is not None
+    return acc
+
+
+@pytest.mark.parametrize('shift', [None, {'border': 32}])
+def test_save_load_and_extend(tmp_path, frames, shift):
+    names = [f'frame{i}' for i in range(len(frames))]
+    add_frames(StackAccumulator(shift=shift), frames[:2], names[:2]).save(tmp_path/'stack.npz')
+
+    acc = StackAccumulator.load(tmp_path/'stack.npz')
+    assert acc.settings() == StackAccumulator(shift=shift).settings()
+    assert acc.num == 2 and acc.total_exptime == 60. and list(acc.frames) == names[:2]
+    assert acc.base_header['OBJECT'] == 'M31'
+    add_frames(acc, frames[2:], names[2:])
+
+    # The same stack as adding all the frames in one run.
+    full = add_frames(StackAccumulator(shift=shift), frames, names)
+    assert acc.num == full.num == len(frames) and acc.total_exptime == full.total_exptime
+    np.testing.assert_allclose(acc.stacked(), full.stacked(), rtol=1e-9)
+    np.testing.assert_array_equal(acc.exposure, full.exposure)
+    assert acc.exposure.max() == 30. * len(frames) and acc.exposure.min() < acc.exposure.max()
+
+
+def test_stack_is_aligned(field, frames):
+    acc = add_frames(StackAccumulator(shift={'border': 32}), frames, range(len(frames)))
+    stacked = acc.stacked() / len(frames)
+    reference = field.frame(noise=0.)
+    inside = acc.exposure == acc.exposure.max()
+    assert np.std((stacked - reference)[inside]) < 5.
+
+
+def test_extends(tmp_path, frames):
+    paths = []
+    for i, frame in enumerate(frames[:3]):
+        paths.append(tmp_path/f'ADP_{i:010d}-OSIRIS_SCIENCE_SKY.fits')
+        fits.PrimaryHDU(frame, header=fits.Header({'EXPTIME': 30.})).writeto(paths[-1])
+    acc = StackAccumulator()
+    for path in paths[:2]:
+        acc.add_file(path)
+    assert acc.extends(paths) and acc.extends(paths[:2])
+    assert not acc.extends(paths[1:])
+    fits.PrimaryHDU(frames[3], header=fits.Header({'EXPTIME': 30.})).writeto(paths[1], overwrite=True)
+    assert not acc.extends(paths)
+    assert raw_exposure(paths[0]) == '0000000000-OSIRIS'
+
+
+def test_settings_and_missing_files(tmp_path, frames):
+    assert StackAccumulator.load(tmp_path/'missing.npz') is None
+    acc = add_frames(StackAccumulator(resample={'kernel': 'lanczos3', 'workers': 2}), frames[:1], ['a'])
+    acc.save(tmp_path/'stack.npz')
+    loaded = StackAccumulator.load(tmp_path/'stack.npz')
+    # The number of threads does not change the stack.
+    assert loaded.settings() == StackAccumulator(resample={'kernel': 'lanczos3', 'workers': 8}).settings()
+    assert loaded.settings() != StackAccumulator(resample={'kernel': 'bilinear'}).settings()
+    assert loaded.settings() != StackAccumulator().settings()
+
+
+def test_frame_without_stars(frames):
+    acc = add_frames(StackAccumulator(), frames[:1], ['a'])
+    assert acc.add(np.random.default_rng(1).normal(1000., 5., frames[0].shape), name='b') is None
+    assert 'b' in acc.failed and acc.num == 1
@@ -0,0 +1,77 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from SAUSERO.combine_osirisplus import COMBINE_METHODS, combine, stack_frames
+
+
+def legacy_combining(lst_frames):
+    """Previous implementation of Reduction.combining."""
+    cube = np.dstack(lst_frames)
+    cube.sort(axis=2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(cube[:, :, 1:-1], axis=2)
+
+
+def make_frames(num, shape=(40, 50), nan_fraction=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(num):
+        fr = rng.normal(1000., 10., shape)
+        fr[rng.random(shape) < nan_fraction] = np.nan
+        frames.append(fr)
+    return frames
+
+
+@pytest.mark.parametrize('num', [3, 4, 7, 10])
+def test_trimmed_median_matches_legacy(num):
+    frames = make_frames(num)
+    result = combine(stack_frames(frames), method='trimmed_median')
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(legacy_combining(frames)))
+    np.testing.assert_allclose(result, legacy_combining(frames), rtol=0, atol=1e-9, equal_nan=True)
+
+
+def test_trimmed_median_all_nan_pixel():
+    frames = make_frames(5, nan_fraction=0.)
+    for fr in frames:
+        fr[3, 4] = np.nan
+    result = combine(stack_frames(frames), method='trimmed_median')
+    assert np.isnan(result[3, 4])
+    assert np.count_nonzero(np.isnan(result)) == 1
+
+
+@pytest.mark.parametrize('num', [1, 2])
+def test_trimmed_median_few_frames_is_median(num):
+    frames = make_frames(num, nan_fraction=0.)
+    result = combine(stack_frames(frames), method='trimmed_median')
+    np.testing.assert_allclose(result, np.median(stack_frames(frames), axis=0))
+
+
+def test_median_matches_nanmedian():
+    cube = stack_frames(make_frames(6))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.nanmedian(cube, axis=0)
+    np.testing.assert_allclose(combine(cube, method='median'), expected, equal_nan=True)
+
+
+def test_minmax_rejects_extremes():
+    cube = stack_frames(make_frames(5, nan_fraction=0.))
+    ordered = np.sort(cube, axis=0)
+    np.testing.assert_allclose(combine(cube, method='minmax'), ordered[1:-1].mean(axis=0))
+
+
+def test_sigclip_rejects_outlier():
+    cube = stack_frames(make_frames(20, nan_fraction=0., seed=1))
+    cube[4, 10, 10] = 1e6
+    result = combine(cube, method='sigclip', sigma=3.0)
+    assert abs(result[10, 10] - 1000.) < 20.
+    np.testing.assert_allclose(np.delete(result.ravel(), 10 * 50 + 10), 1000., atol=20.)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        combine(stack_frames(make_frames(3)), method='mean')
+    assert 'mean' not in COMBINE_METHODS
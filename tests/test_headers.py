@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from ccdproc import ImageFileCollection
+
+from SAUSERO.headers_osirisplus import HeaderCache, HeaderCatalog, HeaderCollection
+
+KEYWORDS = ['OBSMODE', 'OBJECT', 'FILTER2', 'EXPTIME']
+FRAMES = [
+    ('0001-OsirisBias.fits', {'OBSMODE': 'OsirisBias', 'FILTER2': 'OPEN', 'EXPTIME': 0.0}),
+    ('0002-OsirisSkyFlat.fits', {'OBSMODE': 'OsirisSkyFlat', 'OBJECT': 'Flat', 'FILTER2': 'Sloan_r',
+                                 'EXPTIME': 5.0}),
+    ('0003-OsirisBroadBandImage.fits', {'OBSMODE': 'OsirisBroadBandImage', 'OBJECT': 'STD_GD71',
+                                        'FILTER2': 'Sloan_r', 'EXPTIME': 10.0}),
+    ('0004-OsirisBroadBandImage.fits', {'OBSMODE': 'OsirisBroadBandImage', 'OBJECT': 'M31',
+                                        'FILTER2': 'SLOAN_R', 'EXPTIME': 60.0}),
+    ('0005-OsirisBroadBandImage.fits', {'OBSMODE': 'osirisbroadbandimage', 'OBJECT': 'M31',
+                                        'FILTER2': 'Sloan_g', 'EXPTIME': 60.0}),
+]
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name, cards in FRAMES:
+        hdu = fits.PrimaryHDU(np.zeros((4, 4), dtype=np.int16))
+        hdu.header.update(cards)
+        hdu.writeto(tmp_path/name)
+    (tmp_path/'notes.txt').write_text('not a frame')
+    return tmp_path
+
+
+@pytest.fixture(params=['memory', 'catalog'])
+def cache(request, tmp_path):
+    if request.param == 'catalog':
+        return HeaderCache(catalog=HeaderCatalog(tmp_path/'catalog'/'headers.sqlite'))
+    return HeaderCache()
+
+
+def test_summary_matches_image_file_collection(directory, cache):
+    ours = HeaderCollection(directory, keywords=KEYWORDS, cache=cache)
+    theirs = ImageFileCollection(directory, keywords=KEYWORDS)
+    assert ours.files == sorted(theirs.files)
+    assert ours.summary.colnames == theirs.summary.colnames
+    theirs.summary.sort('file')
+    for name in ours.summary.colnames:
+        np.testing.assert_array_equal(np.ma.getmaskarray(ours.summary[name]),
+                                      np.ma.getmaskarray(theirs.summary[name]))
+        assert list(ours.summary[name].compressed()) == list(theirs.summary[name].compressed())
+
+
+@pytest.mark.parametrize('kwd', [
+    {'OBSMODE': 'OsirisBroadBandImage'},
+    {'obsmode': 'OSIRISBROADBANDIMAGE'},
+    {'OBSMODE': 'OsirisBroadBandImage', 'filter2': 'sloan_r'},
+    {'OBJECT': '*'},
+    {'EXPTIME': 60.0},
+    {'OBSMODE': 'OsirisBias', 'EXPTIME': 0.0},
+    {'OBJECT': 'Galaxy'},
+    {'RSPEED': '*'},
+])
+def test_files_filtered_matches_image_file_collection(directory, cache, kwd):
+    ours = HeaderCollection(directory, keywords=KEYWORDS, cache=cache)
+    theirs = ImageFileCollection(directory, keywords=KEYWORDS)
+    assert ours.files_filtered(**kwd) == sorted(theirs.files_filtered(**kwd))
+    assert ours.files_filtered(include_path=True, **kwd) == \
+        sorted(theirs.files_filtered(include_path=True, **kwd))
+
+
+def test_all_keywords(directory, cache):
+    ours = HeaderCollection(directory, cache=cache)
+    theirs = ImageFileCollection(directory)
+    for name in ('obsmode', 'object', 'filter2', 'exptime'):
+        assert name in ours.summary.colnames and name in theirs.summary.colnames
+    assert ours.files_filtered(filter2='Sloan_r') == sorted(theirs.files_filtered(filter2='Sloan_r'))
+    assert ours.files_filtered(FILTER2='Sloan_r') == sorted(theirs.files_filtered(FILTER2='Sloan_r'))
+
+
+def test_glob(directory, cache):
+    ours = HeaderCollection(directory, keywords=KEYWORDS, cache=cache,
+                            glob_include='*Osiris*', glob_exclude='*Bias*')
+    theirs = ImageFileCollection(directory, keywords=KEYWORDS, glob_include='*Osiris*',
+                                 glob_exclude='*Bias*')
+    assert ours.files == sorted(theirs.files)
+
+
+def test_rewritten_frame_is_read_again(directory, cache):
+    path = directory/FRAMES[0][0]
+    assert cache.value(path, 'OBJECT') is None
+    with fits.open(path, mode='update') as hdul:
+        hdul[0].header['OBJECT'] = 'Bias'
+        hdul[0].header['EXTRA'] = 'x' * 60
+    assert cache.value(path, 'OBJECT') == 'Bias'
+
+
+def test_catalog_persists_between_runs(directory, tmp_path):
+    catalog_path = tmp_path/'catalog'/'headers.sqlite'
+    HeaderCollection(directory, cache=HeaderCache(catalog=HeaderCatalog(catalog_path)))
+    # A new cache (another run) takes the headers from the catalog.
+    cache = HeaderCache(catalog=HeaderCatalog(catalog_path))
+    path = os.path.abspath(directory/FRAMES[3][0])
+    assert cache.catalog.lookup(path, *cache._stamp(path))['OBJECT'] == 'M31'
+    os.remove(directory/FRAMES[4][0])
+    collection = HeaderCollection(directory, keywords=KEYWORDS, cache=cache)
+    assert collection.files_filtered(OBJECT='M31') == [FRAMES[3][0]]
+
+
+def test_cache_is_bounded(directory):
+    cache = HeaderCache(max_headers=2)
+    for name, __ in FRAMES:
+        cache.header(directory/name)
+    assert len(cache._headers) == 2
+    assert list(cache._headers) == [os.path.abspath(directory/name) for name, __ in FRAMES[-2:]]
@@ -0,0 +1,97 @@
+import os, shutil, threading, time
+
+import numpy as np
+import pytest
+
+from SAUSERO.library_osirisplus import CalibrationLibrary
+
+
+@pytest.fixture
+def library(tmp_path):
+    return CalibrationLibrary(path=tmp_path/'library', max_days=3.0)
+
+
+def test_make_key_depends_on_content(tmp_path):
+    first, second = tmp_path/'a.fits', tmp_path/'b.fits'
+    first.write_bytes(b'bias frame 1')
+    second.write_bytes(b'bias frame 2')
+    key = CalibrationLibrary.make_key([str(first), str(second)], {'method': 'median'})
+
+    # Copied (and renamed) frames, in another order, keep the key.
+    copies = tmp_path/'copies'
+    copies.mkdir()
+    shutil.copy(first, copies/'c.fits')
+    shutil.copy(second, copies/'d.fits')
+    assert CalibrationLibrary.make_key([str(copies/'d.fits'), str(copies/'c.fits')],
+                                       {'method': 'median'}) == key
+
+    # Another content or other parameters change it.
+    (copies/'c.fits').write_bytes(b'bias frame 3')
+    assert CalibrationLibrary.make_key([str(copies/'c.fits'), str(copies/'d.fits')],
+                                       {'method': 'median'}) != key
+    assert CalibrationLibrary.make_key([str(first), str(second)], {'method': 'minmax'}) != key
+
+
+def test_store_and_nearest(library):
+    params = {'kind': 'bias', 'method': 'median', 'bpm': 'BPM.fits'}
+    library.store('a' * 64, np.full((4, 4), 1., np.float32), 'bias', mjd=100.0, params=params)
+    library.store('b' * 64, np.full((4, 4), 2., np.float32), 'bias', mjd=101.5, params=params)
+
+    data, key = library.nearest('bias', 101.0, params={'method': 'median'})
+    assert key == 'b' * 64 and data.dtype == np.float32
+    np.testing.assert_array_equal(data, 2.)
+    assert library.get('a' * 64)[0, 0] == 1.
+
+    assert library.has('bias', 99.0, params={'method': 'median'})
+    assert not library.has('bias', 99.0, params={'method': 'minmax'})
+    assert not library.has('bias', 110.0)
+    assert not library.has('flat', 100.0)
+    assert not library.has('bias', None)
+    assert library.nearest('bias', 110.0) == (None, None)
+
+    # A master whose file was removed is not valid.
+    os.remove(library.PATH/f"bias_{'b' * 16}.fits")
+    assert not library.has('bias', 101.5)
+
+
+def test_get_or_build_builds_once(library):
+    calls = []
+    def build():
+        calls.append(1)
+        return np.ones((3, 3))
+    for _ in range(2):
+        data = library.get_or_build('c' * 64, build, 'bias', mjd=100.0)
+        np.testing.assert_array_equal(data, 1.)
+    assert len(calls) == 1
+
+
+def test_stale_lock_is_removed(tmp_path):
+    lock_path = tmp_path/'stale.lock'
+    lock_path.touch()
+    old = time.time() - 10.
+    os.utime(lock_path, (old, old))
+    start = time.perf_counter()
+    with CalibrationLibrary._file_lock(lock_path, timeout=1.):
+        assert lock_path.exists()
+    assert time.perf_counter() - start < 1.
+    assert not lock_path.exists()
+
+
+def test_held_lock_is_refreshed(tmp_path):
+    lock_path = tmp_path/'held.lock'
+    held, events = threading.Event(), []
+
+    def owner():
+        with CalibrationLibrary._file_lock(lock_path, timeout=0.4):
+            held.set()
+            # Held for longer than the timeout: the refresh keeps it valid.
+            time.sleep(1.2)
+            events.append('released')
+
+    thread = threading.Thread(target=owner)
+    thread.start()
+    held.wait()
+    with CalibrationLibrary._file_lock(lock_path, timeout=0.4):
+        events.append('acquired')
+    thread.join()
+    assert events == ['released', 'acquired']
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from SAUSERO.combine_osirisplus import combine, stack_frames
+from SAUSERO.reduction_osirisplus import (TRIM_COLS, TRIM_ROWS, Reduction, remove_cosmics,
+                                          shutdown_cosmics_pools)
+
+RAW_SHAPE = (TRIM_ROWS[1] + 4, TRIM_COLS[1] + 4)
+
+
+def write_raw(path, seed=0, bscale=None, bzero=None):
+    """Writes a raw frame. By default it has unsigned integers, stored as int16 
+    with BZERO = 32768; with bscale and bzero, the values are scaled to int16."""
+    rng = np.random.default_rng(seed)
+    data = rng.integers(500, 60000, RAW_SHAPE).astype(np.uint16)
+    hdu = fits.PrimaryHDU(data)
+    if bscale is not None:
+        hdu = fits.PrimaryHDU(data.astype(np.float64))
+        hdu.scale('int16', bscale=bscale, bzero=bzero)
+    hdu.writeto(path)
+    return fits.getdata(path).astype(np.float64)
+
+
+def test_combining_by_blocks():
+    rng = np.random.default_rng(0)
+    frames = [rng.normal(1000., 10., (300, 200)) for _ in range(5)]
+    offset = rng.normal(100., 1., (300, 200))
+    expected = combine(stack_frames([fr - offset for fr in frames]))
+    # About 20 rows per block.
+    result = Reduction.combining(frames, memory_limit=3 * 8 * 5 * 200 * 20 / 2**20, offset=offset)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('scaling', [{}, {'bscale': 2., 'bzero': 30000.}])
+def test_read_rows_applies_scaling(tmp_path, scaling):
+    path = tmp_path/'raw.fits'
+    data = write_raw(path, **scaling)
+    with fits.open(path, do_not_scale_image_data=True) as hdul:
+        assert hdul[0].header['BZERO'] != 0
+        assert hdul[0].data.dtype.kind == 'i'
+    trimmed = data[TRIM_ROWS[0]:TRIM_ROWS[1], TRIM_COLS[0]:TRIM_COLS[1]]
+    np.testing.assert_array_equal(Reduction.read_trimmed(path), trimmed)
+    block = Reduction.read_rows(path, 100, 130, dtype=np.float32)
+    assert block.dtype == np.float32 and block.dtype.isnative
+    np.testing.assert_array_equal(block, trimmed[100:130].astype(np.float32))
+
+
+def test_combining_raw_frames(tmp_path):
+    paths = [tmp_path/f'raw{i}.fits' for i in range(3)]
+    for i, path in enumerate(paths):
+        write_raw(path, seed=i)
+    expected = combine(stack_frames([Reduction.read_trimmed(path) for path in paths]))
+    np.testing.assert_array_equal(Reduction.combining([str(p) for p in paths], memory_limit=16), expected)
+
+
+def cosmic_frame(shape=(160, 180), seed=0):
+    """Sky with a few stars and cosmic rays (sharp single pixels and short tracks)."""
+    rng = np.random.default_rng(seed)
+    frame = rng.normal(500., 12., shape)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    for y, x in rng.uniform(10, min(shape) - 10, (8, 2)):
+        frame += 3000. * np.exp(-((yy - y)**2 + (xx - x)**2) / (2 * 2.**2))
+    for y, x in rng.integers(5, min(shape) - 5, (15, 2)):
+        frame[y, x:x + rng.integers(1, 4)] += 5000.
+    return frame
+
+
+def test_tiled_cosmics_match_serial():
+    frames = [cosmic_frame(seed=i) for i in range(2)]
+    kwargs = dict(contrast=1.5, cr_threshold=5., neighbor_threshold=5., effective_gain=1.9, readnoise=4.3)
+    serial = remove_cosmics(frames, **kwargs)
+    try:
+        tiled = remove_cosmics(frames, workers=2, tiles=2, halo=32, **kwargs)
+    finally:
+        shutdown_cosmics_pools()
+    for fr, ser, til in zip(frames, serial, tiled):
+        assert np.count_nonzero(ser != fr) > 0
+        np.testing.assert_array_equal(til, ser)
@@ -0,0 +1,82 @@
+import astroalign as aa
+import numpy as np
+import pytest
+from skimage.transform import SimilarityTransform, warp
+
+from SAUSERO.resample_osirisplus import RESAMPLE_KERNELS, resample
+
+
+@pytest.fixture
+def transform():
+    return SimilarityTransform(rotation=np.radians(0.4), translation=(6.3, -4.2))
+
+
+def interior(transform, shape, margin=1.):
+    """Output pixels whose position in the frame is at least margin pixels inside it."""
+    ys, xs = np.mgrid[0:shape[0], 0:shape[1]]
+    sx, sy = transform.inverse(np.column_stack([xs.ravel(), ys.ravel()])).T
+    inside = (sx >= margin) & (sx <= shape[1] - 1 - margin) & (sy >= margin) & (sy <= shape[0] - 1 - margin)
+    return inside.reshape(shape)
+
+
+@pytest.mark.parametrize('kernel', RESAMPLE_KERNELS)
+def test_matches_astroalign(field, transform, kernel):
+    frame = field.frame()
+    expected, expected_footprint = aa.apply_transform(transform, frame, frame)
+    result, footprint = resample(frame, transform.params, kernel=kernel, workers=1)
+    assert result.dtype == frame.dtype
+    np.testing.assert_array_equal(footprint, expected_footprint)
+
+    # The same accuracy as the bicubic interpolation of astroalign.
+    truth = field.frame(transform, noise=0.)
+    inside = interior(transform, frame.shape, margin=15.)
+    error = np.std((result - truth)[inside])
+    assert error < 1.2 * np.std((expected - truth)[inside]) if kernel != 'nearest' else error < 5. * 5.
+    if kernel == 'lanczos3':
+        assert np.std((result - expected)[inside]) < 0.3 * 5.
+
+
+@pytest.mark.parametrize('kernel, order', [('nearest', 0), ('bilinear', 1)])
+def test_matches_warp(field, transform, kernel, order):
+    frame = field.frame()
+    expected = warp(frame, transform.inverse, output_shape=frame.shape, order=order, mode='constant',
+                    cval=np.median(frame), preserve_range=True)
+    result, __ = resample(frame, transform.params, kernel=kernel, workers=1)
+    inside = interior(transform, frame.shape)
+    np.testing.assert_allclose(result[inside], expected[inside], rtol=1e-10)
+
+
+@pytest.mark.parametrize('kernel', RESAMPLE_KERNELS)
+def test_integer_translation(field, kernel):
+    frame = field.frame()
+    result, footprint = resample(frame, SimilarityTransform(translation=(3, -2)).params, kernel=kernel,
+                                 workers=1, fill=0.)
+    np.testing.assert_allclose(result[:-2, 3:], frame[2:, :-3], rtol=1e-9)
+    assert footprint[-2:].all() and footprint[:, :3].all() and not footprint[:-2, 3:].any()
+    assert (result[footprint] == 0.).all()
+
+
+def test_threads_and_accumulate(field, transform):
+    frame = field.frame().astype(np.float32)
+    serial, serial_footprint = resample(frame, transform.params, kernel='lanczos3', workers=1)
+    threaded, threaded_footprint = resample(frame, transform.params, kernel='lanczos3', workers=4, block=16)
+    np.testing.assert_array_equal(threaded, serial)
+    np.testing.assert_array_equal(threaded_footprint, serial_footprint)
+
+    total = np.ones(frame.shape, dtype=np.float32)
+    resample(frame, transform.params, out=total, kernel='lanczos3', accumulate=True, workers=2)
+    np.testing.assert_allclose(total[~serial_footprint], serial[~serial_footprint] + 1., rtol=1e-6)
+
+
+def test_nan_values(field, transform):
+    frame = field.frame()
+    frame[100:103, 200:203] = np.nan
+    result, footprint = resample(frame, transform.params, kernel='bilinear', workers=1)
+    assert not np.isnan(result[~footprint]).any()
+    y, x = np.rint(transform([[201., 101.]])[0][::-1]).astype(int)
+    assert footprint[y, x]
+
+
+def test_unknown_kernel(field):
+    with pytest.raises(ValueError):
+        resample(field.frame(), np.eye(3), kernel='cubic')
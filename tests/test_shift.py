@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from skimage.transform import SimilarityTransform
+
+from SAUSERO.shift_osirisplus import find_shift, phase_correlation, shift_frame
+from SAUSERO.sources_osirisplus import extract_sources
+
+
+@pytest.mark.parametrize('dx, dy', [(7.0, -4.0), (-12.3, 5.6), (0.4, 9.5)])
+def test_shift_sign(field, dx, dy):
+    reference = field.frame()
+    # The stars of the frame are at (x + dx, y + dy).
+    image = field.frame(SimilarityTransform(translation=(dx, dy)))
+    (found_dy, found_dx), significance = phase_correlation(reference, image, border=32)
+    assert significance > 8.
+    assert abs(found_dx - dx) < 0.2 and abs(found_dy - dy) < 0.2
+
+    # The shifted frame is aligned with the reference.
+    aligned, footprint = shift_frame(image, found_dy, found_dx)
+    inside = ~footprint
+    inside[:20], inside[-20:], inside[:, :20], inside[:, -20:] = False, False, False, False
+    assert np.std((aligned - reference)[inside]) < 0.2 * np.std(reference[inside])
+
+    assert np.allclose(find_shift(image, reference, extract_sources(image), extract_sources(reference),
+                                  border=32), (found_dy, found_dx))
+
+
+def test_shift_frame_integer():
+    image = np.arange(20.).reshape(4, 5)
+    shifted, footprint = shift_frame(image, 1, 2, fill=-1.)
+    np.testing.assert_array_equal(shifted[:2, :2], image[1:3, 2:4])
+    assert footprint[-1].all() and footprint[:, -2:].all() and not footprint[:2, :2].any()
+    assert (shifted[footprint] == -1.).all()
+
+
+def test_rotation_is_rejected(field):
+    reference = field.frame()
+    centre = np.array(field.shape[::-1]) / 2.
+    rotation = (SimilarityTransform(translation=-centre) + SimilarityTransform(rotation=np.radians(1.))
+                + SimilarityTransform(translation=centre + (5., 3.)))
+    image = field.frame(rotation)
+    assert find_shift(image, reference, extract_sources(image), extract_sources(reference), border=32) is None
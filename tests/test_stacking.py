@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pytest
+
+from SAUSERO.combine_osirisplus import COMBINE_METHODS, combine, stack_frames
+from SAUSERO.stacking_osirisplus import STACK_METHODS, ScratchCube, background_variance, extremes_mask
+
+
+def aligned_frames(num=6, shape=(60, 70), seed=0):
+    """Aligned frames with different noise levels, an outlier and some pixels
+    without data (footprints)."""
+    rng = np.random.default_rng(seed)
+    frames, footprints = [], []
+    for i in range(num):
+        frames.append(rng.normal(1000., 5. + 3. * i, shape))
+        footprint = np.zeros(shape, dtype=bool)
+        footprint[:, :2 * i] = True
+        footprints.append(footprint)
+    frames[-1][30, 30] = 1e5
+    return frames, footprints
+
+
+def fill(cube_frames, footprints, tmp_path, exptimes=None):
+    cube = ScratchCube(len(cube_frames), path=tmp_path)
+    for i, (frame, footprint) in enumerate(zip(cube_frames, footprints)):
+        cube.append(frame, footprint, exptime=10. * (i + 1) if exptimes is None else exptimes[i])
+    return cube
+
+
+@pytest.mark.parametrize('method', COMBINE_METHODS)
+@pytest.mark.parametrize('memory_limit', [None, 0.05])
+def test_matches_in_memory_combine(tmp_path, method, memory_limit):
+    frames, footprints = aligned_frames()
+    expected = combine(stack_frames([np.where(fp, np.nan, fr) for fr, fp in zip(frames, footprints)]),
+                       method=method)
+    with fill(frames, footprints, tmp_path) as cube:
+        image, __, __ = cube.combine(method=method, memory_limit=memory_limit)
+    np.testing.assert_allclose(image, expected, rtol=1e-12, equal_nan=True)
+
+
+def test_weighted_mean(tmp_path):
+    frames, footprints = aligned_frames()
+    planes = stack_frames([np.where(fp, np.nan, fr) for fr, fp in zip(frames, footprints)])
+    weights = np.array([1. / background_variance(plane) for plane in planes])[:, None, None]
+    keep = ~np.isnan(planes)
+    expected = np.sum(np.where(keep, planes, 0.) * weights, axis=0) / np.sum(np.where(keep, weights, 0.), axis=0)
+    with fill(frames, footprints, tmp_path) as cube:
+        image, exposure, weight = cube.combine(method='weighted', memory_limit=0.05)
+    np.testing.assert_allclose(image, expected, rtol=1e-12)
+    np.testing.assert_allclose(weight, np.sum(np.where(keep, weights, 0.), axis=0), rtol=1e-6)
+    # The noisier frames weigh less, so the outlier is diluted.
+    assert weights[0, 0, 0] > weights[-1, 0, 0]
+    np.testing.assert_array_equal(exposure[:, -1], 210.)
+    # Only the first frame has data in the first columns.
+    np.testing.assert_array_equal(exposure[:, :2], 10.)
+
+
+def test_exposure_map_counts_kept_values(tmp_path):
+    frames, footprints = aligned_frames(num=3)
+    exptimes = [10., 20., 40.]
+    planes = stack_frames([np.where(fp, np.nan, fr) for fr, fp in zip(frames, footprints)])
+    with fill(frames, footprints, tmp_path, exptimes=exptimes) as cube:
+        __, median_exposure, __ = cube.combine(method='median')
+        __, trimmed_exposure, __ = cube.combine(method='trimmed_median')
+        __, sigclip_exposure, __ = cube.combine(method='sigclip')
+    # Three values: the median keeps all of them, trimmed_median only the middle one.
+    np.testing.assert_array_equal(median_exposure[:, -1], 70.)
+    middle = np.argsort(planes[:, :, -1], axis=0)[1]
+    np.testing.assert_array_equal(trimmed_exposure[:, -1], np.array(exptimes)[middle])
+    # Two values (the last frame has no data): nothing is rejected.
+    np.testing.assert_array_equal(trimmed_exposure[:, 2:4], 30.)
+    assert np.all(sigclip_exposure <= median_exposure)
+
+
+def test_extremes_mask():
+    cube = stack_frames(aligned_frames()[0])
+    cube[:, 5, 5] = 7.
+    cube[:3, 6, 6] = np.nan
+    keep = extremes_mask(cube)
+    with np.errstate(invalid='ignore'):
+        means = np.sum(cube, axis=0, where=keep) / np.count_nonzero(keep, axis=0)
+    np.testing.assert_allclose(means, combine(cube, method='minmax'))
+    assert np.count_nonzero(keep[:, 5, 5]) == len(cube) - 2
+    assert np.count_nonzero(keep[:, 6, 6]) == len(cube) - 5
+
+
+def test_scratch_file(tmp_path):
+    frames, footprints = aligned_frames(num=2)
+    cube = fill(frames, footprints, tmp_path)
+    assert len(os.listdir(tmp_path)) == 1
+    with pytest.raises(ValueError):
+        cube.append(frames[0])
+    with pytest.raises(ValueError):
+        cube.combine(method='mean')
+    assert 'weighted_sigclip' in STACK_METHODS
+    cube.close()
+    assert os.listdir(tmp_path) == []
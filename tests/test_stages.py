@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from SAUSERO.stages_osirisplus import Stage, StageGraph
+
+
+class Pipeline:
+    """Three stages: 'master' (an array), 'frames' (files, from the master and an
+    input file) and 'zeropoint' (a JSON value, from the frames)."""
+
+    def __init__(self, tmp_path, conf, checkpoint=False):
+        self.path = tmp_path
+        self.runs = []
+        self.memory = {}
+        self.graph = StageGraph(conf, tmp_path/'stages', version='test', checkpoint=checkpoint)
+        self.graph.add(Stage('master', self.master, config=['REDUCTION.method'],
+                             inputs=lambda: [tmp_path/'raw.fits'], restore=self.restore))
+        self.graph.add(Stage('frames', self.frames, deps=['master'], config=['REDUCTION.sky'],
+                             outputs=lambda: [tmp_path/'frame.npy']))
+        self.graph.add(Stage('zeropoint', self.zeropoint, deps=['frames'], restore=self.restore))
+
+    def restore(self, state):
+        self.memory.update(state)
+
+    def master(self):
+        self.runs.append('master')
+        self.memory['master'] = np.full((2, 2), float((self.path/'raw.fits').read_text()))
+        return {'master': self.memory['master']}
+
+    def frames(self):
+        self.runs.append('frames')
+        np.save(self.path/'frame.npy', self.memory['master'] + 1.)
+
+    def zeropoint(self):
+        self.runs.append('zeropoint')
+        self.memory['zp'] = float(np.load(self.path/'frame.npy').mean())
+        return {'zp': self.memory['zp']}
+
+
+@pytest.fixture
+def conf():
+    return {'REDUCTION': {'method': 'median', 'sky': 'global'}}
+
+
+def run(tmp_path, conf, checkpoint=False, **kwargs):
+    pipeline = Pipeline(tmp_path, conf, checkpoint=checkpoint)
+    pipeline.graph.run(**kwargs)
+    return pipeline
+
+
+def test_up_to_date_stages_are_skipped(tmp_path, conf):
+    (tmp_path/'raw.fits').write_text('1.0')
+    first = run(tmp_path, conf)
+    assert first.runs == ['master', 'frames', 'zeropoint']
+    assert first.graph.status['frames']['outputs'] == [str(tmp_path/'frame.npy')]
+
+    second = run(tmp_path, conf)
+    assert second.runs == []
+    assert all(second.graph.up_to_date(name) for name in second.graph.stages)
+    assert run(tmp_path, conf, force=True).runs == ['master', 'frames', 'zeropoint']
+
+
+def test_changes_invalidate_the_later_stages(tmp_path, conf):
+    (tmp_path/'raw.fits').write_text('1.0')
+    run(tmp_path, conf, checkpoint=True)
+
+    # A configuration key of a stage: that stage and the ones that depend on it.
+    conf['REDUCTION']['sky'] = 'window'
+    pipeline = Pipeline(tmp_path, conf, checkpoint=True)
+    assert [pipeline.graph.up_to_date(name) for name in pipeline.graph.stages] == [True, False, False]
+    pipeline.graph.run()
+    assert pipeline.runs == ['frames', 'zeropoint']
+    np.testing.assert_array_equal(pipeline.memory['master'], 1.)
+
+    # A removed product: the stage is run again, with the same fingerprint, so the
+    # stages that depend on it are still up to date.
+    (tmp_path/'frame.npy').unlink()
+    assert run(tmp_path, conf, checkpoint=True).runs == ['frames']
+
+    # A rewritten input file.
+    (tmp_path/'raw.fits').write_text('2.00')
+    pipeline = run(tmp_path, conf, checkpoint=True)
+    assert pipeline.runs == ['master', 'frames', 'zeropoint']
+    assert pipeline.memory['zp'] == 3.
+
+
+def test_results_without_checkpoints(tmp_path, conf):
+    (tmp_path/'raw.fits').write_text('1.0')
+    run(tmp_path, conf)
+    assert not (tmp_path/'stages'/'master').exists()
+    assert (tmp_path/'stages'/'zeropoint'/'state.json').exists()
+
+    # The master has no checkpoint, so it runs again for the stage that needs it.
+    conf['REDUCTION']['sky'] = 'window'
+    pipeline = Pipeline(tmp_path, conf)
+    assert pipeline.graph.up_to_date('master') and not pipeline.graph.restorable('master')
+    pipeline.graph.run()
+    assert pipeline.runs == ['master', 'frames', 'zeropoint']
+
+    # The JSON results are always kept.
+    pipeline = Pipeline(tmp_path, conf)
+    pipeline.graph.require('zeropoint')
+    assert pipeline.memory == {'zp': 2.} and pipeline.runs == []
+
+
+def test_only_one_stage(tmp_path, conf):
+    (tmp_path/'raw.fits').write_text('1.0')
+    with pytest.raises(SystemExit):
+        run(tmp_path, conf, checkpoint=True, only='frames')
+    run(tmp_path, conf, checkpoint=True)
+    pipeline = run(tmp_path, conf, checkpoint=True, only='frames')
+    assert pipeline.runs == ['frames']
+    with pytest.raises(SystemExit):
+        run(tmp_path, conf, checkpoint=True, only='sky')
+
+
+def test_unknown_dependency(tmp_path, conf):
+    graph = StageGraph(conf, tmp_path)
+    with pytest.raises(ValueError):
+        graph.add(Stage('frames', lambda: None, deps=['master']))
@@ -0,0 +1,92 @@
+import json, shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from skimage.transform import SimilarityTransform
+
+import SAUSERO
+from SAUSERO.aligning_osirisplus import StackAccumulator
+from SAUSERO.reduction_osirisplus import TRIM_COLS, TRIM_ROWS
+from SAUSERO.watch_osirisplus import NightWatcher
+from conftest import StarField
+
+RAW_SHAPE = (TRIM_ROWS[1] + 4, TRIM_COLS[1] + 4)
+OFFSETS = [(0., 0.), (9., -6.), (-7., 5.)]
+
+
+class Night:
+    """Raw frames of an OB (bias and science frames of one filter) and the
+    configuration of the watcher."""
+
+    def __init__(self, path):
+        self.path = path
+        self.raw = path/'raw'
+        self.raw.mkdir(parents=True)
+        self.field = StarField(shape=RAW_SHAPE, nstars=80, seed=1)
+        self.count = 0
+        self.bpm = path/'BPM.fits'
+        fits.PrimaryHDU(np.ones(RAW_SHAPE, dtype=np.uint8)).writeto(self.bpm)
+        with open(Path(SAUSERO.__file__).parent/'config'/'configuration.json') as file:
+            self.conf = json.load(file)
+        self.conf['DIRECTORIES'] = {'PATH': str(path), 'PATH_DATA': str(self.raw),
+                                    'PATH_OUTPUT': str(path/'reduced')}
+        self.conf['REDUCTION']['use_FLAT'] = False
+        self.conf['WATCH'] = {'poll_interval': 0.05, 'quiet_period': 0.5, 'calib_quiet': 0.}
+
+    def write(self, obsmode, data, **cards):
+        self.count += 1
+        header = fits.Header({'OBSMODE': obsmode, 'OBJECT': 'M31', 'FILTER1': 'OPEN', 'FILTER2': 'Sloan_r',
+                              'FILTER3': 'OPEN', 'FILTER4': 'OPEN', 'EXPTIME': 30., 'MJD-OBS': 60310.2,
+                              'GTCPRGID': 'GTC1-24', 'GTCOBID': '0001', **cards})
+        name = f'{self.count:010d}-20240101-OSIRIS-{obsmode}.fits'
+        fits.PrimaryHDU(np.clip(data, 0, 65535).astype(np.uint16), header=header).writeto(self.raw/name)
+
+    def bias(self):
+        self.write('OsirisBias', self.field.rng.normal(300., 4., RAW_SHAPE), OBJECT='BIAS', EXPTIME=0.)
+
+    def science(self, offset):
+        self.write('OsirisBroadBandImage', 300. + self.field.frame(SimilarityTransform(translation=offset),
+                                                                   noise=0., sky=800.))
+
+    def watch(self):
+        watcher = NightWatcher(self.conf, str(self.bpm))
+        watcher.run()
+        return watcher
+
+
+def test_restarted_watcher_extends_the_stack(tmp_path):
+    night = Night(tmp_path/'night')
+    for __ in range(2):
+        night.bias()
+    for offset in OFFSETS[:2]:
+        night.science(offset)
+    first = night.watch()
+    quicklook = tmp_path/'night'/'reduced'/'quicklook'
+    assert first.stacks['Sloan_r'].num == 2
+    assert (quicklook/'.stacks'/'Sloan_r.npz').exists()
+    reduced = {path: path.stat().st_mtime_ns for path in quicklook.glob('QL_*.fits')}
+    assert len(reduced) == 2
+
+    # A restarted watcher only reduces the new frame.
+    night.science(OFFSETS[2])
+    second = night.watch()
+    acc = second.stacks['Sloan_r']
+    assert acc.num == 3 and acc.total_exptime == 90.
+    assert all(path.stat().st_mtime_ns == mtime for path, mtime in reduced.items())
+    assert len(list(quicklook.glob('QL_*.fits'))) == 3
+    assert StackAccumulator.load(quicklook/'.stacks'/'Sloan_r.npz').num == 3
+    stack = fits.getdata(quicklook/'GTC1-24_0001_Sloan_r_quicklook.fits')
+    np.testing.assert_allclose(stack, acc.stacked())
+
+    # The same stack as a watcher that receives all the frames at once.
+    once = Night(tmp_path/'once')
+    shutil.copytree(night.raw, once.raw, dirs_exist_ok=True)
+    np.testing.assert_allclose(once.watch().stacks['Sloan_r'].stacked(), acc.stacked(), rtol=1e-9)
+
+    # Without the saved stack, the quick-look frames already reduced are stacked again.
+    shutil.rmtree(quicklook/'.stacks')
+    third = night.watch()
+    assert third.stacks['Sloan_r'].num == 3
+    assert all(path.stat().st_mtime_ns == mtime for path, mtime in reduced.items())
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from astropy.wcs import WCS
+from skimage.transform import SimilarityTransform
+
+from SAUSERO.sources_osirisplus import extract_sources
+from SAUSERO.wcs_osirisplus import find_wcs_transform, predict_transform
+
+SCALE = 0.254 / 3600.
+CENTRE = np.array([220., 200.])
+
+
+def make_wcs(transform=None, error=(0., 0.)):
+    """WCS of a frame whose pixels are the transform of the pixels of the first 
+    frame, with a pointing error (pixels)."""
+    cd = np.array([[-SCALE, 0.], [0., SCALE]])
+    crpix = CENTRE.copy()
+    if transform is not None:
+        cd = cd @ np.linalg.inv(transform.params[:2, :2])
+        crpix = transform(CENTRE[np.newaxis])[0]
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [150., 20.]
+    wcs.wcs.crpix = crpix + np.asarray(error) + 1.
+    wcs.wcs.cd = cd
+    return wcs
+
+
+@pytest.fixture
+def offset():
+    return SimilarityTransform(rotation=np.radians(0.3), translation=(14.2, -9.7))
+
+
+def test_predicted_transform(field, offset):
+    predicted = predict_transform(make_wcs(offset), make_wcs(), field.shape)
+    np.testing.assert_allclose(predicted(field.positions(offset)), field.positions(), atol=1e-3)
+    assert predict_transform(None, make_wcs(), field.shape) is None
+
+
+@pytest.mark.parametrize('error', [(0., 0.), (4., -3.)])
+def test_wcs_seeded_transform(field, offset, error):
+    reference, image = field.frame(), field.frame(offset)
+    transform = find_wcs_transform(field.shape, make_wcs(offset, error), extract_sources(image),
+                                   make_wcs(), extract_sources(reference), search_radius=10., max_residual=1.)
+    assert transform is not None
+    np.testing.assert_allclose(transform(field.positions(offset)), field.positions(), atol=0.1)
+
+
+def test_wrong_wcs_is_rejected(field, offset):
+    reference, image = field.frame(), field.frame(offset)
+    assert find_wcs_transform(field.shape, make_wcs(offset, (40., 25.)), extract_sources(image),
+                              make_wcs(), extract_sources(reference), search_radius=10.) is None